@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+bench_log_writer.py
+チャットログ書き込みのベンチマーク（同期書き込み vs log_writer）
+- 多数のルームが同時にストリーミングしている状況を模擬し、ログ書き込みがイベントループを止める時間を測る
+- 遅いディスク・NFS は --slow-ms（1回の書き込みトランザクションごとの待ち時間）で模擬
+- DB は一時ディレクトリに作成（本番の chat.sqlite3 には触れない）
+実行例（fastapi ディレクトリで）:
+    python bench/bench_log_writer.py --rooms 200 --tokens 40 --slow-ms 5
+"""
+
+import sys
+import time
+import json
+import asyncio
+import argparse
+import tempfile
+import statistics
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from routers import chat_db
+from routers import log_writer as lw
+
+def slow_write_rows(slow_ms: float):
+    original = lw.write_rows
+
+    def write(entries):
+        time.sleep(slow_ms / 1000)  # ✅ 遅いディスクを模擬（1トランザクションごと）
+        original(entries)
+    return write
+
+async def stream_room(room_id: str, tokens: int, interval: float, mode: str, writer, gaps: list):
+    """1ルーム分: 質問を書き込み → トークンを逐次送信 → 回答を書き込み"""
+    entry = {"role": "user", "content": "質問", "model": "", "timestamp": time.time()}
+    if mode == "sync":
+        lw.write_rows([(room_id, entry)])
+    else:
+        writer.submit(room_id, entry)
+
+    last = time.perf_counter()
+    for _ in range(tokens):
+        await asyncio.sleep(interval)
+        now = time.perf_counter()
+        gaps.append(now - last - interval)  # トークン間隔の遅れ
+        last = now
+
+    entry = {"role": "assistant", "content": "回答" * tokens, "model": "bench", "timestamp": time.time()}
+    if mode == "sync":
+        lw.write_rows([(room_id, entry)])
+    else:
+        writer.submit(room_id, entry)
+
+async def loop_lag_probe(stop: asyncio.Event, lags: list, period: float = 0.005):
+    """イベントループの遅れ（予定時刻からのずれ）を計測"""
+    while not stop.is_set():
+        start = time.perf_counter()
+        await asyncio.sleep(period)
+        lags.append(time.perf_counter() - start - period)
+
+async def run(mode: str, args) -> dict:
+    writer = lw.ChatLogWriter()
+    if mode == "async":
+        await writer.start()
+
+    gaps, lags = [], []
+    stop = asyncio.Event()
+    probe = asyncio.create_task(loop_lag_probe(stop, lags))
+
+    start = time.perf_counter()
+    await asyncio.gather(*(
+        stream_room(f"{mode}-{i}", args.tokens, args.interval, mode, writer, gaps)
+        for i in range(args.rooms)
+    ))
+    await writer.stop()  # 書き切るまでを含めて計測
+    elapsed = time.perf_counter() - start
+    stop.set()
+    await probe
+
+    lines = chat_db.connect().execute(
+        "SELECT COUNT(*) FROM messages WHERE room_id LIKE ?", (f"{mode}-%",)
+    ).fetchone()[0]
+    gaps.sort()
+    return {
+        "mode": mode,
+        "elapsed_s": round(elapsed, 3),
+        "rows": lines,
+        "token_delay_p50_ms": round(statistics.median(gaps) * 1000, 2),
+        "token_delay_p99_ms": round(gaps[int(len(gaps) * 0.99) - 1] * 1000, 2),
+        "loop_lag_max_ms": round(max(lags) * 1000, 2) if lags else 0.0,
+        "batches": writer.stats["batches"],
+        "writes": writer.stats["writes"],
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="チャットログ書き込みベンチマーク")
+    parser.add_argument("--rooms", type=int, default=200, help="同時ストリーミングのルーム数")
+    parser.add_argument("--tokens", type=int, default=40, help="1ルームあたりのトークン数")
+    parser.add_argument("--interval", type=float, default=0.02, help="トークン間隔（秒）")
+    parser.add_argument("--slow-ms", type=float, default=5.0, help="1回の追記ごとの模擬遅延（ms）")
+    args = parser.parse_args()
+
+    if args.slow_ms > 0:
+        lw.write_rows = slow_write_rows(args.slow_ms)
+
+    print(f"[INFO] rooms={args.rooms} tokens={args.tokens} interval={args.interval}s slow={args.slow_ms}ms")
+    with tempfile.TemporaryDirectory() as tmp:
+        chat_db.CHAT_LOGS_DIR = Path(tmp)
+        chat_db.DB_PATH = Path(tmp) / "bench.sqlite3"
+        for mode in ("sync", "async"):
+            result = asyncio.run(run(mode, args))
+            print(json.dumps(result, ensure_ascii=False))
+
+if __name__ == "__main__":
+    main()
@@ -6,11 +6,31 @@ from fastapi import FastAPI
 from fastapi.staticfiles import StaticFiles
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import FileResponse
+from contextlib import asynccontextmanager
 import os
+import asyncio
 import requests
 
+from routers.http_clients import start_clients, close_clients
+from routers.log_writer import log_writer
+from routers import chat_db
+
+# === アプリのライフサイクル（共有HTTPクライアント・チャットログ書き込みタスクの起動/停止） ===
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    await start_clients()
+    # ✅ DB の初期化・旧ログの移行は起動時にスレッドで済ませる（最初のリクエストでループを止めない）
+    await asyncio.to_thread(chat_db.connect)
+    await log_writer.start()
+    try:
+        yield
+    finally:
+        # ✅ 未書き込みのログを書き切ってから終了
+        await log_writer.stop()
+        await close_clients()
+
 # === アプリ初期化 ===
-app = FastAPI()
+app = FastAPI(lifespan=lifespan)
 
 # === CORS設定（開発用：本番は制限すべき） ===
 app.add_middleware(
@@ -32,6 +52,11 @@ from routers.voice import router as voice_router
 from routers.vector_search import router as vector_router
 from routers.model import router as model_router
 from routers.voice_transcribe import router as voice_transcribe_router
+from routers.activity import router as activity_router
+from routers.source import router as source_router
+from routers.http_clients import router as pool_router
+from routers.metrics import router as metrics_router
+from routers.answer_cache import router as answer_cache_router
 
 # === ルーター登録（prefixは各routerで定義済） ===
 app.include_router(chat_router)
@@ -41,6 +66,11 @@ app.include_router(voice_router)
 app.include_router(vector_router)
 app.include_router(model_router)
 app.include_router(voice_transcribe_router)
+app.include_router(activity_router)
+app.include_router(source_router)
+app.include_router(pool_router)
+app.include_router(metrics_router)
+app.include_router(answer_cache_router)
 
 # === トップページ（開発中は http://localhost:8000/ で表示） ===
 @app.get("/", response_class=FileResponse)
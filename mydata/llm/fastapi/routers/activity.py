@@ -0,0 +1,54 @@
+import os
+import json
+import time
+import logging
+from pathlib import Path
+from fastapi import APIRouter
+
+router = APIRouter(prefix="/v1/chat")
+
+# === チャット稼働状況ファイル（vectorコンテナの取り込み処理が参照する） ===
+#   /mydata はfastapi・vector両コンテナで共有マウントされている前提
+ACTIVITY_FILE = Path(os.getenv("CHAT_ACTIVITY_FILE", "/mydata/llm/fastapi/chat_logs/chat_activity.json"))
+
+_inflight = 0
+_last_change = 0.0
+
+def _write_activity_file():
+    """稼働状況をアトミックに書き出す（小さいJSONのみ）"""
+    try:
+        ACTIVITY_FILE.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = ACTIVITY_FILE.with_suffix(ACTIVITY_FILE.suffix + ".tmp")
+        with tmp_path.open("w", encoding="utf-8") as f:
+            json.dump({"inflight": _inflight, "updated": _last_change}, f)
+        os.replace(tmp_path, ACTIVITY_FILE)
+    except Exception as e:
+        logging.warning(f"[ACTIVITY] 稼働状況ファイル書き込み失敗: {e}")
+
+def chat_started():
+    """/v1/chat/completions の処理開始時に呼ぶ"""
+    global _inflight, _last_change
+    _inflight += 1
+    _last_change = time.time()
+    _write_activity_file()
+
+def chat_finished():
+    """/v1/chat/completions の処理終了時（ストリーム終了・エラー含む）に必ず呼ぶ"""
+    global _inflight, _last_change
+    _inflight = max(0, _inflight - 1)
+    _last_change = time.time()
+    _write_activity_file()
+
+# 起動時は稼働なしとして初期化（前回プロセスが処理中に落ちた場合の残骸を消す）
+_write_activity_file()
+
+def get_inflight() -> int:
+    return _inflight
+
+@router.get("/activity")
+def get_activity():
+    return {
+        "success": True,
+        "data": {"inflight": _inflight, "updated": _last_change},
+        "error": None
+    }
@@ -0,0 +1,155 @@
+from fastapi import APIRouter
+from typing import List, Optional
+import os
+import time
+import logging
+import threading
+import numpy as np
+
+router = APIRouter(prefix="/v1/chat/cache")
+
+# === 回答キャッシュ（言い回しが違うだけの同じ質問には、過去の回答をそのまま返す） ===
+# ✅ 質問の埋め込み（vector サービスの /embed、正規化済み）のコサイン類似度で照合
+# ✅ スコープ（プロンプトID・プロンプトファイルの更新時刻・モデル名）が一致するものだけ使う
+# ✅ ベクトルインデックスの版（登録・削除スクリプトが更新）が新しくなったら全件破棄
+#    エントリにも版を持たせ、古い版を読んだまま遅れて届いた登録・照合は捨てる（版は巻き戻さない）
+# ✅ TTL 切れ・件数上限（古いものから）で破棄。DELETE /v1/chat/cache で明示的に破棄
+# ✅ 対象は履歴に依存しない単独の質問のみ（続きの質問は同じ文面でも答えが変わるため）
+
+ANSWER_CACHE_ENABLED = os.getenv("ANSWER_CACHE_ENABLED", "1") == "1"
+ANSWER_CACHE_THRESHOLD = float(os.getenv("ANSWER_CACHE_THRESHOLD", "0.97"))
+ANSWER_CACHE_TTL = int(os.getenv("ANSWER_CACHE_TTL", "86400"))               # 秒
+ANSWER_CACHE_MAX_ENTRIES = int(os.getenv("ANSWER_CACHE_MAX_ENTRIES", "512"))
+ANSWER_CACHE_MIN_CHARS = int(os.getenv("ANSWER_CACHE_MIN_CHARS", "8"))      # これより短い質問は対象外
+
+_lock = threading.Lock()
+_entries: List[dict] = []            # 古い順
+_matrix: Optional[np.ndarray] = None  # _entries の埋め込みを積んだ行列（照合用。追加・削除で作り直す）
+_index_version: Optional[str] = None
+_stats = {"hits": 0, "misses": 0, "stores": 0, "stale_stores": 0, "bypassed": 0, "expired": 0, "invalidations": 0}
+
+def is_cacheable(question: str) -> bool:
+    return ANSWER_CACHE_ENABLED and len(question.strip()) >= ANSWER_CACHE_MIN_CHARS
+
+def record_bypass():
+    _stats["bypassed"] += 1
+
+def _rebuild():
+    global _matrix
+    _matrix = np.vstack([e["embedding"] for e in _entries]) if _entries else None
+
+def _expire(now: float):
+    """TTL 切れを破棄（呼び出し側でロック取得済み）"""
+    alive = [e for e in _entries if now - e["created"] < ANSWER_CACHE_TTL]
+    if len(alive) != len(_entries):
+        _stats["expired"] += len(_entries) - len(alive)
+        _entries[:] = alive
+        _rebuild()
+
+def _version_key(index_version: str) -> int:
+    """版番号（bump_index_version のナノ秒時刻）を比較用の整数に"""
+    try:
+        return int(index_version)
+    except (TypeError, ValueError):
+        return 0
+
+def _check_index_version(index_version: str) -> bool:
+    """
+    インデックス版が新しくなっていれば全件破棄して進める（呼び出し側でロック取得済み）
+    戻り値: index_version が現在の版か（False なら版更新前に読んだ古い要求）
+    """
+    global _index_version
+    if _index_version is None:
+        _index_version = index_version
+    elif _version_key(index_version) > _version_key(_index_version):
+        logging.info(f"[CACHE] インデックス更新を検知（{_index_version} → {index_version}）: {len(_entries)}件を破棄")
+        _entries.clear()
+        _rebuild()
+        _stats["invalidations"] += 1
+        _index_version = index_version
+    return index_version == _index_version
+
+def lookup(embedding: List[float], index_version: str, scope: str) -> Optional[dict]:
+    """類似度が閾値以上で、スコープが一致する最も近い回答を返す（なければ None）"""
+    query = np.asarray(embedding, dtype=np.float32)
+    now = time.time()
+    with _lock:
+        current = _check_index_version(index_version)
+        _expire(now)
+        if not current or _matrix is None or _matrix.shape[1] != query.shape[0]:
+            _stats["misses"] += 1
+            return None
+        scores = _matrix @ query
+        for i in np.argsort(-scores):
+            if scores[i] < ANSWER_CACHE_THRESHOLD:
+                break
+            entry = _entries[i]
+            if entry["scope"] == scope and entry["index_version"] == index_version:
+                entry["hits"] += 1
+                _stats["hits"] += 1
+                logging.info(
+                    f"[CACHE] ヒット: 類似度 {scores[i]:.4f} 「{entry['question'][:40]}」"
+                )
+                return {**entry, "score": float(scores[i])}
+        _stats["misses"] += 1
+        return None
+
+def store(embedding: List[float], index_version: str, scope: str, question: str, answer: str,
+          sources: Optional[List[dict]] = None):
+    """回答を登録（出典も併せて保持し、リプレイ時に送る。上限を超えた分は古い順に破棄）"""
+    if not answer.strip():
+        return
+    with _lock:
+        if not _check_index_version(index_version):
+            # ✅ 生成中にインデックスが更新された回答は登録しない（新しい版のエントリは消さない）
+            _stats["stale_stores"] += 1
+            logging.info(f"[CACHE] 古い版の回答は登録しない（{index_version} < {_index_version}）")
+            return
+        _entries.append({
+            "embedding": np.asarray(embedding, dtype=np.float32),
+            "index_version": index_version,
+            "scope": scope,
+            "question": question,
+            "answer": answer,
+            "sources": sources or [],
+            "created": time.time(),
+            "hits": 0,
+        })
+        del _entries[:max(len(_entries) - ANSWER_CACHE_MAX_ENTRIES, 0)]
+        _rebuild()
+        _stats["stores"] += 1
+
+def invalidate(reason: str = "") -> int:
+    with _lock:
+        count = len(_entries)
+        _entries.clear()
+        _rebuild()
+        _stats["invalidations"] += 1
+    logging.info(f"[CACHE] 全件破棄: {count}件 {reason}")
+    return count
+
+@router.get("/stats")
+def get_cache_stats():
+    with _lock:
+        entries = [
+            {"question": e["question"][:80], "scope": e["scope"], "hits": e["hits"],
+             "age_sec": round(time.time() - e["created"], 1)}
+            for e in _entries
+        ]
+    return {
+        "success": True,
+        "data": {
+            **_stats,
+            "enabled": ANSWER_CACHE_ENABLED,
+            "threshold": ANSWER_CACHE_THRESHOLD,
+            "ttl_sec": ANSWER_CACHE_TTL,
+            "index_version": _index_version,
+            "size": len(entries),
+            "entries": entries,
+        },
+        "error": None,
+    }
+
+@router.delete("")
+def clear_cache():
+    return {"success": True, "data": {"deleted": invalidate("(API)")}, "error": None}
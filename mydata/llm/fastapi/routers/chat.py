@@ -1,23 +1,50 @@
 import os
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, HTTPException, Request
 import asyncio
 from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
-from typing import List
+from typing import List, Optional
 import json
-import httpx
 import logging
+import zlib
+import time
 from pathlib import Path
+from typing import Tuple
 
 from .chat_room import save_streamed_message
+from .activity import chat_started, chat_finished
+from .http_clients import get_client
+from .keywords import extract_keywords, rerank_with_keywords
+from .context_packer import context_budget, pack_context, PDF_WORD_SOURCES, EXCEL_CALENDAR_SOURCES
+from .metrics import record_prompt_cache, record_completion, record_abort
+from .history import build_history, schedule_summary
+from . import answer_cache
 
 router = APIRouter(prefix="/v1/chat")
 logging.basicConfig(level=logging.INFO)
 
 LLM_HOST = os.getenv("LLM_HOST", "http://llama:8000")
 VECTOR_API_URL = os.getenv("VECTOR_API_URL", "http://vector:8000/embed_search")
+VECTOR_EMBED_URL = os.getenv("VECTOR_EMBED_URL", VECTOR_API_URL.rsplit("/", 1)[0] + "/embed")
+
+# キーワード抽出モード
+#   local: 辞書＋字種分割のローカル抽出のみ（既定。LLMへの往復なし）
+#   llm:   ローカル抽出で検索しつつ、LLM抽出を並行実行して結果を再補正
+#   off:   キーワード補正なし
+KEYWORD_MODE = os.getenv("KEYWORD_MODE", "local")
 
 PROMPT_DIR = Path("/mydata/llm/fastapi/config/prompts")
+CONTEXT_PLACEHOLDER = "{context_text}"
+DEFAULT_CONTEXT_HEADING = "【RAGチャンク】"
+
+# llama.cpp のスロット数（llama 側の --parallel と合わせる）。ルームごとに同じスロットへ送り KV キャッシュを再利用する
+LLAMA_SLOTS = int(os.getenv("LLAMA_SLOTS", "1"))
+
+# 回答キャッシュのリプレイ時に1チャンクで送る文字数
+CACHE_REPLAY_CHARS = 32
+
+# クライアント切断の確認間隔（秒）。切断から llama.cpp の生成停止までの最大遅れ
+DISCONNECT_POLL_SEC = float(os.getenv("DISCONNECT_POLL_SEC", "0.5"))
 
 class Message(BaseModel):
     role: str
@@ -35,6 +62,7 @@ class CompletionRequest(BaseModel):
     style_id: int = 0
     room_id: str = ""
     prompt_id: str = "rag_default"
+    no_cache: bool = False  # True: 回答キャッシュを使わず必ず生成する（登録もしない）
 
 async def extract_keywords_llm(query: str, model_name: str) -> List[str]:
     try:
@@ -55,46 +83,124 @@ async def extract_keywords_llm(query: str, model_name: str) -> List[str]:
                 {"role": "user", "content": query}
             ]
         }
-        async with httpx.AsyncClient(timeout=20.0) as client:
-            res = await client.post(f"{LLM_HOST}/v1/chat/completions", json=payload)
-            res.raise_for_status()
-            content = res.json()["choices"][0]["message"]["content"]
-            keywords = json.loads(content)
-            logging.info(f"[INFO] 抽出キーワード: {keywords}")
-            return keywords if isinstance(keywords, list) else []
+        client = get_client("llama")
+        res = await client.post(f"{LLM_HOST}/v1/chat/completions", json=payload, timeout=20.0)
+        res.raise_for_status()
+        content = res.json()["choices"][0]["message"]["content"]
+        keywords = json.loads(content)
+        logging.info(f"[INFO] 抽出キーワード: {keywords}")
+        return keywords if isinstance(keywords, list) else []
     except Exception as e:
         logging.warning(f"[WARN] キーワード抽出失敗: {e}")
         return []
 
-async def vector_search_with_keywords(query: str, keywords: List[str], top_k: int = 50, threshold: float = 0.5, limit: int = 50):
+async def embed_query(query: str) -> Tuple[Optional[List[float]], str]:
+    """質問の埋め込みとインデックス版を取得（失敗時は (None, "")。検索・回答キャッシュで共用）"""
+    try:
+        res = await get_client("vector").post(VECTOR_EMBED_URL, json={"texts": [query]})
+        res.raise_for_status()
+        data = res.json().get("data") or {}
+        return data["embeddings"][0], str(data.get("index_version", ""))
+    except Exception as e:
+        logging.warning(f"[WARN] 質問の埋め込み取得失敗: {e}")
+        return None, ""
+
+async def vector_search_with_keywords(query: str, keywords: List[str], top_k: int = 50, threshold: float = 0.5, limit: int = 50,
+                                      embedding: Optional[List[float]] = None):
     try:
         logging.info(f"ベクトル検索開始: {query} (keywords={keywords})")
-        async with httpx.AsyncClient(timeout=30.0) as client:
-            res = await client.post(VECTOR_API_URL, json={
-                "query": query,
-                "keywords": keywords,
-                "top_k": top_k,
-                "threshold": threshold
-            })
-            res.raise_for_status()
-            chunks = res.json().get("data", [])
-            logging.info(f"[DEBUG] ベクトル検索件数: {len(chunks)}")
-            return chunks[:limit] if isinstance(chunks, list) else []
+        client = get_client("vector")
+        body = {
+            "query": query,
+            "keywords": keywords,
+            "top_k": top_k,
+            "threshold": threshold
+        }
+        if embedding is not None:
+            body["embedding"] = embedding
+        res = await client.post(VECTOR_API_URL, json=body)
+        res.raise_for_status()
+        chunks = res.json().get("data", [])
+        logging.info(f"[DEBUG] ベクトル検索件数: {len(chunks)}")
+        return chunks[:limit] if isinstance(chunks, list) else []
     except Exception as e:
         logging.error(f"[vector_search error]: {e}")
         return []
 
-def load_prompt_text(prompt_id: str, context_text: str = "") -> str:
+async def retrieve_chunks(query: str, model_name: str, top_k: int = 50, threshold: float = 0.5,
+                          embedding: Optional[List[float]] = None):
+    """キーワード抽出＋ベクトル検索（LLM抽出は検索の前ではなく検索と並行して走らせる）"""
+    keywords = extract_keywords(query) if KEYWORD_MODE != "off" else []
+    logging.info(f"[INFO] ローカル抽出キーワード: {keywords} (mode={KEYWORD_MODE})")
+    if KEYWORD_MODE != "llm":
+        return await vector_search_with_keywords(query, keywords, top_k=top_k, threshold=threshold, embedding=embedding)
+
+    llm_task = asyncio.create_task(extract_keywords_llm(query, model_name))
+    chunks = await vector_search_with_keywords(query, keywords, top_k=top_k, threshold=threshold, embedding=embedding)
+    llm_keywords = await llm_task
+    extra = [k for k in llm_keywords if isinstance(k, str) and k and k not in keywords]
+    return rerank_with_keywords(chunks, extra)
+
+def prompt_path(prompt_id: str) -> Path:
     file_path = PROMPT_DIR / f"{prompt_id}.txt"
     if not file_path.exists():
         logging.warning(f"[PROMPT] {prompt_id}.txt が見つからないため rag_default を使用します")
         file_path = PROMPT_DIR / "rag_default.txt"
+    return file_path
+
+def load_prompt_text(prompt_id: str, context_text: str = "") -> str:
+    file_path = prompt_path(prompt_id)
     lines = file_path.read_text(encoding="utf-8").splitlines()
     prompt_body = "\n".join(lines[1:]) if len(lines) > 1 else "\n".join(lines)
-    return prompt_body.replace("{context_text}", context_text)
+    return prompt_body.replace(CONTEXT_PLACEHOLDER, context_text)
+
+def load_prompt_parts(prompt_id: str) -> Tuple[str, str]:
+    """
+    プロンプトを (固定のシステムプロンプト, 参考情報の見出し) に分ける
+    ✅ ターンごとに変わる参考情報をシステムプロンプトから外し、最新の質問の直前に置く
+       → システムプロンプト＋履歴が毎ターン同じ先頭列になり、llama.cpp の KV キャッシュを再利用できる
+    """
+    body = load_prompt_text(prompt_id, CONTEXT_PLACEHOLDER)
+    if CONTEXT_PLACEHOLDER not in body:
+        return body.strip(), DEFAULT_CONTEXT_HEADING
+    before, after = body.split(CONTEXT_PLACEHOLDER, 1)
+    lines = before.rstrip().splitlines()
+    heading = DEFAULT_CONTEXT_HEADING
+    # プレースホルダー直前の見出し行（【RAGチャンク】等）は参考情報側へ移す
+    if lines and lines[-1].strip().startswith("【"):
+        heading = lines.pop().strip()
+    static = "\n".join(lines).rstrip()
+    if after.strip():
+        static += "\n\n" + after.strip()
+    static += f"\n\n※ {heading}は、ユーザーの最新の質問の直前に示します。"
+    return static, heading
+
+def cache_scope(prompt_id: str, model: str) -> str:
+    """回答キャッシュのスコープ（プロンプトの編集・モデルの切り替えで別物として扱う）"""
+    file_path = prompt_path(prompt_id)
+    return f"{file_path.stem}:{file_path.stat().st_mtime_ns}:{model}"
+
+def iter_replay(answer: str, model: str):
+    """キャッシュ済みの回答を llama.cpp と同じ SSE 形式で一気に流す"""
+    for i in range(0, len(answer), CACHE_REPLAY_CHARS):
+        chunk = {
+            "object": "chat.completion.chunk",
+            "model": model,
+            "choices": [{"index": 0, "delta": {"content": answer[i:i + CACHE_REPLAY_CHARS]}}],
+        }
+        yield f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n"
+    yield "data: [DONE]\n\n"
+
+def slot_for_room(room_id: str) -> int:
+    """ルームごとに固定のスロット番号（ルームなしは -1=空きスロット任せ）"""
+    if LLAMA_SLOTS <= 1:
+        return 0
+    if not room_id:
+        return -1
+    return zlib.crc32(room_id.encode("utf-8")) % LLAMA_SLOTS
 
 @router.post("/completions")
-async def completions(req: CompletionRequest):
+async def completions(req: CompletionRequest, request: Request):
     user_message = next((m.content for m in reversed(req.messages) if m.role == "user"), None)
     if not user_message:
         raise HTTPException(status_code=400, detail="No user message found")
@@ -103,20 +209,31 @@ async def completions(req: CompletionRequest):
     if req.room_id and user_message:
         save_streamed_message(req.room_id, role="user", content=user_message, model="")
 
-    keywords = await extract_keywords_llm(user_message, req.model)
-    retrieved_chunks = await vector_search_with_keywords(user_message, keywords, top_k=50, threshold=0.5)
-
-    pdf_word_texts, excel_calendar_texts = [], []
-    for c in retrieved_chunks:
-        targets = c if isinstance(c, list) else [c]
-        for sub in targets:
-            if isinstance(sub, dict) and isinstance(sub.get("text"), str):
-                src = sub.get("source") or sub.get("type", "")
-                file_info = f"[ファイル]: {sub.get('absolute_path', sub.get('path', '不明'))}"
-                if src in {"pdf", "word"}:
-                    pdf_word_texts.append(f"{file_info}\n{sub['text'].strip()}")
-                elif src in {"excel", "calendar"}:
-                    excel_calendar_texts.append(f"{file_info}\n{sub['text'].strip()}")
+    # ✅ 検索・プリフィルを待たずにストリームを開始（進捗と出典を先に送る）
+    return StreamingResponse(
+        iter_completion(req, user_message, request),
+        media_type="text/event-stream",
+        headers={"Transfer-Encoding": "chunked"}
+    )
+
+def sse_event(obj: str, **fields) -> str:
+    """
+    RAG の進捗イベント（data 行の JSON。choices を持たないため、トークンとして表示されない）
+    - rag.status: status = retrieving / generating / cached / error
+    - rag.sources: sources = 採用した参考情報の一覧
+    """
+    return f"data: {json.dumps({'object': obj, **fields}, ensure_ascii=False)}\n\n"
+
+def source_list(packed: List[dict]) -> List[dict]:
+    """プロンプトに採用した参考情報の出典（検索順位順）"""
+    return [
+        {"rank": e["rank"], "source": e["source"], "path": e["path"], "tokens": e.get("tokens"), **e.get("meta", {})}
+        for e in packed
+    ]
+
+def build_context_text(packed: List[dict], user_message: str) -> str:
+    pdf_word_texts = [e["text"] for e in packed if e["source"] in PDF_WORD_SOURCES]
+    excel_calendar_texts = [e["text"] for e in packed if e["source"] in EXCEL_CALENDAR_SOURCES]
 
     if pdf_word_texts or excel_calendar_texts:
         context_parts = []
@@ -124,78 +241,211 @@ async def completions(req: CompletionRequest):
             context_parts.append("[PDF/Wordの参考情報]\n" + "\n\n".join(pdf_word_texts))
         if excel_calendar_texts:
             context_parts.append("[Excel/カレンダーの参考情報]\n" + "\n\n".join(excel_calendar_texts))
-        context_text = "\n\n".join(context_parts)
-    else:
-        context_text = (
-            "関連情報が見つかりませんでした。\n"
-            f"以下のテーマについて一般的な知見に基づき回答してください。\n"
-            f"テーマ: {user_message}"
+        return "\n\n".join(context_parts)
+    return (
+        "関連情報が見つかりませんでした。\n"
+        f"以下のテーマについて一般的な知見に基づき回答してください。\n"
+        f"テーマ: {user_message}"
+    )
+
+class ClientDisconnected(Exception):
+    """クライアントが切断した（上流への処理を打ち切る）"""
+
+async def watch_disconnect(request: Request) -> float:
+    """クライアントの切断を待つ（タブを閉じた・停止した場合）。戻り値は検知時刻"""
+    while not await request.is_disconnected():
+        await asyncio.sleep(DISCONNECT_POLL_SEC)
+    return time.monotonic()
+
+async def until_disconnect(aw, watcher: asyncio.Task):
+    """
+    aw の完了を待つ。先にクライアントが切断したら aw を取り消して ClientDisconnected
+    ✅ httpx の送受信を取り消すと接続が閉じられ、llama.cpp 側も生成を止める
+    """
+    task = asyncio.ensure_future(aw)
+    try:
+        done, _ = await asyncio.wait({task, watcher}, return_when=asyncio.FIRST_COMPLETED)
+    except BaseException:
+        # ストリーム自体が取り消された場合も待機中の送受信を残さない
+        task.cancel()
+        raise
+    if task in done:
+        return task.result()
+    task.cancel()
+    try:
+        await task
+    except BaseException:
+        pass
+    raise ClientDisconnected()
+
+async def iter_completion(req: CompletionRequest, user_message: str, request: Request):
+    """
+    検索 → 出典の送信 → LLM の応答を中継（ストリーム開始後のエラーは rag.status=error で通知）
+    ✅ クライアントが切断したら、その時点で llama.cpp へのリクエストを閉じて生成を止める
+    ✅ 回答（途中まででも）はターンごとに1回だけ書き込む
+    """
+    response = None
+    buffer = []
+    phase = "retrieving"
+    completed = saved = client_gone = False
+    disconnected_at = 0.0
+    watcher = asyncio.create_task(watch_disconnect(request))
+    try:
+        # ✅ 取り込みパイプラインへの稼働シグナル（finally の chat_finished と必ず対にする。
+        #    最初の反復前に切断されるとジェネレータ本体は実行されないため、ここで開始する）
+        chat_started()
+        yield sse_event("rag.status", status="retrieving")
+
+        system_prompt, context_heading = load_prompt_parts(req.prompt_id)
+        if req.room_id:
+            # ✅ ルームの履歴は直近の窓＋それより前の要約（ログが伸び続けてもコンテキストに収める）
+            summary, history = await asyncio.to_thread(build_history, req.room_id, user_message)
+            history.append({"role": "user", "content": user_message})
+            if summary:
+                system_prompt += f"\n\n【これまでの会話の要約】\n{summary}"
+        else:
+            summary = ""
+            history = [{"role": m.role, "content": m.content} for m in req.messages if m.content.strip()]
+
+        # ✅ 回答キャッシュ（履歴に依存しない単独の質問のみ。埋め込みはベクトル検索でもそのまま使う）
+        embedding, index_version, scope = None, "", ""
+        standalone = not summary and [m["role"] for m in history] == ["user"]
+        if req.no_cache:
+            answer_cache.record_bypass()
+        elif standalone and answer_cache.is_cacheable(user_message):
+            embedding, index_version = await embed_query(user_message)
+            if embedding is not None:
+                scope = cache_scope(req.prompt_id, req.model)
+                hit = answer_cache.lookup(embedding, index_version, scope)
+                if hit:
+                    yield sse_event("rag.sources", sources=hit.get("sources") or [])
+                    yield sse_event("rag.status", status="cached")
+                    for line in iter_replay(hit["answer"], req.model):
+                        yield line
+                    buffer.append(hit["answer"])
+                    completed = True
+                    return
+
+        retrieved_chunks = await until_disconnect(
+            retrieve_chunks(user_message, req.model, top_k=50, threshold=0.5, embedding=embedding), watcher
         )
 
-    logging.info(f"[DEBUG] RAGプロンプト先頭500文字:\n{context_text[:500]}")
-
-    system_prompt = load_prompt_text(req.prompt_id, context_text)
-    prompt_messages = [
-        {"role": "system", "content": system_prompt},
-        *[{"role": m.role, "content": m.content} for m in req.messages if m.content.strip()]
-    ]
-
-    payload = {
-        "model": req.model,
-        "messages": prompt_messages,
-        "stream": True
-    }
+        # ✅ 参考情報はトークン予算内に収める（システムプロンプト・履歴・回答分を差し引いた残り）
+        budget = await context_budget(system_prompt, history)
+        packed = await pack_context(retrieved_chunks, budget)
+        sources = source_list(packed)
+        # ✅ プリフィル中に出典を表示できるよう、最初のトークンより前に送る
+        yield sse_event("rag.sources", sources=sources)
+
+        context_text = build_context_text(packed, user_message)
+        logging.info(f"[DEBUG] RAGプロンプト先頭500文字:\n{context_text[:500]}")
+
+        # ✅ 並び: 固定のシステムプロンプト → 履歴 → 参考情報＋最新の質問（変わるのは末尾だけ）
+        last_user = max((i for i, m in enumerate(history) if m["role"] == "user"), default=None)
+        if last_user is None:
+            history.append({"role": "user", "content": user_message})
+            last_user = len(history) - 1
+        prompt_messages = [
+            {"role": "system", "content": system_prompt},
+            *history[:last_user],
+            {
+                "role": "user",
+                "content": f"{context_heading}\n{context_text}\n\n【質問】\n{history[last_user]['content']}",
+            },
+            *history[last_user + 1:],
+        ]
+
+        slot = slot_for_room(req.room_id)
+        payload = {
+            "model": req.model,
+            "messages": prompt_messages,
+            "stream": True,
+            "cache_prompt": True,
+            "id_slot": slot,
+        }
 
-    try:
-        async with httpx.AsyncClient(timeout=None) as client:
-            response = await client.post(f"{LLM_HOST}/v1/chat/completions", json=payload)
-            if not response.is_success:
-                raise HTTPException(status_code=response.status_code, detail=f"LLM error: {response.text}")
-
-            async def iter_response():
-                buffer = []
-                try:
-                    async for chunk in response.aiter_text():
-                        try:
-                            clean = chunk.replace("data: ", "").strip()
-                            if clean and clean != "[DONE]":
-                                data = json.loads(clean)
-                                delta = data.get("choices", [{}])[0].get("delta", {})
-                                text_piece = delta.get("content", "")
-                                if text_piece:
-                                    buffer.append(text_piece)
-                            elif clean == "[DONE]":
-                                # ✅ DONE受信時点で書き込み
-                                full_text = "".join(buffer).strip()
-                                if req.room_id and full_text:
-                                    save_streamed_message(
-                                        req.room_id, role="assistant", content=full_text, model=req.model
-                                    )
-                        except Exception:
-                            pass
-
-                        yield chunk
-                        await asyncio.sleep(0)
-                finally:
-                    # ✅ DONEが来なかった場合も終了時に必ず書き込む
-                    if req.room_id and buffer:
-                        full_text = "".join(buffer).strip()
+        yield sse_event("rag.status", status="generating")
+
+        # ✅ 共有クライアントでストリーム受信（応答全体を待たずに逐次中継する）
+        phase = "prefill"
+        client = get_client("llama")
+        upstream = client.build_request("POST", f"{LLM_HOST}/v1/chat/completions", json=payload)
+        response = await until_disconnect(client.send(upstream, stream=True), watcher)
+        if not response.is_success:
+            detail = (await response.aread()).decode("utf-8", errors="replace")
+            logging.error(f"[COMPLETIONS ERROR]: LLM status {response.status_code}: {detail[:500]}")
+            yield sse_event("rag.status", status="error", code=response.status_code, detail=f"LLM error: {detail}")
+            return
+
+        # ✅ SSE は行単位で解釈（TCPチャンク境界で data 行が分割されても取りこぼさない）
+        lines = response.aiter_lines()
+        while True:
+            try:
+                line = await until_disconnect(lines.__anext__(), watcher)
+            except StopAsyncIteration:
+                break
+            try:
+                clean = line.replace("data: ", "").strip()
+                if clean and clean != "[DONE]":
+                    data = json.loads(clean)
+                    delta = data.get("choices", [{}])[0].get("delta", {})
+                    text_piece = delta.get("content", "")
+                    if text_piece:
+                        phase = "generating"
+                        buffer.append(text_piece)
+                    if data.get("timings"):
+                        # ✅ 最終チャンクの timings からプリフィル量・キャッシュ再利用量を記録
+                        record_prompt_cache(req.room_id, slot, data["timings"])
+                        record_completion(data["timings"])
+                elif clean == "[DONE]":
+                    # ✅ DONE受信時点で書き込み
+                    completed = True
+                    full_text = "".join(buffer).strip()
+                    if req.room_id and full_text:
                         save_streamed_message(
                             req.room_id, role="assistant", content=full_text, model=req.model
                         )
-
-            return StreamingResponse(
-                iter_response(),
-                media_type="text/event-stream",
-                headers={"Transfer-Encoding": "chunked"}
-            )
-    except httpx.HTTPStatusError as e:
-        raise HTTPException(status_code=e.response.status_code, detail=f"LLM error: {e.response.text}")
+                        saved = True
+                    # ✅ 最後まで生成できた回答のみキャッシュへ登録
+                    if scope and full_text:
+                        answer_cache.store(embedding, index_version, scope, user_message, full_text, sources)
+            except Exception:
+                pass
+
+            yield f"{line}\n"
+            await asyncio.sleep(0)
+    except ClientDisconnected:
+        client_gone = True
+        disconnected_at = watcher.result()
+        logging.info(f"[INFO] クライアント切断を検知（{phase}）: 上流のリクエストを中止します")
+    except (asyncio.CancelledError, GeneratorExit):
+        # ✅ サーバー側でストリームが取り消された（送信失敗等）場合も切断として扱う
+        client_gone = True
+        disconnected_at = time.monotonic()
+        raise
     except Exception as e:
         import traceback
         logging.error(f"[COMPLETIONS ERROR]: {e}")
         traceback.print_exc()
-        raise HTTPException(status_code=500, detail=f"Unexpected error: {str(e)}")
+        yield sse_event("rag.status", status="error", code=500, detail=f"Unexpected error: {str(e)}")
+    finally:
+        watcher.cancel()
+        # ✅ 接続をプールへ返却（生成途中なら接続ごと閉じる → llama.cpp が生成を打ち切る）
+        if response is not None:
+            await response.aclose()
+        if client_gone and not completed:
+            record_abort(req.room_id, phase, len(buffer), (time.monotonic() - disconnected_at) * 1000)
+        # ✅ DONEが来なかった場合（切断・上流の異常終了）も、途中までの回答を1回だけ書き込む
+        if req.room_id and buffer and not saved:
+            full_text = "".join(buffer).strip()
+            if full_text:
+                save_streamed_message(
+                    req.room_id, role="assistant", content=full_text, model=req.model
+                )
+        chat_finished()
+        # ✅ 履歴の窓がずれていれば要約をバックグラウンドで作り直す（応答の送信後）
+        if req.room_id:
+            schedule_summary(req.room_id, req.model)
 
 @router.get("/prompt/list")
 async def list_prompts():
@@ -0,0 +1,241 @@
+import os
+import json
+import sqlite3
+import logging
+import threading
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+# === ルーム・メッセージの SQLite ストア ===
+# ✅ WAL モード（読み込みと書き込みが互いに待たない）
+# ✅ メッセージは (room_id, id) 索引でページ単位に取得（ルームのログ全体を読まない）
+# ✅ 過去の会話は FTS5 で全文検索（日本語は分かち書き不要の trigram。使えない環境は unicode61）
+# ✅ 初回起動時に rooms.json と {room_id}.jsonl から一括移行（元ファイルはそのまま残す）
+
+CHAT_LOGS_DIR = Path("/mydata/llm/fastapi/chat_logs")
+DB_PATH = Path(os.getenv("CHAT_DB_PATH", str(CHAT_LOGS_DIR / "chat.sqlite3")))
+SYNCHRONOUS = "FULL" if os.getenv("CHAT_LOG_FSYNC", "0") == "1" else "NORMAL"
+
+MIN_TRIGRAM_QUERY = 3  # trigram は3文字未満を検索できないため LIKE にフォールバック
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+CREATE TABLE IF NOT EXISTS rooms (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    id TEXT UNIQUE NOT NULL,
+    name TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS messages (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    room_id TEXT NOT NULL,
+    role TEXT NOT NULL,
+    content TEXT NOT NULL,
+    model TEXT NOT NULL DEFAULT '',
+    timestamp TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_messages_room ON messages (room_id, id);
+"""
+
+FTS_TRIGGERS = """
+CREATE TRIGGER IF NOT EXISTS messages_ai AFTER INSERT ON messages BEGIN
+    INSERT INTO messages_fts (rowid, content) VALUES (new.id, new.content);
+END;
+CREATE TRIGGER IF NOT EXISTS messages_ad AFTER DELETE ON messages BEGIN
+    INSERT INTO messages_fts (messages_fts, rowid, content) VALUES ('delete', old.id, old.content);
+END;
+"""
+
+_local = threading.local()
+_init_lock = threading.Lock()
+_initialized_path: Optional[Path] = None
+
+def connect() -> sqlite3.Connection:
+    """スレッドごとに1接続（エンドポイントのスレッドプール・ログ書き込みスレッドから共用）"""
+    conn = getattr(_local, "conn", None)
+    if conn is None or getattr(_local, "path", None) != DB_PATH:
+        DB_PATH.parent.mkdir(parents=True, exist_ok=True)
+        conn = sqlite3.connect(DB_PATH, timeout=30, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute(f"PRAGMA synchronous={SYNCHRONOUS}")
+        _local.conn, _local.path = conn, DB_PATH
+    init_db(conn)
+    return conn
+
+def init_db(conn: sqlite3.Connection):
+    """スキーマ作成と旧ファイルからの移行（プロセスで1回）"""
+    global _initialized_path
+    if _initialized_path == DB_PATH:
+        return
+    with _init_lock:
+        if _initialized_path == DB_PATH:
+            return
+        conn.executescript(SCHEMA)
+        try:
+            conn.execute("CREATE VIRTUAL TABLE IF NOT EXISTS messages_fts USING fts5("
+                         "content, content='messages', content_rowid='id', tokenize='trigram')")
+        except sqlite3.OperationalError:
+            logging.warning("[CHAT_DB] FTS5 trigram 非対応のため unicode61 で索引を作成します")
+            conn.execute("CREATE VIRTUAL TABLE IF NOT EXISTS messages_fts USING fts5("
+                         "content, content='messages', content_rowid='id')")
+        conn.executescript(FTS_TRIGGERS)
+        migrate_from_files(conn)
+        _initialized_path = DB_PATH
+
+# === 移行 ===
+def read_jsonl(path: Path) -> List[dict]:
+    entries = []
+    with path.open("r", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                msg = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            if isinstance(msg, dict):
+                entries.append(msg)
+    return entries
+
+def migrate_from_files(conn: sqlite3.Connection):
+    """rooms.json と各ルームの .jsonl を取り込む（移行済みなら何もしない）"""
+    if conn.execute("SELECT 1 FROM meta WHERE key = 'migrated'").fetchone():
+        return
+
+    rooms_file = CHAT_LOGS_DIR / "rooms.json"
+    rooms = []
+    if rooms_file.exists():
+        try:
+            with rooms_file.open("r", encoding="utf-8") as f:
+                rooms = json.load(f).get("rooms", [])
+        except Exception as e:
+            logging.warning(f"[CHAT_DB] rooms.json 読み込み失敗（ルームなしで移行）: {e}")
+
+    total = 0
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        for room in rooms:
+            if not isinstance(room, dict) or not room.get("id"):
+                continue
+            conn.execute("INSERT OR IGNORE INTO rooms (id, name) VALUES (?, ?)", (room["id"], room.get("name", "")))
+            log_file = CHAT_LOGS_DIR / f"{room['id']}.jsonl"
+            if not log_file.exists():
+                continue
+            rows = [message_row(room["id"], m) for m in read_jsonl(log_file)]
+            conn.executemany(
+                "INSERT INTO messages (room_id, role, content, model, timestamp) VALUES (?, ?, ?, ?, ?)", rows
+            )
+            total += len(rows)
+        conn.execute("INSERT INTO meta (key, value) VALUES ('migrated', datetime('now'))")
+        conn.execute("COMMIT")
+    except Exception:
+        conn.execute("ROLLBACK")
+        raise
+    logging.info(f"[CHAT_DB] 旧ログから移行: ルーム {len(rooms)}件 / メッセージ {total}件 → {DB_PATH}")
+
+def message_row(room_id: str, entry: dict) -> Tuple[str, str, str, str, str]:
+    return (
+        room_id,
+        str(entry.get("role", "user")),
+        str(entry.get("content", "")),
+        str(entry.get("model", "") or ""),
+        str(entry.get("timestamp", "")),
+    )
+
+# === ルーム ===
+def list_rooms() -> List[dict]:
+    rows = connect().execute("SELECT id, name FROM rooms ORDER BY seq").fetchall()
+    return [{"id": r["id"], "name": r["name"]} for r in rows]
+
+def room_exists(room_id: str) -> bool:
+    return connect().execute("SELECT 1 FROM rooms WHERE id = ?", (room_id,)).fetchone() is not None
+
+def create_room(room_id: str, name: str):
+    connect().execute("INSERT INTO rooms (id, name) VALUES (?, ?)", (room_id, name))
+
+def rename_room(room_id: str, name: str) -> bool:
+    return connect().execute("UPDATE rooms SET name = ? WHERE id = ?", (name, room_id)).rowcount > 0
+
+def delete_room(room_id: str):
+    conn = connect()
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        conn.execute("DELETE FROM messages WHERE room_id = ?", (room_id,))
+        conn.execute("DELETE FROM rooms WHERE id = ?", (room_id,))
+        conn.execute("COMMIT")
+    except Exception:
+        conn.execute("ROLLBACK")
+        raise
+
+# === メッセージ ===
+def insert_messages(entries: List[Tuple[str, dict]]):
+    """(room_id, entry) の列を1トランザクションで追記"""
+    conn = connect()
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        conn.executemany(
+            "INSERT INTO messages (room_id, role, content, model, timestamp) VALUES (?, ?, ?, ?, ?)",
+            [message_row(room_id, entry) for room_id, entry in entries],
+        )
+        conn.execute("COMMIT")
+    except Exception:
+        conn.execute("ROLLBACK")
+        raise
+
+def get_messages(room_id: str, before: Optional[int] = None, limit: int = 100) -> Tuple[List[dict], bool]:
+    """
+    カーソル（メッセージID）より前の最新 limit 件を古い順で返す
+    戻り値: (メッセージ, さらに古いメッセージがあるか)
+    """
+    rows = connect().execute(
+        "SELECT id, role, content, model, timestamp FROM messages "
+        "WHERE room_id = ? AND id < ? ORDER BY id DESC LIMIT ?",
+        (room_id, before if before is not None else 2 ** 63 - 1, limit + 1),
+    ).fetchall()
+    has_more = len(rows) > limit
+    return [dict(r) for r in reversed(rows[:limit])], has_more
+
+def room_messages(room_id: str) -> List[Dict[str, str]]:
+    """履歴組み立て用: ルームの全発言 (role, content) を古い順で"""
+    rows = connect().execute(
+        "SELECT role, content FROM messages WHERE room_id = ? ORDER BY id", (room_id,)
+    ).fetchall()
+    return [{"role": r["role"], "content": r["content"]} for r in rows]
+
+def search_messages(query: str, room_id: Optional[str] = None, limit: int = 20) -> List[dict]:
+    """過去の会話を全文検索（新しい順）"""
+    conn = connect()
+    room_clause = "AND m.room_id = ?" if room_id else ""
+    params: list = []
+    if len(query) >= MIN_TRIGRAM_QUERY:
+        sql = (
+            "SELECT m.id, m.room_id, r.name AS room_name, m.role, m.model, m.timestamp, "
+            "snippet(messages_fts, 0, '[', ']', '…', 16) AS snippet "
+            "FROM messages_fts JOIN messages m ON m.id = messages_fts.rowid "
+            "LEFT JOIN rooms r ON r.id = m.room_id "
+            f"WHERE messages_fts MATCH ? {room_clause} ORDER BY m.id DESC LIMIT ?"
+        )
+        params.append('"' + query.replace('"', '""') + '"')
+    else:
+        sql = (
+            "SELECT m.id, m.room_id, r.name AS room_name, m.role, m.model, m.timestamp, "
+            "substr(m.content, 1, 64) AS snippet "
+            "FROM messages m LEFT JOIN rooms r ON r.id = m.room_id "
+            f"WHERE m.content LIKE ? ESCAPE '\\' {room_clause} ORDER BY m.id DESC LIMIT ?"
+        )
+        escaped = query.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+        params.append(f"%{escaped}%")
+    if room_id:
+        params.append(room_id)
+    params.append(limit)
+    return [dict(r) for r in conn.execute(sql, params).fetchall()]
+
+if __name__ == "__main__":
+    # 手動移行: python -m routers.chat_db
+    logging.basicConfig(level=logging.INFO)
+    connect()
+    print(f"[INFO] ルーム数: {len(list_rooms())} ({DB_PATH})")
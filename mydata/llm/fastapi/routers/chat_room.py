@@ -1,17 +1,24 @@
 from fastapi import APIRouter, HTTPException
 from pydantic import BaseModel
 from pathlib import Path
-import json
+from typing import Optional
+import asyncio
 import logging
 from datetime import datetime
 
-from .room_store import load_rooms, save_rooms, generate_room_id
+from . import chat_db
+from .room_store import generate_room_id
+from .log_writer import log_writer
 
 router = APIRouter(prefix="/v1/chat")
 
 CHAT_LOGS_DIR = Path("/mydata/llm/fastapi/chat_logs")
 CHAT_LOGS_DIR.mkdir(parents=True, exist_ok=True)
 
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 500
+MAX_SEARCH_RESULTS = 100
+
 class CreateRoomRequest(BaseModel):
     name: str
 
@@ -25,49 +32,36 @@ class MessageEntry(BaseModel):
 
 @router.get("/rooms")
 def list_rooms():
-    return {"success": True, "data": load_rooms()["rooms"], "error": None}
+    return {"success": True, "data": chat_db.list_rooms(), "error": None}
 
 @router.post("/rooms")
 def create_room(payload: CreateRoomRequest):
     room_id = generate_room_id()
-    log_path = CHAT_LOGS_DIR / f"{room_id}.jsonl"
     try:
-        log_path.touch()
+        chat_db.create_room(room_id, payload.name)
     except Exception as e:
-        raise HTTPException(status_code=500, detail=f"ログファイル作成失敗: {e}")
-
-    data = load_rooms()
-    data["rooms"].append({"id": room_id, "name": payload.name})
-    save_rooms(data)
+        raise HTTPException(status_code=500, detail=f"ルーム作成失敗: {e}")
     return {"success": True, "data": {"room_id": room_id}, "error": None}
 
 @router.put("/rooms/rename")
 def rename_room(payload: RenameRoomRequest):
-    data = load_rooms()
-    for r in data["rooms"]:
-        if r["id"] == payload.room_id:
-            r["name"] = payload.new_name
-            break
-    else:
+    if not chat_db.rename_room(payload.room_id, payload.new_name):
         raise HTTPException(status_code=404, detail="Room not found")
-    save_rooms(data)
     return {"success": True, "data": None, "error": None}
 
 @router.delete("/rooms/{room_id}")
 def delete_room(room_id: str):
-    data = load_rooms()
-    data["rooms"] = [r for r in data["rooms"] if r["id"] != room_id]
-    save_rooms(data)
-    log_file = CHAT_LOGS_DIR / f"{room_id}.jsonl"
-    if log_file.exists():
-        log_file.unlink()
+    chat_db.delete_room(room_id)
+    # ✅ 旧形式のログ・会話要約のキャッシュも削除
+    (CHAT_LOGS_DIR / f"{room_id}.jsonl").unlink(missing_ok=True)
+    (CHAT_LOGS_DIR / f"{room_id}.summary.json").unlink(missing_ok=True)
     return {"success": True, "data": {"room_id": room_id}, "error": None}
 
 @router.post("/messages")
-def store_message(payload: MessageEntry):
-    log_file = CHAT_LOGS_DIR / f"{payload.room_id}.jsonl"
-    if not log_file.exists():
-        raise HTTPException(status_code=404, detail="ログファイルが存在しません")
+async def store_message(payload: MessageEntry):
+    # ✅ SQLite の参照（初回は DB 初期化・旧ログ移行を含む）はイベントループ外で
+    if not await asyncio.to_thread(chat_db.room_exists, payload.room_id):
+        raise HTTPException(status_code=404, detail="ルームが存在しません")
 
     # ✅ 修正：assistantの場合はモデル名をそのまま保存
     role = payload.message.get("role", "user")
@@ -82,43 +76,53 @@ def store_message(payload: MessageEntry):
     }
 
     try:
-        with log_file.open("a", encoding="utf-8") as f:
-            f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+        # ✅ 書き込み完了まで待つ（イベントループは止めない）
+        await log_writer.append(payload.room_id, entry)
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"書き込み失敗: {e}")
 
     return {"success": True, "data": None, "error": None}
 
 @router.get("/messages/{room_id}")
-def load_messages(room_id: str):
-    log_file = CHAT_LOGS_DIR / f"{room_id}.jsonl"
-    if not log_file.exists():
-        raise HTTPException(status_code=404, detail="ログファイルが存在しません")
-    messages = []
+def load_messages(room_id: str, before: Optional[int] = None, limit: int = DEFAULT_PAGE_SIZE):
+    """
+    ルームのメッセージを新しい方から1ページ分（表示用に古い順）返す
+    - before: カーソル（このメッセージIDより古いものを返す。paging.next_before をそのまま渡す）
+    - limit: 1ページの件数
+    """
+    if not chat_db.room_exists(room_id):
+        raise HTTPException(status_code=404, detail="ルームが存在しません")
+    limit = min(max(limit, 1), MAX_PAGE_SIZE)
     try:
-        with log_file.open("r", encoding="utf-8") as f:
-            for line in f:
-                line = line.strip()
-                if line:
-                    try:
-                        msg = json.loads(line)
-                        if isinstance(msg, dict):
-                            messages.append(msg)
-                    except json.JSONDecodeError:
-                        continue
+        messages, has_more = chat_db.get_messages(room_id, before=before, limit=limit)
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"読み込み失敗: {e}")
-    return {"success": True, "data": messages, "error": None}
+    return {
+        "success": True,
+        "data": messages,
+        "paging": {"has_more": has_more, "next_before": messages[0]["id"] if has_more and messages else None},
+        "error": None,
+    }
+
+@router.get("/search")
+def search_messages(q: str, room_id: Optional[str] = None, limit: int = 20):
+    """過去の会話の全文検索（room_id 指定でルーム内に限定）"""
+    q = q.strip()
+    if not q:
+        raise HTTPException(status_code=400, detail="q is empty")
+    try:
+        hits = chat_db.search_messages(q, room_id=room_id, limit=min(max(limit, 1), MAX_SEARCH_RESULTS))
+    except Exception as e:
+        logging.error(f"[CHAT_DB] 検索失敗: {e}")
+        raise HTTPException(status_code=500, detail=f"検索失敗: {e}")
+    return {"success": True, "data": hits, "error": None}
 
 def save_streamed_message(room_id: str, role: str, content: str, model: str = ""):
+    """ストリーミング中の書き込み（キューへ投入して即座に戻る。実際の追記は log_writer がまとめて行う）"""
     if not room_id:
         logging.warning("[LOG] room_idが空のためスキップ")
         return
 
-    log_file = CHAT_LOGS_DIR / f"{room_id}.jsonl"
-    if not log_file.exists():
-        log_file.touch()
-
     entry = {
         "role": role,
         "content": content,
@@ -127,21 +131,7 @@ def save_streamed_message(room_id: str, role: str, content: str, model: str = ""
     }
 
     try:
-        with log_file.open("a", encoding="utf-8") as f:
-            f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+        log_writer.submit(room_id, entry)
         logging.info(f"[LOG] ストリーミング書き込み: {room_id}")
     except Exception as e:
         logging.error(f"[LOG SAVE ERROR]: {e}")
-
-
-
-
-
-
-
-
-
-
-
-
-
@@ -0,0 +1,156 @@
+import os
+import re
+import time
+import asyncio
+import logging
+import httpx
+from collections import OrderedDict
+from typing import Dict, List
+
+from .http_clients import get_client
+
+# === RAG参考情報のトークン予算内パッキング ===
+# ✅ 検索結果を順位順に予算いっぱいまで詰め、超過分は捨てる（捨てた分はログに残す）
+#    予算 = コンテキスト長 − 回答用の予約 − システムプロンプト（参考情報以外） − 履歴 − 余白
+# ✅ トークン数は llama.cpp の /tokenize（実際に推論するモデルのトークナイザー）で数え、
+#    使えないときは文字種からの概算に切り替える
+
+LLM_HOST = os.getenv("LLM_HOST", "http://llama:8000")
+
+LLM_CTX_SIZE = int(os.getenv("LLM_CTX_SIZE", "4096"))                  # llama の --ctx-size と合わせる
+ANSWER_RESERVE = int(os.getenv("CONTEXT_ANSWER_RESERVE", "1024"))       # 回答生成用に空けておく分
+HISTORY_RESERVE = int(os.getenv("CONTEXT_HISTORY_RESERVE", "512"))      # 履歴が短くても最低限空けておく分
+CONTEXT_MAX_TOKENS = int(os.getenv("CONTEXT_MAX_TOKENS", "0"))          # 参考情報の上限（0=予算いっぱい）
+SAFETY_MARGIN = 64          # チャットテンプレートの制御トークン・見出し等の余白
+MESSAGE_OVERHEAD = 4        # 1メッセージあたりのテンプレート分
+ENTRY_OVERHEAD = 2          # 参考情報1件あたりの区切り（空行）分
+
+TOKENIZE_TIMEOUT = 2.0
+TOKENIZE_POOL_TIMEOUT = 10.0  # 接続プールの空き待ち（応答待ちの TOKENIZE_TIMEOUT とは別）
+TOKENIZE_CONCURRENCY = int(os.getenv("TOKENIZE_CONCURRENCY", "4"))  # 同時に送る /tokenize の上限
+TOKENIZE_RETRY_SEC = 60     # /tokenize 失敗後、この秒数は概算のみで数える
+TOKEN_CACHE_SIZE = 4096
+
+PDF_WORD_SOURCES = {"pdf", "word", "image"}
+EXCEL_CALENDAR_SOURCES = {"excel", "calendar"}
+# 出典表示用に検索結果から引き継ぐ項目（/v1/source/excerpt に渡す位置情報を含む）
+SOURCE_META_KEYS = ("score", "uid", "chunk_index", "sheet", "page", "page_end", "byte_start", "byte_end")
+
+CJK_CHAR = re.compile(r"[\u3000-\u30ff\u3400-\u9fff\uf900-\ufaff\uff00-\uffef]")
+
+_token_cache: "OrderedDict[str, int]" = OrderedDict()
+_tokenize_disabled_until = 0.0
+# ✅ 1回の検索で100件近く数えることがあるため、同時リクエスト数を絞る
+#    （共有の llama プールを埋めて、生成中のストリームの接続を奪わないように）
+_tokenize_slots = asyncio.Semaphore(TOKENIZE_CONCURRENCY)
+
+def approx_tokens(text: str) -> int:
+    """和文は1文字≒1トークン、欧文は3文字≒1トークンで概算（やや多めに見積もる）"""
+    cjk = len(CJK_CHAR.findall(text))
+    return cjk + (len(text) - cjk + 2) // 3
+
+async def _tokenize(text: str) -> int:
+    async with _tokenize_slots:
+        res = await get_client("llama").post(
+            f"{LLM_HOST}/tokenize",
+            json={"content": text},
+            timeout=httpx.Timeout(TOKENIZE_TIMEOUT, pool=TOKENIZE_POOL_TIMEOUT),
+        )
+    res.raise_for_status()
+    return len(res.json().get("tokens", []))
+
+async def count_tokens(texts: List[str]) -> List[int]:
+    """複数テキストのトークン数（キャッシュ済みの分は問い合わせない）"""
+    global _tokenize_disabled_until
+    missing = list({t for t in texts if t not in _token_cache})
+
+    if missing and time.time() >= _tokenize_disabled_until:
+        results = await asyncio.gather(*(_tokenize(t) for t in missing), return_exceptions=True)
+        failed = [r for r in results if isinstance(r, Exception)]
+        if failed:
+            logging.warning(f"[WARN] /tokenize 失敗 → {TOKENIZE_RETRY_SEC}秒間は概算で計数: {failed[0]}")
+            _tokenize_disabled_until = time.time() + TOKENIZE_RETRY_SEC
+        for text, n in zip(missing, results):
+            if not isinstance(n, Exception):
+                _token_cache[text] = n
+        while len(_token_cache) > TOKEN_CACHE_SIZE:
+            _token_cache.popitem(last=False)
+
+    counts = []
+    for text in texts:
+        if text in _token_cache:
+            _token_cache.move_to_end(text)
+            counts.append(_token_cache[text])
+        else:
+            counts.append(approx_tokens(text))
+    return counts
+
+async def context_budget(system_template: str, history: List[Dict[str, str]]) -> int:
+    """参考情報に使えるトークン数"""
+    counts = await count_tokens([system_template] + [m["content"] for m in history])
+    fixed = counts[0] + MESSAGE_OVERHEAD
+    history_tokens = sum(counts[1:]) + MESSAGE_OVERHEAD * len(history)
+    budget = LLM_CTX_SIZE - ANSWER_RESERVE - SAFETY_MARGIN - fixed - max(history_tokens, HISTORY_RESERVE)
+    if CONTEXT_MAX_TOKENS > 0:
+        budget = min(budget, CONTEXT_MAX_TOKENS)
+    logging.info(
+        f"[CONTEXT] 予算: {max(budget, 0)} tokens "
+        f"(ctx={LLM_CTX_SIZE}, 回答予約={ANSWER_RESERVE}, システム={fixed}, 履歴={history_tokens})"
+    )
+    return max(budget, 0)
+
+def iter_entries(chunks: list):
+    """検索結果（dict またはグループの list）を順位順に平坦化し、参考情報1件ずつの形にする"""
+    for rank, item in enumerate(chunks):
+        for sub in (item if isinstance(item, list) else [item]):
+            if not (isinstance(sub, dict) and isinstance(sub.get("text"), str)):
+                continue
+            source = sub.get("source") or sub.get("type", "")
+            if source not in PDF_WORD_SOURCES and source not in EXCEL_CALENDAR_SOURCES:
+                continue
+            file_info = f"[ファイル]: {sub.get('absolute_path', sub.get('path', '不明'))}"
+            yield {
+                "rank": rank,
+                "key": (sub.get("uid"), sub.get("chunk_index")) if sub.get("uid") else sub["text"].strip(),
+                "source": source,
+                "path": sub.get("path", ""),
+                "text": f"{file_info}\n{sub['text'].strip()}",
+                "meta": {k: sub.get(k) for k in SOURCE_META_KEYS if sub.get(k) is not None},
+            }
+
+async def pack_context(chunks: list, budget: int) -> List[dict]:
+    """
+    順位順に予算内で採用する参考情報を返す
+    ✅ uid/index が同じチャンク（グループ間で重複した隣接チャンク等）は1回だけ採用
+    ✅ 予算超過の1件は飛ばし、後続の短いチャンクで残りを埋める
+    """
+    entries, seen, duplicates = [], set(), 0
+    for entry in iter_entries(chunks):
+        if entry["key"] in seen:
+            duplicates += 1
+            continue
+        seen.add(entry["key"])
+        entries.append(entry)
+
+    counts = await count_tokens([e["text"] for e in entries])
+    packed, dropped, used = [], [], 0
+    for entry, tokens in zip(entries, counts):
+        cost = tokens + ENTRY_OVERHEAD
+        if used + cost <= budget:
+            entry["tokens"] = tokens
+            packed.append(entry)
+            used += cost
+        else:
+            dropped.append((entry, tokens))
+
+    logging.info(
+        f"[CONTEXT] 採用: {len(packed)}件 / {used} tokens (予算 {budget}), "
+        f"除外: 予算超過 {len(dropped)}件, 重複 {duplicates}件"
+    )
+    if dropped:
+        logging.info(
+            "[CONTEXT] 予算超過で除外: "
+            + ", ".join(f"#{e['rank']} {e['path']} ({n} tokens)" for e, n in dropped[:20])
+            + (f" ほか{len(dropped) - 20}件" if len(dropped) > 20 else "")
+        )
+    return packed
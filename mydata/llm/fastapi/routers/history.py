@@ -0,0 +1,177 @@
+import os
+import json
+import asyncio
+import logging
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+from . import chat_db
+from .http_clients import get_client
+from .context_packer import approx_tokens
+from .log_writer import log_writer
+
+# === 会話履歴の窓（直近Nターンはそのまま、それより前はローリング要約） ===
+# ✅ 窓は HISTORY_STEP_TURNS ターン単位で段階的にずらす
+#    → 窓がずれるまでの間は「要約＋履歴の先頭」が毎ターン同じになり、KVキャッシュを再利用できる
+# ✅ 要約は chat_logs/{room_id}.summary.json にキャッシュし、窓がずれたときに
+#    応答の生成後にバックグラウンドで作り直す（リクエスト処理の中では LLM を呼ばない）
+
+LLM_HOST = os.getenv("LLM_HOST", "http://llama:8000")
+CHAT_LOGS_DIR = Path("/mydata/llm/fastapi/chat_logs")
+
+HISTORY_TURNS = int(os.getenv("HISTORY_TURNS", "4"))                # そのまま残す直近ターン数（最低値）
+HISTORY_STEP_TURNS = int(os.getenv("HISTORY_STEP_TURNS", "2"))      # 窓をずらす単位
+HISTORY_MAX_TOKENS = int(os.getenv("HISTORY_MAX_TOKENS", "1200"))   # そのまま残す履歴の上限（概算）
+SUMMARY_MAX_TOKENS = int(os.getenv("HISTORY_SUMMARY_MAX_TOKENS", "384"))
+SUMMARY_TIMEOUT = 120.0
+
+SUMMARY_SYSTEM_PROMPT = (
+    "あなたは法律事務所の会話記録を要約する担当者です。\n"
+    "これまでの要約とその後の会話から、新しい要約を作成してください。\n"
+    "1. 事件の事実関係、争点、参照した資料（ファイル名）、回答の結論、未解決の事項を残す\n"
+    "2. 挨拶や重複した説明は省く\n"
+    "3. 400字以内の箇条書きで、要約本文のみを出力する"
+)
+
+_refreshing: set = set()
+_tasks: set = set()  # 実行中タスクの参照保持（GC で消えないように）
+
+def summary_path(room_id: str) -> Path:
+    return CHAT_LOGS_DIR / f"{room_id}.summary.json"
+
+def load_log(room_id: str) -> List[Dict[str, str]]:
+    """ルームの発言を (role, content) の列で読む（空の発言は除き、連続した同一発言は1件にまとめる）"""
+    messages = []
+    for msg in chat_db.room_messages(room_id):
+        content = msg["content"].strip()
+        if msg["role"] not in {"user", "assistant"} or not content:
+            continue
+        if messages and messages[-1] == {"role": msg["role"], "content": content}:
+            continue
+        messages.append({"role": msg["role"], "content": content})
+    return messages
+
+def load_summary(room_id: str) -> Optional[dict]:
+    path = summary_path(room_id)
+    if not path.exists():
+        return None
+    try:
+        with path.open("r", encoding="utf-8") as f:
+            data = json.load(f)
+        return data if isinstance(data, dict) and "upto" in data else None
+    except Exception as e:
+        logging.warning(f"[HISTORY] 要約読み込み失敗: {room_id}: {e}")
+        return None
+
+def save_summary(room_id: str, upto: int, summary: str):
+    path = summary_path(room_id)
+    tmp = path.with_suffix(".json.tmp")
+    with tmp.open("w", encoding="utf-8") as f:
+        json.dump({"upto": upto, "summary": summary, "updated": datetime.now().isoformat()}, f, ensure_ascii=False)
+    os.replace(tmp, path)
+
+def window_start(messages: List[Dict[str, str]]) -> int:
+    """
+    そのまま残す範囲の開始位置（要約対象は [0, 開始位置)）
+    残す件数は HISTORY_TURNS〜HISTORY_TURNS+HISTORY_STEP_TURNS ターンの間で推移する
+    ✅ 残す範囲が HISTORY_MAX_TOKENS を超える場合は、開始位置（＝要約の境界）を step 単位で前へ進める
+       → はみ出したターンは捨てずに要約へ回り、境界は次にずれるまで固定（プロンプトの先頭が変わらない）
+    """
+    n = len(messages)
+    keep, step = HISTORY_TURNS * 2, max(HISTORY_STEP_TURNS, 1) * 2
+    start = 0 if n <= keep else (n - keep) // step * step
+
+    tokens = [approx_tokens(m["content"]) for m in messages]
+    total = sum(tokens[start:])
+    while n - start > 2 and total > HISTORY_MAX_TOKENS:
+        nxt = min(start + step, (n - 2) // 2 * 2)  # 最後の1ターンは残す（境界は user 始まり）
+        if nxt <= start:
+            break
+        total -= sum(tokens[start:nxt])
+        start = nxt
+    return start
+
+def normalize_turns(messages: List[Dict[str, str]]) -> List[Dict[str, str]]:
+    """user 始まり・user/assistant 交互に整える（チャットテンプレートの制約）"""
+    turns = []
+    for m in messages:
+        if not turns and m["role"] != "user":
+            continue
+        if turns and turns[-1]["role"] == m["role"]:
+            turns[-1] = {"role": m["role"], "content": turns[-1]["content"] + "\n\n" + m["content"]}
+        else:
+            turns.append(dict(m))
+    return turns
+
+def build_history(room_id: str, user_message: str) -> Tuple[str, List[Dict[str, str]]]:
+    """
+    プロンプト用の履歴を組み立てる
+    戻り値: (要約テキスト, 直近の履歴（今回の質問は含まない）)
+    ✅ 要約が窓に追いついていない間は、要約済みの位置以降をそのまま渡す（内容は欠けない）
+    """
+    messages = load_log(room_id)
+    # 今回の質問（リクエスト受付時に書き込み済み）は除く
+    if messages and messages[-1] == {"role": "user", "content": user_message.strip()}:
+        messages = messages[:-1]
+
+    start = window_start(messages)
+    summary = load_summary(room_id) if start else None
+    upto = min(summary["upto"], start) if summary else 0
+    recent = messages[upto:]
+
+    # 要約が追いつくまでの間に上限を超える場合は窓の位置から渡す（間のターンは次の要約更新で要約に入る）
+    if upto < start and sum(approx_tokens(m["content"]) for m in recent) > HISTORY_MAX_TOKENS:
+        recent = messages[start:]
+
+    return (summary or {}).get("summary", "") if upto else "", normalize_turns(recent)
+
+async def refresh_summary(room_id: str, model: str):
+    """窓の手前までを要約し直す（前回の要約＋その後の会話から作るため、毎回全履歴は読ませない）"""
+    if room_id in _refreshing:
+        return
+    _refreshing.add(room_id)
+    try:
+        # ✅ 直前の応答の追記が終わってから読む
+        await log_writer.drain()
+        messages = await asyncio.to_thread(load_log, room_id)
+        start = window_start(messages)
+        summary = load_summary(room_id) or {"upto": 0, "summary": ""}
+        if start <= summary["upto"]:
+            return
+
+        lines = [f"{'ユーザー' if m['role'] == 'user' else 'アシスタント'}: {m['content']}"
+                 for m in messages[summary["upto"]:start]]
+        prompt = (
+            f"【これまでの要約】\n{summary['summary'] or '（なし）'}\n\n"
+            f"【その後の会話】\n" + "\n".join(lines)
+        )
+        res = await get_client("llama").post(
+            f"{LLM_HOST}/v1/chat/completions",
+            json={
+                "model": model,
+                "messages": [
+                    {"role": "system", "content": SUMMARY_SYSTEM_PROMPT},
+                    {"role": "user", "content": prompt},
+                ],
+                "max_tokens": SUMMARY_MAX_TOKENS,
+                "cache_prompt": False,
+            },
+            timeout=SUMMARY_TIMEOUT,
+        )
+        res.raise_for_status()
+        text = res.json()["choices"][0]["message"]["content"].strip()
+        if text:
+            save_summary(room_id, start, text)
+            logging.info(f"[HISTORY] 要約更新: {room_id} (〜{start}件目, {len(text)}文字)")
+    except Exception as e:
+        logging.warning(f"[HISTORY] 要約更新失敗: {room_id}: {e}")
+    finally:
+        _refreshing.discard(room_id)
+
+def schedule_summary(room_id: str, model: str):
+    """応答の送信後に呼ぶ（結果を待たない）"""
+    if room_id and room_id not in _refreshing:
+        task = asyncio.get_running_loop().create_task(refresh_summary(room_id, model))
+        _tasks.add(task)
+        task.add_done_callback(_tasks.discard)
@@ -0,0 +1,142 @@
+from fastapi import APIRouter
+from typing import Dict
+import os
+import time
+import logging
+import httpx
+
+router = APIRouter(prefix="/v1/pool")
+
+# === 上流サービスごとの共有クライアント（アプリ起動時に生成し、終了時に閉じる） ===
+# ✅ リクエストごとに AsyncClient を作ると毎回 TCP 接続からやり直しになるため、
+#    コネクションプールをプロセス内で使い回す
+LLM_HOST = os.getenv("LLM_HOST", "http://llama:8000")
+VECTOR_API_URL = os.getenv("VECTOR_API_URL", "http://vector:8000/embed_search")
+VOICEVOX_HOST = os.getenv("VOICEVOX_HOST", "http://voicevox:50021")
+
+# HTTP/2 は h2 パッケージ導入時のみ（http:// 宛ては httpx が HTTP/1.1 で接続する）
+HTTP2_ENABLED = os.getenv("HTTPX_HTTP2", "0") == "1"
+KEEPALIVE_EXPIRY = float(os.getenv("HTTPX_KEEPALIVE_EXPIRY", "30"))
+
+# name: (base_url, 最大接続数, keep-alive 保持数, タイムアウト)
+# ※ llama の read はストリーミング応答のため無制限（個別呼び出し側で上書き可）
+UPSTREAMS = {
+    "llama": (
+        LLM_HOST,
+        int(os.getenv("LLAMA_POOL_MAX", "16")),
+        int(os.getenv("LLAMA_POOL_KEEPALIVE", "8")),
+        httpx.Timeout(connect=5.0, read=None, write=30.0, pool=10.0),
+    ),
+    "vector": (
+        VECTOR_API_URL,
+        int(os.getenv("VECTOR_POOL_MAX", "16")),
+        int(os.getenv("VECTOR_POOL_KEEPALIVE", "8")),
+        httpx.Timeout(connect=5.0, read=30.0, write=10.0, pool=10.0),
+    ),
+    "voicevox": (
+        VOICEVOX_HOST,
+        int(os.getenv("VOICEVOX_POOL_MAX", "8")),
+        int(os.getenv("VOICEVOX_POOL_KEEPALIVE", "4")),
+        httpx.Timeout(connect=5.0, read=60.0, write=10.0, pool=10.0),
+    ),
+}
+
+_clients: Dict[str, httpx.AsyncClient] = {}
+_counters: Dict[str, Dict[str, int]] = {}
+_started_at = 0.0
+_http2 = False
+
+def _http2_available() -> bool:
+    if not HTTP2_ENABLED:
+        return False
+    try:
+        import h2  # noqa: F401
+        return True
+    except ImportError:
+        logging.warning("[WARN] HTTPX_HTTP2=1 ですが h2 が未インストールのため HTTP/1.1 で接続します")
+        return False
+
+def _make_client(name: str, http2: bool) -> httpx.AsyncClient:
+    base_url, max_connections, max_keepalive, timeout = UPSTREAMS[name]
+    counters = _counters.setdefault(name, {"requests": 0, "responses": 0, "errors": 0})
+
+    async def on_request(request: httpx.Request):
+        counters["requests"] += 1
+
+    async def on_response(response: httpx.Response):
+        counters["responses"] += 1
+        if response.status_code >= 400:
+            counters["errors"] += 1
+
+    return httpx.AsyncClient(
+        timeout=timeout,
+        limits=httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_keepalive,
+            keepalive_expiry=KEEPALIVE_EXPIRY,
+        ),
+        http2=http2,
+        event_hooks={"request": [on_request], "response": [on_response]},
+    )
+
+async def start_clients():
+    """lifespan 開始時に呼ぶ"""
+    global _started_at, _http2
+    _http2 = _http2_available()
+    for name in UPSTREAMS:
+        if name not in _clients:
+            _clients[name] = _make_client(name, _http2)
+    _started_at = time.time()
+    logging.info(f"[INFO] HTTPクライアント初期化: {list(_clients)} (http2={_http2})")
+
+async def close_clients():
+    """lifespan 終了時に呼ぶ"""
+    for name, client in list(_clients.items()):
+        try:
+            await client.aclose()
+        except Exception as e:
+            logging.warning(f"[WARN] HTTPクライアント終了失敗: {name}: {e}")
+    _clients.clear()
+
+def get_client(name: str) -> httpx.AsyncClient:
+    """
+    共有クライアントを返す
+    ✅ lifespan 外（単体起動・テスト等）で呼ばれた場合はその場で生成して登録
+    """
+    client = _clients.get(name)
+    if client is None or client.is_closed:
+        client = _clients[name] = _make_client(name, _http2)
+    return client
+
+def pool_stats(name: str, client: httpx.AsyncClient) -> dict:
+    base_url, max_connections, max_keepalive, timeout = UPSTREAMS[name]
+    # ✅ httpcore の接続プールを参照（内部属性のため取れない場合は件数のみ返す）
+    pool = getattr(getattr(client, "_transport", None), "_pool", None)
+    connections = list(getattr(pool, "connections", []) or [])
+    idle = sum(1 for c in connections if c.is_idle())
+    queued = sum(1 for r in getattr(pool, "_requests", []) or [] if getattr(r, "is_queued", lambda: False)())
+    return {
+        "upstream": base_url,
+        "http2": _http2,
+        "max_connections": max_connections,
+        "max_keepalive_connections": max_keepalive,
+        "keepalive_expiry": KEEPALIVE_EXPIRY,
+        "timeout": {"connect": timeout.connect, "read": timeout.read, "write": timeout.write, "pool": timeout.pool},
+        "connections": len(connections),
+        "active": len(connections) - idle,
+        "idle": idle,
+        "queued": queued,
+        **_counters.get(name, {}),
+    }
+
+@router.get("/stats")
+def get_pool_stats():
+    try:
+        data = {name: pool_stats(name, client) for name, client in _clients.items()}
+        return {
+            "success": True,
+            "data": {"uptime_sec": round(time.time() - _started_at, 1) if _started_at else 0, "clients": data},
+            "error": None,
+        }
+    except Exception as e:
+        return {"success": False, "data": None, "error": str(e)}
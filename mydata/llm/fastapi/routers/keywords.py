@@ -0,0 +1,165 @@
+import os
+import re
+import logging
+from functools import lru_cache
+from pathlib import Path
+from typing import Dict, List, Tuple
+
+# === ローカルキーワード抽出（LLM不要・辞書＋字種分割） ===
+# ✅ ベクトル検索のキーワード補正用。LLMへの往復なしでマイクロ秒単位で返す
+#    1. 事件番号・条文番号を正規表現で抽出（最優先）
+#    2. 法律用語辞書で最長一致
+#    3. 残りを字種（漢字・カタカナ・英数字）の連続で分割し、ストップワードを除外
+
+MAX_KEYWORDS = int(os.getenv("KEYWORD_MAX", "5"))
+KEYWORD_BOOST = 0.1  # vector 側 embed_search のキーワード補正と同じ加点
+USER_DICT_PATH = Path(os.getenv("KEYWORD_DICT_PATH", "/mydata/llm/fastapi/config/keywords_dict.txt"))
+
+DIGIT = r"[0-9０-９〇一二三四五六七八九十百千]"
+KANJI = r"[一-龥々〆ヶ]"
+
+# 例: 令和5年(ワ)第1234号 / 平成３０年（ネ）第５６号
+CASE_NUMBER = re.compile(
+    rf"(?:令和|平成|昭和)\s*(?:{DIGIT}+|元)\s*年\s*[（(]\s*[ぁ-んァ-ヶ一-龥]{{1,4}}\s*[）)]\s*第?\s*{DIGIT}+\s*号"
+)
+# 例: 民法第709条 / 借地借家法32条1項 / 会社法第423条の2
+STATUTE_ARTICLE = re.compile(
+    rf"{KANJI}{{1,15}}法(?:施行令|施行規則)?\s*第?\s*{DIGIT}+\s*条(?:の{DIGIT}+)?"
+    rf"(?:\s*第?\s*{DIGIT}+\s*項)?(?:\s*第?\s*{DIGIT}+\s*号)?"
+)
+# 法令名を伴わない条文番号（例: 第415条）
+ARTICLE = re.compile(rf"第\s*{DIGIT}+\s*条(?:の{DIGIT}+)?(?:\s*第?\s*{DIGIT}+\s*項)?")
+
+# 字種の連続（漢字・カタカナ・英数字）。ひらがなと記号は区切りとして扱う
+TOKEN = re.compile(rf"{KANJI}+|[ァ-ヶー]+|[A-Za-zＡ-Ｚａ-ｚ0-9０-９]+")
+
+LEGAL_TERMS = {
+    # 民事一般
+    "損害賠償", "不法行為", "債務不履行", "消滅時効", "取得時効", "過失相殺", "慰謝料", "逸失利益",
+    "使用者責任", "善管注意義務", "表見代理", "無権代理", "契約不適合責任", "瑕疵担保責任",
+    "催告", "解除", "弁済", "相殺", "免除", "保証債務", "連帯保証", "連帯債務", "債権譲渡",
+    "抵当権", "根抵当権", "質権", "留置権", "先取特権", "所有権移転", "登記", "仮登記",
+    "賃貸借", "賃貸借契約", "明渡し", "明け渡し", "立退料", "原状回復", "敷金", "更新料",
+    "売買契約", "請負契約", "委任契約", "消費貸借", "準消費貸借", "不当利得", "事務管理",
+    # 家事・相続
+    "離婚", "親権", "養育費", "財産分与", "婚姻費用", "面会交流", "認知", "養子縁組",
+    "遺言", "遺産分割", "遺留分", "遺留分侵害額請求", "相続放棄", "限定承認", "寄与分",
+    "特別受益", "成年後見", "保佐", "補助",
+    # 労働
+    "解雇", "雇止め", "残業代", "未払賃金", "労働災害", "安全配慮義務", "就業規則",
+    "ハラスメント", "パワーハラスメント", "セクシュアルハラスメント",
+    # 手続
+    "訴状", "答弁書", "準備書面", "陳述書", "証拠説明書", "訴訟費用", "仮執行宣言",
+    "控訴", "上告", "上告受理申立て", "抗告", "和解", "調停", "審判", "支払督促",
+    "強制執行", "仮差押え", "仮処分", "差押え", "保全", "期日", "口頭弁論", "弁論準備",
+    "破産", "免責", "民事再生", "個人再生", "任意整理", "過払金",
+    # 刑事
+    "起訴", "不起訴", "勾留", "保釈", "示談", "執行猶予", "告訴", "被害届",
+}
+
+STOPWORDS = {
+    "事件", "裁判", "本件", "場合", "事項", "関係", "内容", "方法", "必要", "可能", "問題",
+    "質問", "説明", "回答", "教示", "今回", "以下", "以上", "理由", "結果", "状況", "対応",
+    "確認", "検討", "判断", "意味", "請求", "具体的", "一般的", "何", "件", "点", "等", "的",
+    "ください", "について", "どう", "どの", "これ", "それ",
+}
+
+@lru_cache(maxsize=1)
+def load_dictionary() -> Tuple[frozenset, Dict[str, List[int]]]:
+    """
+    組み込み辞書＋ユーザー辞書（1行1語、# 以降はコメント）
+    戻り値: (語の集合, 先頭文字 → その文字で始まる語の長さ一覧（長い順）)
+    """
+    terms = set(LEGAL_TERMS)
+    if USER_DICT_PATH.exists():
+        try:
+            for line in USER_DICT_PATH.read_text(encoding="utf-8").splitlines():
+                term = line.split("#", 1)[0].strip()
+                if term:
+                    terms.add(term)
+        except Exception as e:
+            logging.warning(f"[WARN] キーワード辞書読み込み失敗: {USER_DICT_PATH}: {e}")
+    lengths: Dict[str, set] = {}
+    for term in terms:
+        lengths.setdefault(term[0], set()).add(len(term))
+    return frozenset(terms), {c: sorted(ls, reverse=True) for c, ls in lengths.items()}
+
+def _mask(text: str, spans: List[Tuple[int, int]]) -> str:
+    """抽出済み範囲を区切り文字に置き換え、後段で二重に拾わないようにする"""
+    chars = list(text)
+    for start, end in spans:
+        for i in range(start, end):
+            chars[i] = " "
+    return "".join(chars)
+
+def _dictionary_matches(text: str) -> List[Tuple[int, int]]:
+    """辞書語の最長一致（左から貪欲）"""
+    terms, lengths = load_dictionary()
+    spans, i = [], 0
+    while i < len(text):
+        for length in lengths.get(text[i], ()):
+            if text[i:i + length] in terms:
+                spans.append((i, i + length))
+                i += length
+                break
+        else:
+            i += 1
+    return spans
+
+def extract_keywords(query: str, limit: int = MAX_KEYWORDS) -> List[str]:
+    """
+    質問文から検索補正用キーワードを抽出（優先度: 事件番号 > 条文 > 辞書語 > 長い複合語）
+    ✅ 表記は質問文のまま返す（全角・半角を変換しない。vector 側は部分一致で照合するため）
+    """
+    candidates: List[Tuple[int, int, str]] = []  # (優先度, 出現位置, 語)
+    text = query
+
+    for priority, pattern in enumerate((CASE_NUMBER, STATUTE_ARTICLE, ARTICLE)):
+        spans = []
+        for m in pattern.finditer(text):
+            candidates.append((priority, m.start(), re.sub(r"\s+", "", m.group(0))))
+            spans.append(m.span())
+        text = _mask(text, spans)
+
+    spans = _dictionary_matches(text)
+    for start, end in spans:
+        candidates.append((3, start, text[start:end]))
+    text = _mask(text, spans)
+
+    for m in TOKEN.finditer(text):
+        token = m.group(0)
+        if len(token) >= 2 and token not in STOPWORDS and not token.isdigit():
+            # 長い複合語ほど検索語として有効なため優先
+            candidates.append((4, -len(token), token))
+
+    keywords = []
+    for _, _, word in sorted(candidates):
+        if word in STOPWORDS or any(word in k for k in keywords):
+            continue
+        keywords.append(word)
+        if len(keywords) >= limit:
+            break
+    return keywords
+
+def rerank_with_keywords(chunks: list, keywords: List[str]) -> list:
+    """
+    検索結果に追加キーワード分の補正を加えて並べ直す（vector 側と同じ加点ルール）
+    chunks は hit の dict、または連続チャンクの list（グループ）の列
+    """
+    if not keywords:
+        return chunks
+
+    def boost(hit: dict):
+        if isinstance(hit, dict) and isinstance(hit.get("text"), str):
+            path = hit.get("absolute_path") or ""
+            hits = sum(1 for kw in keywords if kw in hit["text"] or kw in path)
+            hit["score"] = hit.get("score", 0) + KEYWORD_BOOST * hits
+
+    def best_score(item) -> float:
+        group = item if isinstance(item, list) else [item]
+        return max((h.get("score", 0) for h in group if isinstance(h, dict)), default=0)
+
+    for item in chunks:
+        for hit in (item if isinstance(item, list) else [item]):
+            boost(hit)
+    return sorted(chunks, key=best_score, reverse=True)
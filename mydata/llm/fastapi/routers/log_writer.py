@@ -0,0 +1,133 @@
+import os
+import time
+import asyncio
+import logging
+from typing import List, Optional, Tuple
+
+from . import chat_db
+
+# === チャットログの非同期書き込み（キュー＋バックグラウンドタスクでまとめて追記） ===
+# ✅ イベントループ上で DB 書き込みしない（遅いディスクや NFS で全ストリームが止まるのを防ぐ）
+# ✅ FLUSH_INTERVAL 秒ごと、または MAX_BATCH 件たまった時点で、1トランザクションにまとめて追記
+# ✅ ルーム内の追記順は投入順のまま（書き込みタスクは1つ）
+# ✅ append() は書き込み完了まで待つ（従来の同期書き込みと同じく、戻った時点でOSへ渡っている）
+#    submit() は待たない（ストリーム終了時など、応答を止めたくない箇所用）
+# ✅ 停止時はキューを最後まで書き切ってから終了
+
+FLUSH_INTERVAL = float(os.getenv("CHAT_LOG_FLUSH_INTERVAL", "0.05"))
+MAX_BATCH = int(os.getenv("CHAT_LOG_MAX_BATCH", "256"))
+
+def write_rows(entries: List[Tuple[str, dict]]):
+    """(room_id, entry) の列を追記（スレッドで実行。CHAT_LOG_FSYNC=1 で synchronous=FULL）"""
+    chat_db.insert_messages(entries)
+
+class ChatLogWriter:
+    def __init__(self):
+        self.queue: Optional[asyncio.Queue] = None
+        self.task: Optional[asyncio.Task] = None
+        self.stats = {"entries": 0, "batches": 0, "writes": 0, "errors": 0, "max_batch": 0}
+
+    @property
+    def running(self) -> bool:
+        return self.task is not None and not self.task.done()
+
+    async def start(self):
+        if self.running:
+            return
+        self.queue = asyncio.Queue()
+        self.task = asyncio.create_task(self._run())
+        logging.info(f"[LOG] 非同期ログ書き込み開始 (interval={FLUSH_INTERVAL}s, batch={MAX_BATCH})")
+
+    async def stop(self):
+        """キューを書き切ってから停止"""
+        if not self.running:
+            return
+        await self.queue.put(None)
+        await self.task
+        self.task = None
+        logging.info(f"[LOG] 非同期ログ書き込み停止: {self.stats}")
+
+    def submit(self, room_id: str, entry: dict, wait: bool = False) -> Optional[asyncio.Future]:
+        """
+        追記を予約して即座に戻る（イベントループ上から呼ぶ。失敗はログのみ）
+        書き込みタスクが動いていない場合（起動前・単体利用）はその場で同期書き込み
+        """
+        if not self.running:
+            write_rows([(room_id, entry)])
+            return None
+        future = asyncio.get_running_loop().create_future() if wait else None
+        self.queue.put_nowait((room_id, entry, future))
+        return future
+
+    async def append(self, room_id: str, entry: dict):
+        """追記して書き込み完了まで待つ（失敗時は例外）"""
+        future = self.submit(room_id, entry, wait=True)
+        if future is not None:
+            await future
+
+    async def drain(self):
+        """その時点までに投入された分の書き込み完了を待つ"""
+        if self.running:
+            await self.queue.join()
+
+    async def _collect(self) -> Tuple[List[tuple], bool]:
+        """最初の1件を待ち、その後 FLUSH_INTERVAL の間に届いた分をまとめる"""
+        batch, stop = [], False
+        item = await self.queue.get()
+        deadline = time.monotonic() + FLUSH_INTERVAL
+        while True:
+            if item is None:
+                stop = True
+                self.queue.task_done()
+            else:
+                batch.append(item)
+            if stop or len(batch) >= MAX_BATCH:
+                break
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                item = await asyncio.wait_for(self.queue.get(), timeout)
+            except asyncio.TimeoutError:
+                break
+        return batch, stop
+
+    async def _run(self):
+        while True:
+            batch, stop = await self._collect()
+            if batch:
+                await self._flush(batch)
+            if stop:
+                # 停止指示より後に届いた分も書き切る
+                rest = []
+                while not self.queue.empty():
+                    item = self.queue.get_nowait()
+                    if item is None:
+                        self.queue.task_done()
+                    else:
+                        rest.append(item)
+                if rest:
+                    await self._flush(rest)
+                return
+
+    async def _flush(self, batch: List[tuple]):
+        self.stats["entries"] += len(batch)
+        self.stats["batches"] += 1
+        self.stats["max_batch"] = max(self.stats["max_batch"], len(batch))
+        error = None
+        try:
+            await asyncio.to_thread(write_rows, [(room_id, entry) for room_id, entry, _ in batch])
+            self.stats["writes"] += 1
+        except Exception as e:
+            self.stats["errors"] += 1
+            logging.error(f"[LOG SAVE ERROR]: {len(batch)}件: {e}")
+            error = e
+        for _, _, future in batch:
+            if future is not None and not future.done():
+                if error is None:
+                    future.set_result(None)
+                else:
+                    future.set_exception(error)
+            self.queue.task_done()
+
+log_writer = ChatLogWriter()
@@ -0,0 +1,107 @@
+from fastapi import APIRouter
+from collections import deque
+import time
+import logging
+
+router = APIRouter(prefix="/v1/metrics")
+
+# === llama.cpp のプロンプトキャッシュ効果（プリフィル削減量）の集計 ===
+# llama.cpp のストリーム最終チャンクの timings:
+#   prompt_n: 実際にプリフィルしたトークン数 / cache_n: KVキャッシュから再利用したトークン数
+RECENT_TURNS = 100
+
+_prompt_cache = {"turns": 0, "prompt_tokens": 0, "cached_tokens": 0, "prompt_ms": 0.0}
+_recent = deque(maxlen=RECENT_TURNS)
+
+def record_prompt_cache(room_id: str, slot: int, timings: dict):
+    """1ターン分の timings を記録"""
+    prompt_n = int(timings.get("prompt_n") or 0)
+    cache_n = int(timings.get("cache_n") or 0)
+    prompt_ms = float(timings.get("prompt_ms") or 0.0)
+    total = prompt_n + cache_n
+
+    _prompt_cache["turns"] += 1
+    _prompt_cache["prompt_tokens"] += prompt_n
+    _prompt_cache["cached_tokens"] += cache_n
+    _prompt_cache["prompt_ms"] += prompt_ms
+    _recent.append({
+        "time": time.time(),
+        "room_id": room_id,
+        "slot": slot,
+        "prompt_tokens": prompt_n,
+        "cached_tokens": cache_n,
+        "prompt_ms": round(prompt_ms, 1),
+    })
+    logging.info(
+        f"[METRICS] プリフィル: {prompt_n} tokens / キャッシュ再利用: {cache_n} tokens "
+        f"({(cache_n / total * 100) if total else 0:.1f}%, {prompt_ms:.0f}ms, room={room_id or '-'}, slot={slot})"
+    )
+
+@router.get("/prompt_cache")
+def get_prompt_cache_metrics():
+    total = _prompt_cache["prompt_tokens"] + _prompt_cache["cached_tokens"]
+    return {
+        "success": True,
+        "data": {
+            **_prompt_cache,
+            "prompt_ms": round(_prompt_cache["prompt_ms"], 1),
+            "cache_ratio": round(_prompt_cache["cached_tokens"] / total, 4) if total else 0.0,
+            "recent": list(_recent),
+        },
+        "error": None,
+    }
+
+# === クライアント切断による生成の打ち切り（止めた生成で浪費・節約したトークン数） ===
+# generated_tokens: 打ち切りまでに生成済みだったトークン数（誰にも読まれなかった計算）
+# reclaimed_tokens_est: 打ち切らなければ生成していたと見込まれる残りのトークン数
+#                       （最後まで生成した回答の平均トークン数 − 生成済み。下限 0）
+_completion = {"turns": 0, "tokens": 0}
+_aborts = {"turns": 0, "generated_tokens": 0, "reclaimed_tokens_est": 0, "by_phase": {}}
+_recent_aborts = deque(maxlen=RECENT_TURNS)
+
+def record_completion(timings: dict):
+    """最後まで生成できた1ターン分の生成トークン数（timings.predicted_n）を記録"""
+    predicted_n = int(timings.get("predicted_n") or 0)
+    if predicted_n:
+        _completion["turns"] += 1
+        _completion["tokens"] += predicted_n
+
+def average_completion_tokens() -> float:
+    return _completion["tokens"] / _completion["turns"] if _completion["turns"] else 0.0
+
+def record_abort(room_id: str, phase: str, generated_tokens: int, abort_ms: float):
+    """
+    クライアント切断で上流を打ち切った1ターン分を記録
+    - phase: 切断時点の段階（retrieving / prefill / generating）
+    - abort_ms: 切断を検知してから上流の接続を閉じるまでの時間
+    """
+    reclaimed = max(int(average_completion_tokens()) - generated_tokens, 0)
+    _aborts["turns"] += 1
+    _aborts["generated_tokens"] += generated_tokens
+    _aborts["reclaimed_tokens_est"] += reclaimed
+    _aborts["by_phase"][phase] = _aborts["by_phase"].get(phase, 0) + 1
+    _recent_aborts.append({
+        "time": time.time(),
+        "room_id": room_id,
+        "phase": phase,
+        "generated_tokens": generated_tokens,
+        "reclaimed_tokens_est": reclaimed,
+        "abort_ms": round(abort_ms, 1),
+    })
+    logging.info(
+        f"[METRICS] 切断により生成を中止: phase={phase} / 生成済み {generated_tokens} tokens / "
+        f"節約見込み {reclaimed} tokens ({abort_ms:.0f}ms, room={room_id or '-'})"
+    )
+
+@router.get("/aborts")
+def get_abort_metrics():
+    return {
+        "success": True,
+        "data": {
+            **_aborts,
+            "completed_turns": _completion["turns"],
+            "avg_completion_tokens": round(average_completion_tokens(), 1),
+            "recent": list(_recent_aborts),
+        },
+        "error": None,
+    }
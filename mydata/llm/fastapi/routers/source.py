@@ -0,0 +1,196 @@
+from fastapi import APIRouter, HTTPException, Request, Response
+from pathlib import Path
+from functools import lru_cache
+from typing import Optional
+import os
+import re
+import mmap
+import hashlib
+import logging
+
+router = APIRouter(prefix="/v1/source")
+
+# === テキストストア（vectorコンテナの db/text。/mydata は共有マウント） ===
+TEXT_ROOT = Path(os.getenv("SOURCE_TEXT_ROOT", "/mydata/llm/vector/db/text")).resolve()
+EXCERPT_CACHE_SIZE = int(os.getenv("SOURCE_EXCERPT_CACHE_SIZE", "256"))
+
+DEFAULT_CHARS = 500
+MAX_CHARS = 20000
+MAX_PAGES = 10
+MAX_BYTES_PER_CHAR = 4  # UTF-8
+MARKER_MARGIN = 32      # 窓の端で切れたページマーカーを読み切るための余白バイト
+
+HEADER_SEPARATOR = b"----------------------------------------\n"
+PAGE_MARKER = b"<<page:"
+PAGE_MARKER_LINE = re.compile(r"<<page:(\d+)>>\n?")
+
+def resolve_text_path(rel_path: str) -> Path:
+    """TEXT_ROOT 配下のファイルのみ許可（../ などでの脱出を防ぐ）"""
+    path = (TEXT_ROOT / rel_path).resolve()
+    if TEXT_ROOT not in path.parents or not path.is_file():
+        raise HTTPException(status_code=404, detail="Source not found")
+    return path
+
+def align_start(mm, pos: int) -> int:
+    """UTF-8 の継続バイト（0b10xxxxxx）上なら次の文字先頭まで進める"""
+    while pos < len(mm) and (mm[pos] & 0xC0) == 0x80:
+        pos += 1
+    return pos
+
+def align_back(mm, pos: int) -> int:
+    """文字の途中で切れないよう、pos が継続バイトなら文字先頭まで戻す"""
+    while 0 < pos < len(mm) and (mm[pos] & 0xC0) == 0x80:
+        pos -= 1
+    return pos
+
+def body_start_of(mm) -> int:
+    """メタ情報ヘッダー直後のバイト位置（ヘッダーがなければ 0）"""
+    pos = mm.find(HEADER_SEPARATOR)
+    return pos + len(HEADER_SEPARATOR) if pos >= 0 else 0
+
+def page_window(mm, body_start: int, byte_start: int, byte_end: int, pages: int):
+    """
+    チャンクを含むページ＋前後 pages ページ分のバイト範囲
+    ページマーカーのない文書は None（文字数ウィンドウにフォールバック）
+    """
+    start = mm.rfind(PAGE_MARKER, body_start, byte_start)
+    if start < 0:
+        return None
+    for _ in range(pages):
+        prev = mm.rfind(PAGE_MARKER, body_start, start)
+        if prev < 0:
+            break
+        start = prev
+
+    end = mm.find(PAGE_MARKER, byte_end)
+    for _ in range(pages):
+        if end < 0:
+            break
+        end = mm.find(PAGE_MARKER, end + 1)
+    return start, (end if end >= 0 else len(mm))
+
+def page_at(mm, body_start: int, pos: int) -> Optional[int]:
+    """pos が属するページ番号（手前で最後のページマーカー。マーカーのない文書は None）"""
+    idx = mm.rfind(PAGE_MARKER, body_start, pos)
+    if idx < 0:
+        return None
+    m = PAGE_MARKER_LINE.match(mm[idx:idx + MARKER_MARGIN].decode("utf-8", errors="replace"))
+    return int(m.group(1)) if m else None
+
+def page_segments(text: str, page: Optional[int]) -> list:
+    """ページマーカーで区切った [(ページ番号, 本文), ...]（最初のマーカーより前は page のページ）"""
+    parts = PAGE_MARKER_LINE.split(text)
+    segments = [(page, parts[0])]
+    for i in range(1, len(parts), 2):
+        segments.append((int(parts[i]), parts[i + 1]))
+    return segments
+
+def keep_chars(segments: list, chars: int, from_end: bool = False) -> list:
+    """本文が chars 文字になるよう区切りごと切り詰める（from_end: 末尾側を残す）"""
+    kept, remaining = [], chars
+    for page, text in (reversed(segments) if from_end else segments):
+        if remaining <= 0:
+            break
+        part = text[-remaining:] if from_end else text[:remaining]
+        kept.append((page, part))
+        remaining -= len(part)
+    return kept[::-1] if from_end else kept
+
+@lru_cache(maxsize=EXCERPT_CACHE_SIZE)
+def read_excerpt(path_str: str, mtime_ns: int, size: int, byte_start: int, byte_end: int,
+                 chars: int, pages: int) -> dict:
+    """
+    必要なバイト範囲だけを mmap で切り出す（ファイル全体は読まない）
+    ✅ mtime_ns / size をキーに含めるため、テキスト更新時は自動的に別エントリになる
+    """
+    with open(path_str, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        body_start = body_start_of(mm)
+        byte_start = align_back(mm, min(max(byte_start, body_start), len(mm)))
+        byte_end = align_back(mm, min(max(byte_end, byte_start), len(mm)))
+
+        window = page_window(mm, body_start, byte_start, byte_end, pages) if pages >= 0 else None
+        by_chars = window is None
+        if by_chars:
+            # ✅ 前後 chars 文字分（最大4バイト/文字）だけ読む
+            margin = chars * MAX_BYTES_PER_CHAR + MARKER_MARGIN
+            window = (
+                align_start(mm, max(body_start, byte_start - margin)),
+                align_back(mm, min(len(mm), byte_end + margin)),
+            )
+        win_start, win_end = window
+        before = mm[win_start:byte_start].decode("utf-8", errors="replace")
+        match = mm[byte_start:byte_end].decode("utf-8", errors="replace")
+        after = mm[byte_end:win_end].decode("utf-8", errors="replace")
+        first_page = page_at(mm, body_start, win_start)
+
+    # ✅ ページ番号は切り詰め後に実際に返す本文から数える（窓の先頭ページはマーカーより前の本文の分）
+    before_segments = page_segments(before, first_page)
+    match_segments = page_segments(match, before_segments[-1][0])
+    after_segments = page_segments(after, match_segments[-1][0])
+    if by_chars:
+        before_segments = keep_chars(before_segments, chars, from_end=True)
+        after_segments = keep_chars(after_segments, chars)
+
+    page_numbers = []
+    for segments, always in ((before_segments, False), (match_segments, True), (after_segments, False)):
+        for page, text in segments:
+            if page is not None and (text or always) and page not in page_numbers:
+                page_numbers.append(page)
+    return {
+        "before": "".join(text for _, text in before_segments),
+        "match": "".join(text for _, text in match_segments),
+        "after": "".join(text for _, text in after_segments),
+        "byte_start": byte_start,
+        "byte_end": byte_end,
+        "pages": page_numbers,
+    }
+
+@router.get("/excerpt")
+def get_excerpt(
+    request: Request,
+    response: Response,
+    path: str,
+    byte_start: int,
+    byte_end: int,
+    chars: int = DEFAULT_CHARS,
+    pages: Optional[int] = None,
+):
+    """
+    引用チャンク周辺の原文を返す
+    - path: db/text 基準の相対パス（検索結果の path）
+    - byte_start / byte_end: チャンクのバイト位置（検索結果の byte_start / byte_end）
+    - chars: 前後に付ける文字数
+    - pages: 指定時はページ単位（0=チャンクを含むページのみ、N=前後Nページ追加）。
+             ページ区切りのない文書（Excel等）は chars にフォールバック
+    """
+    chars = min(max(chars, 0), MAX_CHARS)
+    pages = -1 if pages is None else min(max(pages, 0), MAX_PAGES)
+    text_path = resolve_text_path(path)
+    stat = text_path.stat()
+    if stat.st_size == 0:
+        raise HTTPException(status_code=404, detail="Source is empty")
+
+    # ✅ ETag はファイルの版と要求範囲から作る（本文を読まずに 304 を返せる）
+    etag_source = f"{path}:{stat.st_mtime_ns}:{stat.st_size}:{byte_start}:{byte_end}:{chars}:{pages}"
+    etag = '"' + hashlib.sha1(etag_source.encode("utf-8")).hexdigest() + '"'
+    headers = {"ETag": etag, "Cache-Control": "private, no-cache"}
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers=headers)
+
+    try:
+        data = read_excerpt(str(text_path), stat.st_mtime_ns, stat.st_size, byte_start, byte_end, chars, pages)
+    except (OSError, ValueError) as e:
+        logging.error(f"[SOURCE] 抜粋読み込み失敗: {path}: {e}")
+        raise HTTPException(status_code=500, detail=f"抜粋読み込み失敗: {e}")
+
+    response.headers.update(headers)
+    return {"success": True, "data": {"path": path, **data}, "error": None}
+
+@router.get("/excerpt/cache")
+def get_excerpt_cache_info():
+    info = read_excerpt.cache_info()
+    return {
+        "success": True,
+        "data": {"hits": info.hits, "misses": info.misses, "size": info.currsize, "max_size": info.maxsize},
+        "error": None,
+    }
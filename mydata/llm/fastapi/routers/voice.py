@@ -2,22 +2,25 @@ from fastapi import APIRouter, HTTPException
 from pydantic import BaseModel
 from fastapi.responses import JSONResponse
 import os
-import requests
 import io
+import asyncio
+import httpx
 from pydub import AudioSegment
 import re
 
+from .http_clients import get_client
+
 router = APIRouter(prefix="/v1/voice")
 
 VOICEVOX_HOST = os.getenv("VOICEVOX_HOST", "http://voicevox:50021")
 
 # === ユーティリティ ===
-def get_json(endpoint: str):
+async def get_json(endpoint: str):
     try:
-        res = requests.get(f"{VOICEVOX_HOST}{endpoint}")
+        res = await get_client("voicevox").get(f"{VOICEVOX_HOST}{endpoint}")
         res.raise_for_status()
         return res.json()
-    except requests.exceptions.RequestException as e:
+    except httpx.HTTPError as e:
         raise HTTPException(status_code=500, detail=f"VOICEVOX接続エラー: {str(e)}")
 
 def split_sentences(text: str):
@@ -25,11 +28,18 @@ def split_sentences(text: str):
     parts = re.split(r'[。！？]\s*|\n+', text)
     return [p.strip() for p in parts if p.strip()]
 
+def wav_to_mp3_hex(wav: bytes) -> str:
+    # MP3変換（メモリ上のみ）→ クライアント用：hex文字列
+    audio = AudioSegment.from_file(io.BytesIO(wav), format="wav")
+    mp3_bytes = io.BytesIO()
+    audio.export(mp3_bytes, format="mp3")
+    return mp3_bytes.getvalue().hex()
+
 # === 話者一覧取得 ===
 @router.get("/speakers")
-def get_speakers():
+async def get_speakers():
     try:
-        speakers = get_json("/speakers")
+        speakers = await get_json("/speakers")
         return {"success": True, "data": speakers, "error": None}
     except HTTPException as e:
         raise e
@@ -42,8 +52,9 @@ class SynthesisRequest(BaseModel):
 
 # === 文単位の音声合成 API（保存なし版）===
 @router.post("/synthesize_multi")
-def synthesize_multi(body: SynthesisRequest):
+async def synthesize_multi(body: SynthesisRequest):
     try:
+        client = get_client("voicevox")
         speaker_param = body.style_id
         sentences = split_sentences(body.text)
         audio_blobs = []
@@ -53,33 +64,26 @@ def synthesize_multi(body: SynthesisRequest):
                 continue
 
             # STEP1: audio_query
-            query_res = requests.post(
+            query_res = await client.post(
                 f"{VOICEVOX_HOST}/audio_query",
                 params={"text": sentence, "speaker": speaker_param}
             )
             query_res.raise_for_status()
 
             # STEP2: synthesis（WAVバイナリ取得）
-            synth_res = requests.post(
+            synth_res = await client.post(
                 f"{VOICEVOX_HOST}/synthesis",
                 params={"speaker": speaker_param},
                 json=query_res.json()
             )
             synth_res.raise_for_status()
 
-            # STEP3: MP3変換（メモリ上のみ）
-            wav_bytes = io.BytesIO(synth_res.content)
-            audio = AudioSegment.from_file(wav_bytes, format="wav")
-            mp3_bytes = io.BytesIO()
-            audio.export(mp3_bytes, format="mp3")
-            mp3_bytes.seek(0)
-
-            # クライアント用：hex文字列で返す
-            audio_blobs.append(mp3_bytes.read().hex())
+            # STEP3: MP3変換（ffmpeg 呼び出しのためイベントループ外で実行）
+            audio_blobs.append(await asyncio.to_thread(wav_to_mp3_hex, synth_res.content))
 
         return JSONResponse(content={"success": True, "data": audio_blobs, "error": None})
 
-    except requests.exceptions.RequestException as e:
+    except httpx.HTTPError as e:
         raise HTTPException(status_code=500, detail=f"VOICEVOX接続エラー: {str(e)}")
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"音声合成処理失敗: {str(e)}")
@@ -152,6 +152,7 @@ async function sendChatMessage(text, model, speaker_uuid, style_id, roomId) {
   const decoder = new TextDecoder("utf-8");
   let assistantText = "";
   let buffer = "";
+  let streamError = null;
 
   while (true) {
     const { value, done } = await reader.read();
@@ -168,6 +169,22 @@ async function sendChatMessage(text, model, speaker_uuid, style_id, roomId) {
 
       try {
         const parsed = JSON.parse(chunk);
+
+        // ✅ RAG の進捗イベント（トークンより先に届く。本文には含めない）
+        if (parsed.object === "rag.status") {
+          if (parsed.status === "error") {
+            streamError = parsed.detail || "不明なエラー";
+            updateAssistantText(`[llama エラー] ${streamError}`, messageId);
+          } else if (!assistantText && STATUS_LABELS[parsed.status]) {
+            updateAssistantText(STATUS_LABELS[parsed.status], messageId);
+          }
+          continue;
+        }
+        if (parsed.object === "rag.sources") {
+          renderSources(parsed.sources || [], messageId);
+          continue;
+        }
+
         const delta = parsed.choices?.[0]?.delta?.content || "";
         assistantText += delta;
         updateAssistantText(assistantText, messageId);
@@ -178,6 +195,8 @@ async function sendChatMessage(text, model, speaker_uuid, style_id, roomId) {
     }
   }
 
+  if (streamError) return;
+
   const audioUrls = await synthesizeMultiSpeech(assistantText, speaker_uuid, style_id);
   for (const url of audioUrls) {
     const audio = new Audio(url);
@@ -188,20 +207,7 @@ async function sendChatMessage(text, model, speaker_uuid, style_id, roomId) {
     });
   }
 
-  await fetch("/v1/chat/messages", {
-    method: "POST",
-    headers: { "Content-Type": "application/json" },
-    body: JSON.stringify({
-      room_id: roomId,
-      message: {
-        role: "assistant",
-        content: assistantText,
-        model,
-        speaker_uuid,
-        style_id,
-      },
-    }),
-  });
+  // ✅ 回答の保存はサーバー側（/v1/chat/completions）で1回だけ行う（途中で切断した場合も含む）
 }
 
 function appendMessage(role, content, model = "") {
@@ -235,6 +241,41 @@ function appendMessage(role, content, model = "") {
   return messageId;
 }
 
+const STATUS_LABELS = {
+  retrieving: "[資料を検索中…]",
+  generating: "[生成中…]",
+};
+
+// ✅ 回答の参考にした資料（ファイル単位にまとめ、ページ番号を併記）
+function renderSources(sources, messageId) {
+  const bubble = document.getElementById(messageId);
+  if (!bubble || !sources.length) return;
+
+  const files = new Map();
+  for (const s of sources) {
+    if (!s.path) continue;
+    if (!files.has(s.path)) files.set(s.path, new Set());
+    if (s.page != null) files.get(s.path).add(s.page);
+  }
+  if (!files.size) return;
+
+  let list = bubble.querySelector(".sources");
+  if (!list) {
+    list = document.createElement("div");
+    list.className = "sources";
+    bubble.appendChild(list);
+  }
+  list.textContent = "";
+  for (const [path, pages] of files) {
+    const item = document.createElement("div");
+    item.className = "source-item";
+    const pageText = pages.size ? ` (p.${[...pages].sort((a, b) => a - b).join(", ")})` : "";
+    item.textContent = `📄 ${path.split("/").pop()}${pageText}`;
+    item.title = path;
+    list.appendChild(item);
+  }
+}
+
 function updateAssistantText(content, messageId) {
   const bubble = document.getElementById(messageId);
   if (!bubble) return;
@@ -248,7 +289,11 @@ function updateAssistantText(content, messageId) {
   }
 }
 
-const chatObserver = new MutationObserver(() => scrollToBottom());
+const chatObserver = new MutationObserver(() => {
+  // 古いメッセージの読み込み中（先頭への差し込み）は表示位置を保つ
+  if (chatContainer?.dataset.keepScroll) return;
+  scrollToBottom();
+});
 const chatContainer = document.getElementById("chat-messages");
 if (chatContainer) {
   chatObserver.observe(chatContainer, {
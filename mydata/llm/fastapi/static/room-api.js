@@ -129,38 +129,85 @@ export async function loadMessages(roomId) {
   container.innerHTML = "";
 
   try {
-    const res = await fetch(`/v1/chat/messages/${roomId}`);
-    if (!res.ok) throw new Error(`status=${res.status}`);
-    const result = await res.json();
-    const messages = Array.isArray(result?.data) ? result.data : [];
+    const page = await fetchMessagePage(roomId);
+    page.messages.forEach((msg) => container.appendChild(createMessageElement(msg)));
+    updateLoadOlderButton(container, roomId, page.paging);
+    container.scrollTop = container.scrollHeight;
+  } catch (e) {
+    console.warn("メッセージ取得失敗:", e);
+  }
+}
 
-    messages.forEach((msg) => {
-      const wrapper = document.createElement("div");
-      wrapper.className = msg.role;
+// ✅ メッセージはページ単位（新しい方から）で取得。古いメッセージは paging.next_before で続きを読む
+async function fetchMessagePage(roomId, before = null) {
+  const query = before != null ? `?before=${encodeURIComponent(before)}` : "";
+  const res = await fetch(`/v1/chat/messages/${roomId}${query}`);
+  if (!res.ok) throw new Error(`status=${res.status}`);
+  const result = await res.json();
+  return {
+    messages: Array.isArray(result?.data) ? result.data : [],
+    paging: result?.paging || { has_more: false, next_before: null },
+  };
+}
 
-      const bubble = document.createElement("div");
-      bubble.className = "bubble";
+async function loadOlderMessages(container, roomId, before) {
+  const page = await fetchMessagePage(roomId, before);
+  const prevHeight = container.scrollHeight;
+
+  // ✅ 先頭へ差し込むため、下端への自動スクロールを止めて表示位置を保つ
+  container.dataset.keepScroll = "1";
+  const anchor = container.querySelector(".load-older")?.nextSibling || container.firstChild;
+  page.messages.forEach((msg) => container.insertBefore(createMessageElement(msg), anchor));
+  updateLoadOlderButton(container, roomId, page.paging);
+  container.scrollTop = container.scrollHeight - prevHeight;
+  setTimeout(() => delete container.dataset.keepScroll, 0);
+}
 
-      if (msg.role === "assistant" && msg.model) {
-        const modelTag = document.createElement("div");
-        modelTag.className = "model-name";
-        modelTag.textContent = extractModelName(msg.model); // ✅ 修正点
-        bubble.appendChild(modelTag);
-      }
+function updateLoadOlderButton(container, roomId, paging) {
+  let button = container.querySelector(".load-older");
+  if (!paging?.has_more) {
+    button?.remove();
+    return;
+  }
+  if (!button) {
+    button = document.createElement("button");
+    button.className = "load-older";
+    button.textContent = "以前のメッセージを読み込む";
+    container.insertBefore(button, container.firstChild);
+  }
+  button.onclick = async () => {
+    button.disabled = true;
+    try {
+      await loadOlderMessages(container, roomId, paging.next_before);
+    } catch (e) {
+      console.warn("メッセージ取得失敗:", e);
+    } finally {
+      button.disabled = false;
+    }
+  };
+}
 
-      const text = document.createElement("div");
-      text.className = "message-text";
-      text.textContent = msg.content;
-      bubble.appendChild(text);
+function createMessageElement(msg) {
+  const wrapper = document.createElement("div");
+  wrapper.className = msg.role;
 
-      wrapper.appendChild(bubble);
-      container.appendChild(wrapper);
-    });
+  const bubble = document.createElement("div");
+  bubble.className = "bubble";
 
-    container.scrollTop = container.scrollHeight;
-  } catch (e) {
-    console.warn("メッセージ取得失敗:", e);
+  if (msg.role === "assistant" && msg.model) {
+    const modelTag = document.createElement("div");
+    modelTag.className = "model-name";
+    modelTag.textContent = extractModelName(msg.model); // ✅ 修正点
+    bubble.appendChild(modelTag);
   }
+
+  const text = document.createElement("div");
+  text.className = "message-text";
+  text.textContent = msg.content;
+  bubble.appendChild(text);
+
+  wrapper.appendChild(bubble);
+  return wrapper;
 }
 
 
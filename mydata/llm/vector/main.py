@@ -17,10 +17,14 @@ VECTOR_CONFIG_PATHS = [
     Path("/mydata/llm/vector/vector_config_vector_excel_calendar.json"),
 ]
 
-JOINABLE_SOURCES = {"pdf", "word"}
+JOINABLE_SOURCES = {"pdf", "word", "image"}
 EXCEL_SOURCES = {"excel", "calendar"}
 
 BASE_CHUNK_PATH = Path("/mydata/llm/vector/db/chunk")
+BASE_TEXT_PATH = Path("/mydata/llm/vector/db/text")
+OFFSET_KEYS = ("page", "page_end", "char_start", "char_end", "byte_start", "byte_end")
+# ✅ 登録・削除スクリプト（script/index_version.py）が更新するインデックス版
+INDEX_VERSION_PATH = Path("/mydata/llm/vector/db/index_version.json")
 
 
 def load_vector_configs():
@@ -33,6 +37,32 @@ def load_vector_configs():
     return configs
 
 
+def read_index_version() -> str:
+    try:
+        with INDEX_VERSION_PATH.open("r", encoding="utf-8") as f:
+            return str(json.load(f).get("version", "0"))
+    except (FileNotFoundError, json.JSONDecodeError):
+        return "0"
+
+
+@app.post("/embed")
+async def embed(request: Request):
+    """
+    テキストの埋め込みのみ返す（検索なし）
+    ✅ 呼び出し側（回答キャッシュ）が版の一致を確認できるよう、インデックス版を併せて返す
+    """
+    body = await request.json()
+    texts = body.get("texts") or ([body["query"]] if body.get("query") else [])
+    if not texts:
+        return JSONResponse(content={"success": False, "data": None, "error": "Missing texts"}, status_code=400)
+    embeddings = model.encode(texts, convert_to_numpy=True, normalize_embeddings=True).tolist()
+    return {
+        "success": True,
+        "data": {"embeddings": embeddings, "index_version": read_index_version()},
+        "error": None,
+    }
+
+
 @app.post("/embed_search")
 async def embed_search(request: Request):
     # ✅ リクエストID（ms単位のタイムスタンプ）
@@ -49,10 +79,15 @@ async def embed_search(request: Request):
 
     threshold = body.get("threshold", 0.65)
     top_k = body.get("top_k", 50)
+    collapse_duplicates = body.get("collapse_duplicates", False)
     raw_hits = []
 
     formatted_query = query
-    embedding = model.encode([formatted_query], convert_to_numpy=True, normalize_embeddings=True).tolist()
+    if body.get("embedding"):
+        # ✅ 呼び出し側で計算済み（/embed）の埋め込みがあれば再計算しない
+        embedding = [body["embedding"]]
+    else:
+        embedding = model.encode([formatted_query], convert_to_numpy=True, normalize_embeddings=True).tolist()
 
     for config in load_vector_configs():
         try:
@@ -83,16 +118,24 @@ async def embed_search(request: Request):
                     relative_path = metadata.get("path") or ""
                     absolute_path = str(BASE_CHUNK_PATH / relative_path)
 
-                    raw_hits.append({
+                    hit = {
                         "score": score,
                         "uid": metadata.get("uid"),
                         "path": relative_path,
                         "absolute_path": absolute_path,
-                        "chunk_index": metadata.get("chunk_index", -1),
+                        "chunk_index": metadata.get("index", metadata.get("chunk_index", -1)),  # ✅ 登録時のキーは index
+                        "dup_of": metadata.get("dup_of"),        # 近似重複チャンクの重複元ID
                         "source": source,
                         "type": chunk_type,
-                        "text": text.strip()
-                    })
+                        "sheet": metadata.get("sheet"),          # Excel: シート名
+                        "row_lines": metadata.get("row_lines"),  # Excel: 行番号（JSON文字列）
+                        "text": text.strip(),
+                        # ✅ 出典位置（db/text ファイルを seek / mmap で切り出すための範囲）
+                        "text_path": str(BASE_TEXT_PATH / relative_path),
+                    }
+                    for key in OFFSET_KEYS:
+                        hit[key] = metadata.get(key)
+                    raw_hits.append(hit)
         except Exception as e:
             print(f"[ERROR] コレクション検索失敗: {config.get('collection_name')} → {e}")
             continue
@@ -112,6 +155,19 @@ async def embed_search(request: Request):
     added = set()
     raw_hits.sort(key=lambda x: x["score"], reverse=True)
 
+    if collapse_duplicates:
+        # ✅ 近似重複（版違いの書面）はスコア最上位の1件だけ残す
+        seen_groups = set()
+        collapsed = []
+        for hit in raw_hits:
+            group = hit["dup_of"] or f"{hit['uid']}-{hit['chunk_index']}"
+            if group in seen_groups:
+                continue
+            seen_groups.add(group)
+            collapsed.append(hit)
+        print(f"[INFO] ✅ 近似重複の集約: {len(raw_hits)} → {len(collapsed)} 件")
+        raw_hits = collapsed
+
     for main_hit in raw_hits[:3]:
         if main_hit["uid"] not in added:
             context_hits.append(main_hit)
@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+bench_word_extract.py
+Word系テキスト抽出のベンチマーク（形式別 files/sec）
+- 直接抽出（.docx / .rtf）と LibreOffice → PDF → PyPDF2 経路を同じファイル群で比較
+- 結果ファイルは書き出さない（抽出のみ計測）
+
+使用方法: python3 bench_word_extract.py <フォルダー> [--libreoffice]
+"""
+
+import sys
+import time
+import shutil
+from pathlib import Path
+from collections import defaultdict
+
+from word_extract import extract_native_pages, NATIVE_EXTRACTORS
+
+BENCH_TMP = Path("/tmp/bench_word_pdf")
+EXTS = (".doc", ".docx", ".rtf")
+
+def bench_native(files: list) -> dict:
+    stats = defaultdict(lambda: [0, 0.0, 0])  # 拡張子 → [件数, 秒, 文字数]
+    for path in files:
+        ext = path.suffix.lower()
+        if ext not in NATIVE_EXTRACTORS:
+            continue
+        started = time.perf_counter()
+        try:
+            pages = extract_native_pages(path)
+        except Exception as e:
+            print(f"[WARN] 直接抽出失敗: {path.name} ({e})")
+            continue
+        stats[ext][0] += 1
+        stats[ext][1] += time.perf_counter() - started
+        stats[ext][2] += sum(len(p) for p in pages)
+    return stats
+
+def bench_libreoffice(files: list) -> dict:
+    from PyPDF2 import PdfReader
+    from soffice_pool import SofficePool
+
+    stats = defaultdict(lambda: [0, 0.0, 0])
+    BENCH_TMP.mkdir(parents=True, exist_ok=True)
+    # ✅ 起動時間は計測対象外（常駐プールの定常スループットを測る）
+    with SofficePool(1) as pool:
+        for seq, path in enumerate(files):
+            ext = path.suffix.lower()
+            pdf_path = BENCH_TMP / f"{seq:06d}.pdf"
+            started = time.perf_counter()
+            if not pool.convert(path, pdf_path):
+                continue
+            text_len = sum(len(p.extract_text() or "") for p in PdfReader(str(pdf_path)).pages)
+            stats[ext][0] += 1
+            stats[ext][1] += time.perf_counter() - started
+            stats[ext][2] += text_len
+            pdf_path.unlink(missing_ok=True)
+    shutil.rmtree(BENCH_TMP, ignore_errors=True)
+    return stats
+
+def print_stats(label: str, stats: dict):
+    print(f"=== {label} ===")
+    for ext, (count, elapsed, chars) in sorted(stats.items()):
+        rate = count / elapsed if elapsed > 0 else 0.0
+        print(f"  {ext:6s} {count:5d} 件 / {elapsed:8.2f} 秒 = {rate:8.2f} files/sec（{chars} 文字）")
+
+def main():
+    if len(sys.argv) < 2:
+        print("使用方法: python3 bench_word_extract.py <フォルダー> [--libreoffice]")
+        return
+
+    root = Path(sys.argv[1])
+    files = sorted(p for p in root.rglob("*") if p.is_file() and p.suffix.lower() in EXTS)
+    print(f"[INFO] 対象: {len(files)} 件")
+
+    print_stats("直接抽出（1プロセス）", bench_native(files))
+    if "--libreoffice" in sys.argv:
+        print_stats("LibreOffice経由（1インスタンス）", bench_libreoffice(files))
+
+if __name__ == "__main__":
+    main()
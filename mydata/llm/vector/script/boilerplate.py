@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+boilerplate.py
+文書内で繰り返されるヘッダー・フッター行の検出と除去（PDF / Word 共通）
+- 各ページの先頭・末尾数行を候補とし、数字を # に正規化して出現ページ数を数える
+  （「- 12 -」「令和5年(ワ)第123号」のようにページ番号・日付だけ違う行も同一視）
+- 一定割合以上のページに現れる行を定型行とみなし、ページ端から除去
+- 行構造が残っている整形前のページテキストに対して適用すること
+"""
+
+import re
+import math
+from collections import Counter
+
+EDGE_LINES = 3          # ページ先頭・末尾から候補とする行数
+MAX_LINE_CHARS = 80     # これより長い行は本文とみなし候補にしない
+MIN_PAGES = 3           # この回数以上（かつ MIN_RATIO 以上）出現したら定型行
+MIN_RATIO = 0.5
+
+DIGITS = re.compile(r"[0-9０-９]+")
+SPACES = re.compile(r"[\s　]+")
+
+def normalize_line(line: str) -> str:
+    line = SPACES.sub("", line)
+    return DIGITS.sub("#", line)
+
+def edge_indexes(lines: list) -> list:
+    """空行を除いた先頭・末尾 EDGE_LINES 行の行番号"""
+    filled = [i for i, line in enumerate(lines) if line.strip()]
+    return sorted(set(filled[:EDGE_LINES] + filled[-EDGE_LINES:]))
+
+class BoilerplateDetector:
+    """
+    使い方（ページは2回走査する。1回目で数え、2回目で除去）:
+        detector = BoilerplateDetector()
+        for text in pages: detector.add_page(text)
+        detector.finalize()
+        for text in pages: cleaned, removed = detector.strip(text)
+    """
+
+    def __init__(self):
+        self.counts = Counter()
+        self.chars = Counter()   # 候補行ごとの文字数合計（除去量の事前計算用）
+        self.num_pages = 0
+        self.repeated = set()
+        self.removed_chars = 0
+
+    def add_page(self, text: str):
+        self.num_pages += 1
+        lines = text.splitlines()
+        keys = set()
+        for i in edge_indexes(lines):
+            stripped = lines[i].strip()
+            if len(stripped) <= MAX_LINE_CHARS:
+                key = normalize_line(stripped)
+                keys.add(key)
+                self.chars[key] += len(stripped)
+        self.counts.update(keys)  # ✅ 1ページ内の重複は1回と数える
+
+    def finalize(self):
+        threshold = max(MIN_PAGES, math.ceil(self.num_pages * MIN_RATIO))
+        self.repeated = {key for key, count in self.counts.items() if key and count >= threshold}
+        # ✅ strip() で除去される文字数の合計（本文を書く前にヘッダーへ記録できる）
+        self.removed_chars = sum(self.chars[key] for key in self.repeated)
+        self.counts.clear()
+        self.chars.clear()
+
+    def strip(self, text: str) -> tuple:
+        """定型行を除いたページテキストと、除去した文字数を返す"""
+        if not self.repeated:
+            return text, 0
+        lines = text.splitlines()
+        drop = {
+            i for i in edge_indexes(lines)
+            if len(lines[i].strip()) <= MAX_LINE_CHARS and normalize_line(lines[i].strip()) in self.repeated
+        }
+        if not drop:
+            return text, 0
+        removed = sum(len(lines[i].strip()) for i in drop)
+        return "\n".join(line for i, line in enumerate(lines) if i not in drop), removed
+
+def strip_boilerplate(pages: list) -> tuple:
+    """ページテキストのリストから定型行を除去。(除去後ページ, 除去文字数) を返す"""
+    detector = BoilerplateDetector()
+    for text in pages:
+        detector.add_page(text)
+    detector.finalize()
+
+    return [detector.strip(text)[0] for text in pages], detector.removed_chars
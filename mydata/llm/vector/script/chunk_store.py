@@ -0,0 +1,358 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+chunk_store.py
+チャンクストア（uidハッシュで分割した zstd 圧縮 Parquet）
+- 旧形式: db/chunk/<テキスト相対パス>.jsonl（1文書1ファイル・各行に uid/path/type を重複保持）
+- 新形式: db/chunk_store/part=XX/seg-<連番>.parquet（追記） / tomb-<連番>.parquet（削除印）
+    列: uid, index, path, type, text, extra（その他のキーをJSON文字列で保持）
+- 同じ uid が複数セグメントにある場合は連番の大きいセグメントが有効（再チャンク化＝追記で上書き）
+- 削除印は、自分より連番の小さいセグメントの uid を無効化
+- メタ列（uid/index/path/type）だけの走査では text 列を読まない
+- compact: 有効行だけを新セグメントへ書き直し、古いファイルを削除
+  （新セグメントの連番が最大のため、途中で落ちても結果は変わらない）
+
+使用方法:
+  python3 chunk_store.py migrate            # db/chunk の JSONL を取り込む（初回のみ）
+  python3 chunk_store.py export [フォルダー]  # JSONL で書き出す（省略時は標準出力）
+  python3 chunk_store.py compact            # 全パーティションを圧縮
+  python3 chunk_store.py stats
+"""
+
+import os
+import re
+import sys
+import json
+import fcntl
+import zlib
+from pathlib import Path
+from contextlib import contextmanager
+from collections import defaultdict
+from typing import Iterator, Dict, Any, Iterable, List
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+import pyarrow.compute as pc
+
+ROOT = Path("/mydata/llm/vector")
+STORE_DIR = ROOT / "db/chunk_store"
+LEGACY_CHUNK_DIR = ROOT / "db/chunk"
+MIGRATED_MARKER = "MIGRATED"  # 移行済みの印（ストア直下。全件削除で空になっても再移行しない）
+
+NUM_PARTITIONS = int(os.getenv("CHUNK_STORE_PARTITIONS", "16"))
+FLUSH_ROWS = int(os.getenv("CHUNK_STORE_FLUSH_ROWS", "20000"))   # この行数を超えたら次の uid の前で書き出し
+COMPACT_SEGMENTS = int(os.getenv("CHUNK_STORE_COMPACT_SEGMENTS", "8"))
+COMPRESSION = "zstd"
+
+BASE_COLUMNS = ("uid", "index", "path", "type", "text")
+META_COLUMNS = ("uid", "index", "path", "type")
+SCHEMA = pa.schema([
+    ("uid", pa.string()),
+    ("index", pa.int32()),
+    ("path", pa.string()),
+    ("type", pa.string()),
+    ("text", pa.string()),
+    ("extra", pa.string()),
+])
+TOMB_SCHEMA = pa.schema([("uid", pa.string())])
+FILE_PATTERN = re.compile(r"^(seg|tomb)-(\d{8})\.parquet$")
+
+def partition_of(uid: str) -> int:
+    return zlib.crc32(uid.encode("utf-8")) % NUM_PARTITIONS
+
+def to_record(row: Dict[str, Any]) -> Dict[str, Any]:
+    """Parquet の1行 → 旧JSONLと同じ形のチャンクレコード"""
+    record = {key: row[key] for key in BASE_COLUMNS}
+    if row.get("extra"):
+        record.update(json.loads(row["extra"]))
+    return record
+
+class ChunkStore:
+
+    def __init__(self, root: Path = STORE_DIR):
+        self.root = Path(root)
+
+    # ====== 1. ファイル管理 ======
+    def part_dir(self, part: int) -> Path:
+        return self.root / f"part={part:02d}"
+
+    def exists(self) -> bool:
+        return self.root.exists() and any(self.root.glob("part=*/seg-*.parquet"))
+
+    @contextmanager
+    def locked(self):
+        """書き込み・圧縮はプロセス間で直列化"""
+        self.root.mkdir(parents=True, exist_ok=True)
+        with open(self.root / ".lock", "w") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def list_files(self, part: int):
+        """(セグメント [(連番, パス)], 削除印 [(連番, パス)])。連番の昇順"""
+        segs, tombs = [], []
+        part_dir = self.part_dir(part)
+        if part_dir.exists():
+            for path in part_dir.iterdir():
+                m = FILE_PATTERN.match(path.name)
+                if m:
+                    (segs if m.group(1) == "seg" else tombs).append((int(m.group(2)), path))
+        return sorted(segs), sorted(tombs)
+
+    def next_seq(self, part: int) -> int:
+        segs, tombs = self.list_files(part)
+        return max((seq for seq, _ in segs + tombs), default=0) + 1
+
+    def write_file(self, part: int, kind: str, table: pa.Table) -> Path:
+        """一時ファイル → 置換で書き出し（呼び出し側でロック取得済みであること）"""
+        part_dir = self.part_dir(part)
+        part_dir.mkdir(parents=True, exist_ok=True)
+        path = part_dir / f"{kind}-{self.next_seq(part):08d}.parquet"
+        tmp_path = path.with_suffix(".parquet.tmp")
+        pq.write_table(table, tmp_path, compression=COMPRESSION)
+        os.replace(tmp_path, path)
+        return path
+
+    # ====== 2. 有効行の判定 ======
+    def live_segments(self, part: int) -> tuple:
+        """
+        uid → 有効なセグメントの連番 と セグメント一覧を返す
+        ✅ uid 列だけを読む
+        """
+        segs, tombs = self.list_files(part)
+        seg_of = {}
+        for seq, path in segs:
+            for uid in pq.read_table(path, columns=["uid"]).column("uid").to_pylist():
+                seg_of[uid] = seq
+        for seq, path in tombs:
+            for uid in pq.read_table(path, columns=["uid"]).column("uid").to_pylist():
+                if seg_of.get(uid, seq) < seq:
+                    del seg_of[uid]
+        return seg_of, segs
+
+    def live_rows(self, path: Path, seq: int, seg_of: dict, columns=None, uids=None) -> pa.Table:
+        """セグメントから有効行（と指定 uid）のみを読み出す"""
+        wanted = [uid for uid, s in seg_of.items() if s == seq and (uids is None or uid in uids)]
+        if not wanted:
+            return None
+        table = pq.read_table(path, columns=list(columns) if columns else None)
+        return table.filter(pc.is_in(table["uid"], value_set=pa.array(wanted, pa.string())))
+
+    # ====== 3. 読み出し ======
+    def scan_meta(self, columns=META_COLUMNS) -> Iterator[Dict[str, Any]]:
+        """メタ列のみ走査（text 列は読まない）"""
+        for part in range(NUM_PARTITIONS):
+            seg_of, segs = self.live_segments(part)
+            for seq, path in segs:
+                table = self.live_rows(path, seq, seg_of, columns=columns)
+                if table is not None:
+                    yield from table.to_pylist()
+
+    def live_uids(self) -> set:
+        uids = set()
+        for part in range(NUM_PARTITIONS):
+            uids.update(self.live_segments(part)[0])
+        return uids
+
+    def read_uids(self, uids: Iterable[str]) -> Iterator[Dict[str, Any]]:
+        """指定 uid のチャンクレコード（text・付加情報込み）"""
+        by_part = defaultdict(set)
+        for uid in uids:
+            by_part[partition_of(uid)].add(uid)
+        for part, part_uids in sorted(by_part.items()):
+            seg_of, segs = self.live_segments(part)
+            for seq, path in segs:
+                table = self.live_rows(path, seq, seg_of, uids=part_uids)
+                if table is not None:
+                    for row in table.to_pylist():
+                        yield to_record(row)
+
+    def iter_records(self) -> Iterator[Dict[str, Any]]:
+        """全チャンクレコード（パーティション・セグメント順）"""
+        for part in range(NUM_PARTITIONS):
+            seg_of, segs = self.live_segments(part)
+            for seq, path in segs:
+                table = self.live_rows(path, seq, seg_of)
+                if table is not None:
+                    for row in table.to_pylist():
+                        yield to_record(row)
+
+    # ====== 4. 書き込み・削除・圧縮 ======
+    def writer(self, flush_rows: int = FLUSH_ROWS) -> "ChunkStoreWriter":
+        return ChunkStoreWriter(self, flush_rows)
+
+    def delete_uids(self, uids: Iterable[str]) -> int:
+        """uid 単位の削除印を追記。件数を返す"""
+        by_part = defaultdict(list)
+        for uid in set(uids):
+            by_part[partition_of(uid)].append(uid)
+        with self.locked():
+            for part, part_uids in by_part.items():
+                self.write_file(part, "tomb", pa.Table.from_pydict({"uid": part_uids}, schema=TOMB_SCHEMA))
+        return sum(len(v) for v in by_part.values())
+
+    def compact(self, force: bool = False) -> int:
+        """
+        削除印があるか、セグメント数が COMPACT_SEGMENTS 以上のパーティションを1セグメントに書き直す
+        戻り値: 圧縮したパーティション数
+        """
+        compacted = 0
+        with self.locked():
+            for part in range(NUM_PARTITIONS):
+                segs, tombs = self.list_files(part)
+                if not segs and not tombs:
+                    continue
+                if not force and not tombs and len(segs) < COMPACT_SEGMENTS:
+                    continue
+                seg_of, segs = self.live_segments(part)
+                tables = [t for t in (self.live_rows(path, seq, seg_of) for seq, path in segs) if t is not None]
+                if tables:
+                    self.write_file(part, "seg", pa.concat_tables(tables))
+                for _, path in segs + tombs:
+                    path.unlink(missing_ok=True)
+                compacted += 1
+        return compacted
+
+    def stats(self) -> dict:
+        segments = tombstones = size = 0
+        for part in range(NUM_PARTITIONS):
+            segs, tombs = self.list_files(part)
+            segments += len(segs)
+            tombstones += len(tombs)
+            size += sum(path.stat().st_size for _, path in segs + tombs)
+        return {"segments": segments, "tombstones": tombstones, "bytes": size}
+
+class ChunkStoreWriter:
+    """
+    チャンクレコードをパーティション別にバッファし、セグメントとして追記
+    ✅ 1つの uid のチャンクは必ず同じセグメントに入るよう、uid の切れ目でのみ書き出す
+    """
+
+    def __init__(self, store: ChunkStore, flush_rows: int = FLUSH_ROWS):
+        self.store = store
+        self.flush_rows = flush_rows
+        self.buffers = defaultdict(lambda: {name: [] for name in SCHEMA.names})
+        self.buffered = 0
+        self.current_uid = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, *exc):
+        if exc_type is None:
+            self.flush()
+
+    def append(self, record: Dict[str, Any]):
+        uid = record["uid"]
+        if uid != self.current_uid:
+            if self.buffered >= self.flush_rows:
+                self.flush()
+            self.current_uid = uid
+        extra = {k: v for k, v in record.items() if k not in BASE_COLUMNS}
+        columns = self.buffers[partition_of(uid)]
+        for key in BASE_COLUMNS:
+            columns[key].append(record.get(key))
+        columns["extra"].append(json.dumps(extra, ensure_ascii=False) if extra else None)
+        self.buffered += 1
+
+    def flush(self):
+        if not self.buffered:
+            return
+        with self.store.locked():
+            for part, columns in self.buffers.items():
+                self.store.write_file(part, "seg", pa.Table.from_pydict(columns, schema=SCHEMA))
+        self.buffers.clear()
+        self.buffered = 0
+
+# ====== 5. 旧形式との相互変換 ======
+def migrate_from_jsonl(store: ChunkStore, chunk_dir: Path = LEGACY_CHUNK_DIR) -> int:
+    """db/chunk 配下の JSONL を取り込む（ファイル単位＝uid単位で追記）。取り込み件数を返す"""
+    count = 0
+    with store.writer() as writer:
+        for chunk_file in sorted(chunk_dir.rglob("*.jsonl")):
+            try:
+                with chunk_file.open("r", encoding="utf-8") as f:
+                    for line in f:
+                        if line.strip():
+                            writer.append(json.loads(line))
+                            count += 1
+            except Exception as e:
+                print(f"[WARN] チャンクファイル取り込み失敗: {chunk_file} ({e})")
+    return count
+
+def mark_migrated(store: ChunkStore, count: int):
+    store.root.mkdir(parents=True, exist_ok=True)
+    with open(store.root / MIGRATED_MARKER, "w", encoding="utf-8") as f:
+        json.dump({"source": str(LEGACY_CHUNK_DIR), "chunks": count}, f, ensure_ascii=False)
+
+def ensure_migrated(store: ChunkStore = None) -> ChunkStore:
+    """
+    旧形式のチャンクを一度だけ取り込む
+    ✅ 移行済みかどうかはストアが空かではなく印（MIGRATED）で判定
+       （全件削除＋圧縮でストアが空になった後に、古い JSONL を再び取り込まないように）
+    """
+    store = store or ChunkStore()
+    if (store.root / MIGRATED_MARKER).exists():
+        return store
+    if store.exists():
+        # 印を導入する前に移行済みのストア
+        mark_migrated(store, -1)
+        return store
+    count = 0
+    if LEGACY_CHUNK_DIR.exists() and any(LEGACY_CHUNK_DIR.rglob("*.jsonl")):
+        print(f"[INFO] 旧形式チャンクをチャンクストアへ移行: {LEGACY_CHUNK_DIR} → {store.root}")
+        count = migrate_from_jsonl(store)
+        print(f"[INFO] 移行完了: {count} チャンク")
+    mark_migrated(store, count)
+    return store
+
+def export_jsonl(store: ChunkStore, out_dir: Path = None) -> int:
+    """
+    JSONL で書き出す（ツール用）
+    out_dir 指定時は旧形式と同じ <path>.jsonl 構成、省略時は標準出力へ1行1チャンク
+    """
+    count = 0
+    if out_dir is None:
+        for record in store.iter_records():
+            sys.stdout.write(json.dumps(record, ensure_ascii=False) + "\n")
+            count += 1
+        return count
+
+    by_path: Dict[str, List[Dict[str, Any]]] = defaultdict(list)
+    for record in store.iter_records():
+        by_path[record["path"]].append(record)
+    for rel_path, records in by_path.items():
+        out_path = Path(out_dir) / (rel_path + ".jsonl")
+        out_path.parent.mkdir(parents=True, exist_ok=True)
+        with out_path.open("w", encoding="utf-8") as f:
+            for record in sorted(records, key=lambda r: r["index"]):
+                f.write(json.dumps(record, ensure_ascii=False) + "\n")
+        count += len(records)
+    return count
+
+def main():
+    if len(sys.argv) < 2:
+        print(__doc__)
+        return
+    store = ChunkStore()
+    command = sys.argv[1]
+    if command == "migrate":
+        count = migrate_from_jsonl(store)
+        mark_migrated(store, count)
+        print(f"[INFO] 取り込み: {count} チャンク")
+    elif command == "export":
+        out_dir = Path(sys.argv[2]) if len(sys.argv) > 2 else None
+        count = export_jsonl(store, out_dir)
+        if out_dir:
+            print(f"[INFO] 書き出し: {count} チャンク → {out_dir}")
+    elif command == "compact":
+        print(f"[INFO] 圧縮: {store.compact(force=True)} パーティション")
+    elif command == "stats":
+        print(json.dumps(store.stats(), ensure_ascii=False))
+    else:
+        print(__doc__)
+
+if __name__ == "__main__":
+    main()
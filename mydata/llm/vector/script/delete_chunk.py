@@ -1,11 +1,10 @@
 #!/usr/bin/env python3
-import json
 from pathlib import Path
-from uid_utils import read_jsonl, write_jsonl_atomic_sync, remove_empty_dirs
+from uid_utils import read_jsonl, rebuild_chunk_log_fast
+from chunk_store import ensure_migrated, STORE_DIR
 
 # === パス設定 ===
 ROOT = Path("/mydata/llm/vector")
-CHUNK_DIR = ROOT / "db/chunk"
 LOG_ROOT = ROOT / "db/log"
 
 TEXT_LOG = LOG_ROOT / "text_log.jsonl"
@@ -25,56 +24,28 @@ def load_valid_uids() -> set:
                 valid_uids.add(e["uid"])
     return valid_uids
 
-def delete_unnecessary_chunks(valid_uids: set) -> int:
-    """テキストログにないUIDのチャンクを物理削除"""
-    removed_count = 0
-    for chunk_file in CHUNK_DIR.rglob("*.jsonl"):
-        try:
-            with chunk_file.open("r", encoding="utf-8") as f:
-                first_line = f.readline().strip()
-                if not first_line:
-                    continue
-                entry = json.loads(first_line)
-                uid = entry.get("uid")
-                if uid not in valid_uids:
-                    chunk_file.unlink()
-                    removed_count += 1
-        except Exception as e:
-            print(f"[WARN] チャンクファイル確認失敗: {chunk_file} ({e})")
-    return removed_count
-
-def rebuild_chunk_log():
-    """実チャンクから最新のchunk_log.jsonlを再生成"""
-    entries = []
-    for chunk_file in CHUNK_DIR.rglob("*.jsonl"):
-        try:
-            with chunk_file.open("r", encoding="utf-8") as f:
-                first_line = json.loads(f.readline())
-                entries.append({
-                    "uid": first_line.get("uid"),
-                    "index": first_line.get("index"),
-                    "path": first_line.get("path"),
-                    "type": first_line.get("type", "unknown")
-                })
-        except Exception as e:
-            print(f"[WARN] チャンクログ構築失敗: {chunk_file} ({e})")
-            continue
-
-    write_jsonl_atomic_sync(CHUNK_LOG, entries)
-    print(f"[INFO] チャンクログ更新: {CHUNK_LOG.name}（{len(entries)} 件・fsync済）")
+def delete_unnecessary_chunks(store, valid_uids: set) -> int:
+    """テキストログにないUIDのチャンクを削除（削除印の追記 → 圧縮で物理削除）"""
+    stale_uids = store.live_uids() - valid_uids
+    if not stale_uids:
+        return 0
+    return store.delete_uids(stale_uids)
 
 def main():
-    print("▶️ delete_chunk.py 開始（最終設計準拠・空フォルダー削除対応）")
+    print("▶️ delete_chunk.py 開始（チャンクストア対応）")
+    store = ensure_migrated()  # ✅ 旧形式（db/chunk/*.jsonl）からの初回移行
     valid_uids = load_valid_uids()
     print(f"[INFO] 有効UID数: {len(valid_uids)}")
 
-    removed = delete_unnecessary_chunks(valid_uids)
-    print(f"[INFO] 不要チャンク削除数: {removed}")
+    removed = delete_unnecessary_chunks(store, valid_uids)
+    print(f"[INFO] 不要チャンク削除数: {removed} 文書")
 
-    rebuild_chunk_log()
+    # ✅ 削除印のあるパーティション・セグメントが増えたパーティションを書き直す
+    compacted = store.compact()
+    if compacted:
+        print(f"[INFO] チャンクストア圧縮: {compacted} パーティション")
 
-    if removed:
-        remove_empty_dirs(CHUNK_DIR, exclude=("calendar",))  # ✅ calendar残す
+    rebuild_chunk_log_fast(STORE_DIR, CHUNK_LOG)
 
     print("✅ delete_chunk.py 完了")
 
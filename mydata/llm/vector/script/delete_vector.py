@@ -11,6 +11,8 @@ import json
 from pathlib import Path
 from chromadb import PersistentClient
 from uid_utils import read_jsonl, write_jsonl_atomic_sync
+from minhash_index import MinHashIndex
+from index_version import bump_index_version
 
 # === 設定 ===
 ROOT = Path("/mydata/llm/vector")
@@ -85,6 +87,16 @@ def delete_from_chroma(db_path: str, collection_name: str, ghost_file_map: dict)
     print(f"[INFO] ベクトル削除完了: {collection_name}（合計 {total_files} ファイル / {total_chunks} チャンク）")
 
 
+def delete_from_minhash(collection_name: str, ghost_file_map: dict):
+    """削除したUIDの近似重複署名も索引から除去"""
+    if not ghost_file_map:
+        return
+    uids = {uid for uids in ghost_file_map.values() for uid in uids}
+    with MinHashIndex(collection_name) as mh_index:
+        removed = mh_index.remove_uids(uids)
+    print(f"[INFO] MinHash署名削除: {collection_name}（{removed} チャンク）")
+
+
 def save_vector_uid_log(path: Path, db_path: str, collection_name: str):
     """最新のDB状態からベクターログを再生成"""
     client = PersistentClient(path=db_path)
@@ -113,6 +125,7 @@ def main():
 
     valid_uids = load_chunk_uids()
     print(f"[INFO] 有効チャンクUID数: {len(valid_uids)}")
+    deleted_files = 0
 
     for key, db_path in VECTOR_DB_DIRS.items():
         print(f"=== {key} 処理開始 ===")
@@ -125,8 +138,13 @@ def main():
 
         ghost_file_map = get_db_ghost_file_map(db_path, key, valid_uids)
         delete_from_chroma(db_path, key, ghost_file_map)
+        delete_from_minhash(key, ghost_file_map)
         save_vector_uid_log(VECTOR_UID_LOGS[key], db_path, key)
+        deleted_files += len(ghost_file_map)
 
+    if deleted_files:
+        # ✅ 回答キャッシュの無効化用
+        bump_index_version(f"ベクトル削除 {deleted_files} ファイル")
     print("✅ delete_vector.py 完了")
 
 
@@ -18,7 +18,10 @@ EXCLUDE_KEYWORDS = (
 )
 
 # === 対象拡張子 ===
-VALID_EXTS = (".doc", ".docx", ".rtf", ".pdf", ".xls", ".xlsx", ".json")
+VALID_EXTS = (
+    ".doc", ".docx", ".rtf", ".pdf", ".xls", ".xlsx", ".json",
+    ".jpg", ".jpeg", ".png", ".tif", ".tiff",
+)
 
 def is_excluded(path: Path) -> bool:
     """ゴミファイル・隠しファイル・対象外ファイルを除外"""
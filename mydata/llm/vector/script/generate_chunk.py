@@ -3,13 +3,13 @@ import json
 import subprocess
 from pathlib import Path
 from uid_utils import read_jsonl, write_jsonl_atomic_sync, rebuild_chunk_log_fast
+from chunk_store import ensure_migrated, STORE_DIR
 
 # === パス設定 ===
 ROOT = Path("/mydata/llm/vector")
 SCRIPT_ROOT = ROOT / "script"
 LOG_ROOT = ROOT / "db/log"
 TMP_ROOT = Path("/tmp")
-CHUNK_DIR = ROOT / "db/chunk"
 
 TEXT_LOG = LOG_ROOT / "text_log.jsonl"
 CHUNK_LOG = LOG_ROOT / "chunk_log.jsonl"
@@ -19,6 +19,7 @@ SCRIPT_MAP = {
     "pdf": SCRIPT_ROOT / "make_chunk_pdf.py",
     "excel": SCRIPT_ROOT / "make_chunk_excel.py",
     "calendar": SCRIPT_ROOT / "make_chunk_calendar.py",
+    "image": SCRIPT_ROOT / "make_chunk_image.py",
 }
 
 EXT_MAP = {
@@ -26,6 +27,7 @@ EXT_MAP = {
     "pdf": [".pdf"],
     "excel": [".xls", ".xlsx"],
     "calendar": [".json"],
+    "image": [".jpg", ".jpeg", ".png", ".tif", ".tiff"],
 }
 
 def classify_targets():
@@ -69,11 +71,12 @@ def invoke_script(script_path: Path):
 
 def main():
     print("▶️ generate_chunk.py 開始")
+    ensure_migrated()  # ✅ 旧形式（db/chunk/*.jsonl）からの初回移行
     categorized = classify_targets()
 
     if not any(categorized.values()):
         print("[INFO] チャンク生成対象なし")
-        rebuild_chunk_log_fast(CHUNK_DIR, CHUNK_LOG)
+        rebuild_chunk_log_fast(STORE_DIR, CHUNK_LOG)
         print("✅ generate_chunk 完了")
         return
 
@@ -87,7 +90,7 @@ def main():
             continue
         invoke_script(script_path)
 
-    rebuild_chunk_log_fast(CHUNK_DIR, CHUNK_LOG)
+    rebuild_chunk_log_fast(STORE_DIR, CHUNK_LOG)
     print("✅ generate_chunk 完了")
 
 if __name__ == "__main__":
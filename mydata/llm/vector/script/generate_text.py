@@ -22,6 +22,7 @@ EXT_MAP = {
     "pdf": [".pdf"],
     "excel": [".xls", ".xlsx"],
     "calendar": [".json"],
+    "image": [".jpg", ".jpeg", ".png", ".tif", ".tiff"],
 }
 
 SCRIPT_MAP = {
@@ -29,6 +30,7 @@ SCRIPT_MAP = {
     "pdf": SCRIPT_ROOT / "make_pdf.py",
     "excel": SCRIPT_ROOT / "make_excel.py",
     "calendar": SCRIPT_ROOT / "make_calendar.py",
+    "image": SCRIPT_ROOT / "make_image.py",
 }
 
 # === 1. 変更検出 ===
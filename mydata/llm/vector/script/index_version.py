@@ -0,0 +1,34 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+index_version.py
+ベクトルインデックスの版番号（登録・削除のたびに更新）
+- fastapi 側の回答キャッシュは、この版が変わったら古い回答を使わない
+- /mydata は共有マウントのため、vector サービス（/embed）経由で参照される
+"""
+
+import os
+import json
+import time
+from datetime import datetime
+from pathlib import Path
+
+INDEX_VERSION_PATH = Path("/mydata/llm/vector/db/index_version.json")
+
+def read_index_version() -> str:
+    try:
+        with INDEX_VERSION_PATH.open("r", encoding="utf-8") as f:
+            return str(json.load(f).get("version", "0"))
+    except (FileNotFoundError, json.JSONDecodeError):
+        return "0"
+
+def bump_index_version(reason: str) -> str:
+    """版番号を更新（ナノ秒時刻。複数スクリプトが続けて更新しても重ならない）"""
+    version = str(time.time_ns())
+    INDEX_VERSION_PATH.parent.mkdir(parents=True, exist_ok=True)
+    tmp = INDEX_VERSION_PATH.with_suffix(".json.tmp")
+    with tmp.open("w", encoding="utf-8") as f:
+        json.dump({"version": version, "reason": reason, "updated": datetime.now().isoformat()}, f, ensure_ascii=False)
+    os.replace(tmp, INDEX_VERSION_PATH)
+    print(f"[INFO] インデックス版を更新: {version}（{reason}）")
+    return version
@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+ingest_throttle.py
+チャット応答（llama.cpp推論）を優先するための取り込み処理スロットリング
+- fastapi の chat ルーターが書き出す稼働状況ファイル（処理中の /v1/chat/completions 数）を参照
+- チャット処理中はワーカーを一時停止し、アイドルに戻ったら全速で再開
+- 取り込みワーカーは nice 値を下げて常に推論より低優先で動作
+- 一時停止した時間は throttle_log.jsonl に記録
+"""
+
+import os
+import json
+import time
+import threading
+from pathlib import Path
+from datetime import datetime
+
+# === 設定 ===
+ACTIVITY_FILE = Path(os.getenv("CHAT_ACTIVITY_FILE", "/mydata/llm/fastapi/chat_logs/chat_activity.json"))
+THROTTLE_LOG = Path("/mydata/llm/vector/db/log/throttle_log.jsonl")
+
+THROTTLE_ENABLED = os.getenv("INGEST_THROTTLE", "1") != "0"
+WORKER_NICE = int(os.getenv("INGEST_NICE", "10"))
+POLL_SEC = 1.0
+STALE_SEC = 900       # これより古い稼働状況は無視（fastapi異常終了時の残骸対策）
+MAX_WAIT_SEC = 1800   # チャットが続いても取り込みが完全に止まらないよう上限を設ける
+
+_lock = threading.Lock()
+_throttled_sec = 0.0
+_idle_event = None  # 計測中の待機（同じプロセスの他スレッドはこれの完了を待つだけ）
+
+def is_chat_active() -> bool:
+    """処理中のチャットがあるか"""
+    if not THROTTLE_ENABLED:
+        return False
+    try:
+        with ACTIVITY_FILE.open("r", encoding="utf-8") as f:
+            state = json.load(f)
+    except Exception:
+        return False
+    if time.time() - float(state.get("updated", 0)) > STALE_SEC:
+        return False
+    return int(state.get("inflight", 0)) > 0
+
+def lower_priority():
+    """
+    プロセスのCPU優先度を下げる（ProcessPoolExecutorのinitializerにも使用）
+    ※一度下げたnice値は非特権では戻せないため、取り込み系プロセスでのみ呼ぶ
+    """
+    if not THROTTLE_ENABLED:
+        return
+    try:
+        current = os.nice(0)
+        if current < WORKER_NICE:
+            os.nice(WORKER_NICE - current)
+    except Exception as e:
+        print(f"[WARN] nice設定失敗: {e}")
+
+def wait_for_idle(label: str) -> float:
+    """
+    チャット処理中なら終了まで待機し、待機秒数を返す
+    待機が発生した場合のみ throttle_log.jsonl に1行追記する
+    ✅ 複数スレッドが同時に待つ場合、計測・記録は最初の1スレッドだけ（他は完了を待って 0 を返す）
+       スレッド数ぶん待機時間やログ行が重複しないよう、壁時計の待機時間を1回だけ数える
+    """
+    if not is_chat_active():
+        return 0.0
+
+    global _throttled_sec, _idle_event
+    with _lock:
+        event = _idle_event
+        if event is None:
+            event = _idle_event = threading.Event()
+            leader = True
+        else:
+            leader = False
+    if not leader:
+        event.wait()
+        return 0.0
+
+    try:
+        started = time.time()
+        while is_chat_active() and time.time() - started < MAX_WAIT_SEC:
+            time.sleep(POLL_SEC)
+        waited = time.time() - started
+        with _lock:
+            _throttled_sec += waited
+    finally:
+        with _lock:
+            _idle_event = None
+        event.set()
+    _append_log(label, waited)
+    return waited
+
+def throttled_seconds() -> float:
+    """このプロセス内で待機した合計秒数"""
+    return _throttled_sec
+
+def _append_log(label: str, waited: float):
+    entry = {
+        "label": label,
+        "pid": os.getpid(),
+        "throttled_sec": round(waited, 3),
+        "timestamp": datetime.now().isoformat()
+    }
+    try:
+        THROTTLE_LOG.parent.mkdir(parents=True, exist_ok=True)
+        # O_APPEND の1回書き込みなので複数ワーカーからの同時追記でも行は混ざらない
+        with THROTTLE_LOG.open("a", encoding="utf-8") as f:
+            f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+    except Exception as e:
+        print(f"[WARN] スロットルログ書き込み失敗: {e}")
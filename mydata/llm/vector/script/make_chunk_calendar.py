@@ -4,19 +4,24 @@ from pathlib import Path
 from tqdm import tqdm
 
 from uid_utils import generate_chunk_index  # ✅ インデックス付番用
+from chunk_store import ChunkStore
 
 TEXT_ROOT = Path("/mydata/llm/vector/db/text")
-CHUNK_DIR = Path("/mydata/llm/vector/db/chunk")
 TARGETS_JSONL = Path("/tmp/targets_chunk_calendar.jsonl")
 
-def process_file(txt_path: Path, uid: str, ftype: str):
+def process_file(writer, txt_path: Path, uid: str, ftype: str):
     """
-    カレンダーファイルをチャンク化（基本1ファイル=1チャンク）し、最終設計準拠形式で保存
+    カレンダーファイルをチャンク化（基本1ファイル=1チャンク）し、チャンクストアへ追記
     """
     rel_path = str(txt_path.relative_to(TEXT_ROOT))
 
-    with open(txt_path, "r", encoding="utf-8") as f:
-        text = f.read().strip()
+    with open(txt_path, "r", encoding="utf-8", newline="") as f:
+        raw = f.read()
+    body = raw.strip()
+    text = body.replace("\r\n", "\n")
+    lead = raw[:len(raw) - len(raw.lstrip())]
+    char_start = len(lead)
+    byte_start = len(lead.encode("utf-8"))
 
     # カレンダーは1チャンク固定
     record = {
@@ -24,13 +29,14 @@ def process_file(txt_path: Path, uid: str, ftype: str):
         "index": generate_chunk_index(0),     # 常に0
         "path": rel_path,
         "type": ftype,                        # calendar
-        "text": text
+        "text": text,
+        "char_start": char_start,             # テキストファイル上の範囲
+        "char_end": char_start + len(body),
+        "byte_start": byte_start,
+        "byte_end": byte_start + len(body.encode("utf-8"))
     }
 
-    out_path = CHUNK_DIR / (rel_path + ".jsonl")
-    out_path.parent.mkdir(parents=True, exist_ok=True)
-    with open(out_path, "w", encoding="utf-8") as f:
-        f.write(json.dumps(record, ensure_ascii=False) + "\n")
+    writer.append(record)
 
     return 1  # 常に1チャンク
 
@@ -48,12 +54,13 @@ def main():
 
     print(f"▶️ Calendarチャンク生成開始: {len(targets)} 件")
     total_chunks = 0
-    for t in tqdm(targets):
-        txt_path = TEXT_ROOT / t["rel_path"]
-        if not txt_path.exists():
-            print(f"[WARN] テキストファイル未発見: {txt_path}")
-            continue
-        total_chunks += process_file(txt_path, uid=t["uid"], ftype=t["type"])
+    with ChunkStore().writer() as writer:  # ✅ 一定行数ごと・終了時にセグメント書き出し
+        for t in tqdm(targets):
+            txt_path = TEXT_ROOT / t["rel_path"]
+            if not txt_path.exists():
+                print(f"[WARN] テキストファイル未発見: {txt_path}")
+                continue
+            total_chunks += process_file(writer, txt_path, uid=t["uid"], ftype=t["type"])
 
     print(f"✅ Calendarチャンク作成完了: 合計 {total_chunks} チャンク")
 
@@ -1,16 +1,22 @@
 #!/usr/bin/env python3
+import os
 import json
 import re
 from pathlib import Path
 from tqdm import tqdm
 
 from uid_utils import generate_chunk_index  # ✅ インデックス付番用
+from chunk_store import ChunkStore
 
 TEXT_ROOT = Path("/mydata/llm/vector/db/text")
-CHUNK_DIR = Path("/mydata/llm/vector/db/chunk")
 TARGETS_JSONL = Path("/tmp/targets_chunk_excel.jsonl")
 
 SHEET_PATTERN = re.compile(r"<<sheet:(.*?)>>")
+NUMERIC_CELL = re.compile(r"^[-+¥￥$]?[\d,.:/年月日時分%円-]+$")
+HEADER_SEPARATOR = "----------------------------------------"
+
+# ✅ 1チャンクあたりのトークン予算（見出し行込み・メタ情報除く）
+WINDOW_TOKENS = int(os.getenv("EXCEL_WINDOW_TOKENS", "384"))
 
 def classify_text(text: str) -> str:
     text = text.lower()
@@ -44,53 +50,133 @@ def extract_keywords(text: str) -> str:
     return "・".join(keywords)
 
 def split_text_by_line(text):
-    lines = text.splitlines()
-    chunks = []
-    current_sheet = ""
+    """
+    本文（メタ情報ヘッダー以降）を (行テキスト, 行番号, シート名, 位置) に分解
+    行番号はテキストファイル全体での0始まりの行番号
+    位置は (文字開始, 文字終了, バイト開始, バイト終了)：前後空白を除いた行のファイル上の範囲
+    """
+    lines = text.splitlines(keepends=True)
+    body_start = 0
     for idx, line in enumerate(lines):
-        line = line.strip()
-        if not line:
-            continue
-        m = SHEET_PATTERN.match(line)
-        if m:
-            current_sheet = m.group(1)
-            continue
-        chunks.append((line, idx, current_sheet))
-    return chunks
-
-def process_file(txt_path: Path, uid: str, ftype: str):
+        if line.strip() == HEADER_SEPARATOR:
+            body_start = idx + 1
+            break
+
+    rows = []
+    current_sheet = ""
+    char_pos = byte_pos = 0
+    for idx, raw in enumerate(lines):
+        raw_bytes = len(raw.encode("utf-8"))
+        line = raw.strip()
+        if idx >= body_start and line:
+            m = SHEET_PATTERN.match(line)
+            if m:
+                current_sheet = m.group(1)
+            else:
+                lead = raw[:len(raw) - len(raw.lstrip())]
+                start = char_pos + len(lead)
+                byte_start = byte_pos + len(lead.encode("utf-8"))
+                span = (start, start + len(line), byte_start, byte_start + len(line.encode("utf-8")))
+                rows.append((line, idx, current_sheet, span))
+        char_pos += len(raw)
+        byte_pos += raw_bytes
+    return rows
+
+def estimate_tokens(text: str) -> int:
+    """
+    埋め込みモデル（legal-bge-m3）のトークン数概算
+    日本語はほぼ1文字1トークン、ASCII英数字は約4文字1トークン
+    """
+    ascii_count = sum(1 for c in text if c < "\x80")
+    return (len(text) - ascii_count) + ascii_count // 4 + 1
+
+def is_header_row(line: str) -> bool:
+    """シート先頭行が見出し行か（数値・日付・金額を含まない2列以上の行）"""
+    cells = line.split()
+    return len(cells) >= 2 and not any(NUMERIC_CELL.match(c) for c in cells)
+
+def group_rows_by_window(rows, budget=WINDOW_TOKENS):
+    """
+    同一シートの連続行をトークン予算内でまとめる
+    各シートの見出し行は各ウィンドウの先頭に1回だけ付与
+    戻り値: [(シート名, 見出し行 or "", [(行テキスト, 行番号, 位置), ...]), ...]
+    """
+    windows = []
+    sheet_rows = {}
+    order = []
+    for line, idx, sheet, span in rows:
+        if sheet not in sheet_rows:
+            sheet_rows[sheet] = []
+            order.append(sheet)
+        sheet_rows[sheet].append((line, idx, span))
+
+    for sheet in order:
+        items = sheet_rows[sheet]
+        header = ""
+        if len(items) > 1 and is_header_row(items[0][0]):
+            header = items[0][0]
+            items = items[1:]
+        header_tokens = estimate_tokens(header) if header else 0
+
+        current, used = [], header_tokens
+        for line, idx, span in items:
+            tokens = estimate_tokens(line)
+            if current and used + tokens > budget:
+                windows.append((sheet, header, current))
+                current, used = [], header_tokens
+            current.append((line, idx, span))
+            used += tokens
+        if current:
+            windows.append((sheet, header, current))
+    return windows
+
+def process_file(writer, txt_path: Path, uid: str, ftype: str):
     rel_path = str(txt_path.relative_to(TEXT_ROOT))
 
-    with open(txt_path, "r", encoding="utf-8") as f:
+    # ✅ 改行を変換せずに読む（文字位置・バイト位置をファイルと一致させる）
+    with open(txt_path, "r", encoding="utf-8", newline="") as f:
         text = f.read()
 
     chunks = []
-    for idx, (chunk_text, offset, sheet_name) in enumerate(split_text_by_line(text)):
-        chunk_type = classify_text(chunk_text)
-        keywords = extract_keywords(chunk_text)
+    for idx, (sheet_name, header, window) in enumerate(group_rows_by_window(split_text_by_line(text))):
+        window_text = "\n".join(line for line, _, _ in window)
+        chunk_type = classify_text(window_text)
+        keywords = extract_keywords(window_text)
 
         meta_text = f"[分類]: {chunk_type}\n[ファイル名]: /text/{rel_path}"
         if sheet_name:
             meta_text += f"\n[シート]: {sheet_name}"
         if keywords:
             meta_text += f"\n[キーワード候補]: {keywords}"
+        prefix = f"{meta_text}\n{header}\n" if header else f"{meta_text}\n"
+
+        # ✅ 各行がチャンク本文のどこから始まるか（ヒット行の特定用）
+        row_offsets, pos = [], len(prefix)
+        for line, _, _ in window:
+            row_offsets.append(pos)
+            pos += len(line) + 1
 
         record = {
             "uid": uid,                        # ✅ テキストログ由来UID
             "index": generate_chunk_index(idx),
             "path": rel_path,
             "type": ftype,                     # excel
-            "text": f"{meta_text}\n{chunk_text}"
+            "text": prefix + window_text,
+            "row_start": window[0][1],         # テキストファイル上の行番号
+            "row_end": window[-1][1],
+            "row_lines": [line_no for _, line_no, _ in window],
+            "row_offsets": row_offsets,
+            "char_start": window[0][2][0],     # テキストファイル上の範囲（先頭行〜末尾行）
+            "char_end": window[-1][2][1],
+            "byte_start": window[0][2][2],
+            "byte_end": window[-1][2][3],
         }
         if sheet_name:
             record["sheet"] = sheet_name
         chunks.append(record)
 
-    out_path = CHUNK_DIR / (rel_path + ".jsonl")
-    out_path.parent.mkdir(parents=True, exist_ok=True)
-    with open(out_path, "w", encoding="utf-8") as f:
-        for c in chunks:
-            f.write(json.dumps(c, ensure_ascii=False) + "\n")
+    for c in chunks:
+        writer.append(c)
 
     return len(chunks)
 
@@ -108,12 +194,13 @@ def main():
 
     print(f"▶️ Excelチャンク生成開始: {len(targets)} 件")
     total_chunks = 0
-    for t in tqdm(targets):
-        txt_path = TEXT_ROOT / t["rel_path"]
-        if not txt_path.exists():
-            print(f"[WARN] テキストファイル未発見: {txt_path}")
-            continue
-        total_chunks += process_file(txt_path, uid=t["uid"], ftype=t["type"])
+    with ChunkStore().writer() as writer:  # ✅ 一定行数ごと・終了時にセグメント書き出し
+        for t in tqdm(targets):
+            txt_path = TEXT_ROOT / t["rel_path"]
+            if not txt_path.exists():
+                print(f"[WARN] テキストファイル未発見: {txt_path}")
+                continue
+            total_chunks += process_file(writer, txt_path, uid=t["uid"], ftype=t["type"])
 
     print(f"✅ Excelチャンク作成完了: 合計 {total_chunks} チャンク")
 
@@ -0,0 +1,45 @@
+#!/usr/bin/env python3
+import json
+from pathlib import Path
+from tqdm import tqdm
+
+from page_chunker import iter_body_pages, iter_chunks, write_chunk_file  # ✅ ページ単位ストリーミング
+from chunk_store import ChunkStore
+
+TEXT_ROOT = Path("/mydata/llm/vector/db/text")
+TARGETS_JSONL = Path("/tmp/targets_chunk_image.jsonl")
+
+def process_file(writer, txt_path: Path, uid: str, ftype: str):
+    """
+    OCRテキストをページ単位で読みながら文境界でチャンク化し、チャンクストアへ追記
+    ✅ 各チャンクに開始・終了ページ（page / page_end）を記録
+    """
+    chunks = iter_chunks(iter_body_pages(txt_path))
+    return write_chunk_file(txt_path, TEXT_ROOT, writer, uid, ftype, chunks)
+
+def main():
+    if not TARGETS_JSONL.exists():
+        print(f"[INFO] 処理対象なし: {TARGETS_JSONL}")
+        return
+
+    with TARGETS_JSONL.open("r", encoding="utf-8") as f:
+        targets = [json.loads(line) for line in f if line.strip()]
+
+    if not targets:
+        print("[INFO] 有効なターゲットなし")
+        return
+
+    print(f"▶️ 画像チャンク生成開始: {len(targets)} 件")
+    total_chunks = 0
+    with ChunkStore().writer() as writer:  # ✅ 一定行数ごと・終了時にセグメント書き出し
+        for t in tqdm(targets):
+            txt_path = TEXT_ROOT / t["rel_path"]
+            if not txt_path.exists():
+                print(f"[WARN] テキストファイル未発見: {txt_path}")
+                continue
+            total_chunks += process_file(writer, txt_path, uid=t["uid"], ftype=t["type"])
+
+    print(f"✅ 画像チャンク作成完了: 合計 {total_chunks} チャンク")
+
+if __name__ == "__main__":
+    main()
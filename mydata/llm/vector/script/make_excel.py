@@ -1,4 +1,5 @@
 #!/usr/bin/env python3
+import os
 import re
 import json
 from pathlib import Path
@@ -8,49 +9,134 @@ from concurrent.futures import ProcessPoolExecutor, as_completed
 from openpyxl import load_workbook
 import xlrd  # for .xls
 
+try:
+    from python_calamine import CalamineWorkbook  # 任意（EXCEL_READER=calamine で使用）
+except ImportError:
+    CalamineWorkbook = None
+
 from uid_utils import generate_uid, get_relative_path  # ✅ 最終設計対応
+from ingest_throttle import lower_priority, wait_for_idle
 
 TEXT_ROOT = Path("/mydata/llm/vector/db/text")
 NAS_ROOT = Path("/mydata/nas")
 TARGETS_JSONL = Path("/tmp/targets_text_excel.jsonl")
 
+# ✅ 連続空行がこれを超えたらシート末尾とみなして打ち切る（書式だけの巨大範囲対策）
+EMPTY_ROW_LIMIT = int(os.getenv("EXCEL_EMPTY_ROW_LIMIT", "500"))
+# ✅ これ以上のサイズのブックはシート単位で並列処理
+LARGE_WORKBOOK_BYTES = int(os.getenv("EXCEL_LARGE_WORKBOOK_MB", "20")) * 1024 * 1024
+# ✅ "calamine" 指定かつ python-calamine 導入済みならRust実装で高速読み込み
+EXCEL_READER = os.getenv("EXCEL_READER", "openpyxl")
+
 def clean_text(text: str) -> str:
     return re.sub(r"[\t\f\r]+", " ", text).strip()
 
-def extract_text_from_excel(path: Path) -> str:
+def format_row(row) -> str:
+    """末尾の空セルを落としてから1行テキスト化"""
+    cells = list(row)
+    while cells and (cells[-1] is None or str(cells[-1]).strip() == ""):
+        cells.pop()
+    line = " ".join(str(cell).strip() if cell is not None else "" for cell in cells)
+    return clean_text(line)
+
+def use_calamine() -> bool:
+    return EXCEL_READER == "calamine" and CalamineWorkbook is not None
+
+def list_sheets(path: Path) -> list:
+    """シート名一覧（セルは読み込まない）"""
+    if use_calamine():
+        return list(CalamineWorkbook.from_path(str(path)).sheet_names)
     if path.suffix.lower() == ".xls":
-        wb = xlrd.open_workbook(str(path))
-        output_lines = []
-        for sheet in wb.sheets():
-            output_lines.append(f"<<sheet:{sheet.name}>>")
+        wb = xlrd.open_workbook(str(path), on_demand=True)
+        try:
+            return wb.sheet_names()
+        finally:
+            wb.release_resources()
+    wb = load_workbook(path, read_only=True, data_only=True)
+    try:
+        return list(wb.sheetnames)
+    finally:
+        wb.close()
+
+def iter_sheet_rows(path: Path, sheet_name: str):
+    """1シート分の行を逐次返す（ブック全体をメモリに載せない）"""
+    if use_calamine():
+        sheet = CalamineWorkbook.from_path(str(path)).get_sheet_by_name(sheet_name)
+        yield from sheet.iter_rows()
+    elif path.suffix.lower() == ".xls":
+        # on_demand: 指定シートのみ読み込み / ragged_rows: 行末の空セルを保持しない
+        wb = xlrd.open_workbook(str(path), on_demand=True, ragged_rows=True)
+        try:
+            sheet = wb.sheet_by_name(sheet_name)
             for row_idx in range(sheet.nrows):
-                row = sheet.row_values(row_idx)
-                line = " ".join(str(cell).strip() if cell else "" for cell in row)
-                line = clean_text(line)
-                if line:
-                    output_lines.append(line)
-            output_lines.append("")
-        return "\n".join(output_lines).strip()
+                yield sheet.row_values(row_idx)
+            wb.unload_sheet(sheet_name)
+        finally:
+            wb.release_resources()
     else:
-        wb = load_workbook(path, data_only=True)
-        output_lines = []
-        for sheet in wb.worksheets:
-            output_lines.append(f"<<sheet:{sheet.title}>>")
-            for row in sheet.iter_rows(values_only=True):
-                if not row:
-                    continue
-                line = " ".join(str(cell).strip() if cell is not None else "" for cell in row)
-                line = clean_text(line)
-                if line:
-                    output_lines.append(line)
-            output_lines.append("")
-        return "\n".join(output_lines).strip()
-
-def save_text(filepath: Path, text: str):
-    # ===== メタ情報取得（最終設計準拠） =====
+        # read_only: 行をストリーム読み込み（全セルを保持しない）
+        wb = load_workbook(path, read_only=True, data_only=True)
+        try:
+            yield from wb[sheet_name].iter_rows(values_only=True)
+        finally:
+            wb.close()
+
+def iter_sheet_lines(path: Path, sheet_name: str):
+    """空行を除いた行テキストを逐次返す。長い空行の連続で打ち切り"""
+    empty_run = 0
+    for row in iter_sheet_rows(path, sheet_name):
+        line = format_row(row) if row else ""
+        if not line:
+            empty_run += 1
+            if empty_run > EMPTY_ROW_LIMIT:
+                break
+            continue
+        empty_run = 0
+        yield line
+
+def text_out_path(filepath: Path) -> Path:
     rel_path = filepath.relative_to(NAS_ROOT)
-    out_path = TEXT_ROOT / rel_path.with_name(rel_path.name + ".txt")
+    return TEXT_ROOT / rel_path.with_name(rel_path.name + ".txt")
+
+def extract_sheet_lines(path: Path, sheet_name: str, index: int) -> Path:
+    """
+    シート単位の並列処理用（1シート分の行テキストを出力先横の一時ファイルへ書き、パスだけ返す）
+    ✅ 親プロセスに行リストを溜めない（結合は save_split_workbook）
+    """
+    wait_for_idle("make_excel")  # ✅ チャット処理中は待機
+    out_path = text_out_path(path)
+    out_path.parent.mkdir(parents=True, exist_ok=True)
+    sheet_path = out_path.with_suffix(out_path.suffix + f".sheet{index}.tmp")
+    try:
+        with open(sheet_path, "w", encoding="utf-8") as f:
+            for line in iter_sheet_lines(path, sheet_name):
+                f.write(line + "\n")
+    except BaseException:
+        sheet_path.unlink(missing_ok=True)
+        raise
+    return sheet_path
+
+def iter_sheet_file(sheet_path: Path):
+    with open(sheet_path, "r", encoding="utf-8") as f:
+        for line in f:
+            yield line.rstrip("\n")
+
+def iter_excel_lines(path: Path):
+    """ブック全体を <<sheet:名前>> 区切りで逐次返す"""
+    for sheet_name in list_sheets(path):
+        yield f"<<sheet:{sheet_name}>>"
+        yield from iter_sheet_lines(path, sheet_name)
+        yield ""
+
+def save_text(filepath: Path, lines) -> bool:
+    """
+    行イテレータを逐次書き込み（本文全体を文字列にしない）
+    本文が空ならファイルを残さず False を返す
+    """
+    # ===== メタ情報取得（最終設計準拠） =====
+    out_path = text_out_path(filepath)
     out_path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = out_path.with_suffix(out_path.suffix + ".tmp")
 
     uid = generate_uid(filepath)
     abs_path = out_path.resolve()
@@ -61,7 +147,9 @@ def save_text(filepath: Path, text: str):
     size = stat.st_size
 
     # ===== 書き込み =====
-    with open(out_path, "w", encoding="utf-8") as f:
+    written = 0
+    pending_blank = 0  # 末尾の空行は書かない（従来の strip() 相当）
+    with open(tmp_path, "w", encoding="utf-8") as f:
         f.write(f"[UID]: {uid}\n")
         f.write(f"[ABS_PATH]: {abs_path}\n")
         f.write(f"[REL_PATH]: {rel_text_path}\n")
@@ -69,19 +157,51 @@ def save_text(filepath: Path, text: str):
         f.write(f"[MTIME]: {mtime_iso}\n")
         f.write(f"[SIZE]: {size}\n")
         f.write("----------------------------------------\n")
-        f.write(text)
+        for line in lines:
+            if not line:
+                pending_blank += 1
+                continue
+            if written:
+                f.write("\n" * (pending_blank + 1))
+            f.write(line)
+            pending_blank = 0
+            written += 1
+
+    if not written:
+        tmp_path.unlink(missing_ok=True)
+        return False
+    tmp_path.replace(out_path)
+    return True
 
 def process_excel(filepath: Path):
+    wait_for_idle("make_excel")  # ✅ チャット処理中は待機
     try:
-        text = extract_text_from_excel(filepath)
-        if text.strip():
-            save_text(filepath, text)
+        if save_text(filepath, iter_excel_lines(filepath)):
             return f"[OK] {filepath}"
         else:
             return f"[WARN] 空データ: {filepath}"
     except Exception as e:
         return f"[ERROR] {filepath}\n{e}"
 
+def save_split_workbook(filepath: Path, sheet_names: list, sheet_files: dict) -> str:
+    """シート単位で並列抽出した一時ファイルをシート順に結合して保存（一時ファイルは削除）"""
+    def iter_lines():
+        for name in sheet_names:
+            yield f"<<sheet:{name}>>"
+            if sheet_files.get(name):
+                yield from iter_sheet_file(sheet_files[name])
+            yield ""
+    try:
+        if save_text(filepath, iter_lines()):
+            return f"[OK] {filepath}（{len(sheet_names)} シート並列）"
+        return f"[WARN] 空データ: {filepath}"
+    except Exception as e:
+        return f"[ERROR] {filepath}\n{e}"
+    finally:
+        for sheet_path in sheet_files.values():
+            if sheet_path:
+                sheet_path.unlink(missing_ok=True)
+
 def main():
     if not TARGETS_JSONL.exists():
         print(f"[INFO] Excel対象なし: {TARGETS_JSONL}")
@@ -103,11 +223,42 @@ def main():
         return
 
     print(f"[INFO] Excel処理開始: {len(paths)} 件")
+    lower_priority()  # ✅ ワーカーにも継承される
 
     with ProcessPoolExecutor() as executor:
-        futures = [executor.submit(process_excel, p) for p in paths]
+        futures = {}
+        split_books = {}  # パス → (シート名一覧, {シート名: 一時ファイル}, 残りシート数)
+        for p in paths:
+            sheet_names = []
+            if p.stat().st_size >= LARGE_WORKBOOK_BYTES:
+                try:
+                    sheet_names = list_sheets(p)
+                except Exception as e:
+                    print(f"[WARN] シート一覧取得失敗: {p} ({e})")
+            if len(sheet_names) > 1:
+                # ✅ 大きいブックはシート単位で各ワーカーに分配
+                split_books[p] = (sheet_names, {}, len(sheet_names))
+                for i, name in enumerate(sheet_names):
+                    futures[executor.submit(extract_sheet_lines, p, name, i)] = (p, name)
+            else:
+                futures[executor.submit(process_excel, p)] = (p, None)
+
         for f in as_completed(futures):
-            print(f.result())
+            p, sheet_name = futures[f]
+            if sheet_name is None:
+                print(f.result())
+                continue
+            sheet_names, sheet_files, remaining = split_books[p]
+            try:
+                sheet_files[sheet_name] = f.result()
+            except Exception as e:
+                print(f"[ERROR] {p} シート[{sheet_name}]\n{e}")
+                sheet_files[sheet_name] = None
+            remaining -= 1
+            split_books[p] = (sheet_names, sheet_files, remaining)
+            if remaining == 0:
+                print(save_split_workbook(p, sheet_names, sheet_files))
+                del split_books[p]
 
     print("[DONE] Excel処理完了")
 
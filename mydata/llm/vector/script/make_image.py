@@ -6,16 +6,45 @@ import pytesseract
 import logging
 import piexif
 import json
+import hashlib
+import resource
+import numpy as np
 from pathlib import Path
 from datetime import datetime
-from PIL import Image
+from PIL import Image, ImageSequence
 from concurrent.futures import ProcessPoolExecutor, as_completed
 
 from uid_utils import generate_uid, get_relative_path  # ✅ 最終設計対応
+from ingest_throttle import lower_priority, wait_for_idle
 
 TEXT_ROOT = Path("/mydata/llm/vector/db/text")
 NAS_ROOT = Path("/mydata/nas")
-TARGETS_JSONL = Path("/tmp/targets_image.jsonl")
+TARGETS_JSONL = Path("/tmp/targets_text_image.jsonl")  # ✅ generate_text.py に合わせる
+OCR_CACHE_DIR = Path("/mydata/llm/vector/db/ocr_cache")     # ✅ 内容ハッシュ単位のOCR結果キャッシュ
+
+IMAGE_EXTS = (".jpg", ".jpeg", ".png", ".tif", ".tiff")
+
+# ✅ OCRワーカー設定（tesseractはワーカー内で1スレッドに制限し、並列はプロセス数で取る）
+OCR_WORKERS = int(os.getenv("OCR_WORKERS", str(max(1, (os.cpu_count() or 2) // 2))))
+OCR_WORKER_MEM_MB = int(os.getenv("OCR_WORKER_MEM_MB", "2048"))  # ワーカー1つあたりのメモリ上限
+OCR_MAX_SIDE = 5000  # これを超えるフレームは縮小してからOCR（300dpiでA3程度）
+
+# ✅ OCR の言語・tesseract 追加設定（キャッシュキーにも含める）
+OCR_LANG = os.getenv("OCR_LANG", "jpn")
+OCR_CONFIG = os.getenv("OCR_TESSERACT_CONFIG", "")
+# ✅ 前処理・整形を変えたら上げる（古い結果はキャッシュから使われなくなる）
+OCR_CACHE_VERSION = 1
+
+# ✅ 向き判定（OSD）は長辺この画素数まで縮小して実行
+OSD_MAX_SIDE = 1200
+# ✅ OSDの向き信頼度がこれ未満なら4方向総当たりOCRにフォールバック
+OSD_MIN_CONFIDENCE = float(os.getenv("OCR_OSD_MIN_CONF", "2.0"))
+
+RIGHT_ANGLE_ROTATIONS = {
+    90: cv2.ROTATE_90_CLOCKWISE,
+    180: cv2.ROTATE_180,
+    270: cv2.ROTATE_90_COUNTERCLOCKWISE,
+}
 
 logging.basicConfig(level=logging.INFO, format="[%(levelname)s] %(message)s")
 
@@ -58,24 +87,67 @@ def get_exif_datetime(img_path: Path) -> str:
     return ""
 
 def rotate_image(img, angle):
+    """時計回りに angle 度回転（90度単位は切り取りなしの転置回転）"""
+    angle = angle % 360
+    if angle == 0:
+        return img
+    if angle in RIGHT_ANGLE_ROTATIONS:
+        return cv2.rotate(img, RIGHT_ANGLE_ROTATIONS[angle])
     (h, w) = img.shape[:2]
-    M = cv2.getRotationMatrix2D((w // 2, h // 2), angle, 1.0)
+    M = cv2.getRotationMatrix2D((w // 2, h // 2), -angle, 1.0)
     return cv2.warpAffine(img, M, (w, h), flags=cv2.INTER_CUBIC, borderMode=cv2.BORDER_REPLICATE)
 
-def preprocess_image_cv2(image_path: Path) -> list:
-    img = cv2.imread(str(image_path), cv2.IMREAD_GRAYSCALE)
-    if img is None:
-        raise ValueError(f"画像読み込み失敗: {image_path}")
-
+def preprocess_image_cv2(img):
+    """グレースケール画像（ndarray）を二値化"""
     img = cv2.medianBlur(img, 3)  # ノイズ除去
     img = cv2.bitwise_not(img)
     thresh = cv2.adaptiveThreshold(img, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C,
                                    cv2.THRESH_BINARY, 11, 2)
-    img = cv2.bitwise_not(thresh)
-
-    angles = [0, 90, 180, 270]
-    rotated_images = [rotate_image(img, angle) for angle in angles]
-    return rotated_images
+    return cv2.bitwise_not(thresh)
+
+def iter_frames(image_path: Path):
+    """
+    フレーム（マルチページTIFFの各ページ）を1枚ずつグレースケールで返す
+    ✅ 全ページを同時にメモリへ載せない
+    """
+    with Image.open(image_path) as im:
+        for page_no, frame in enumerate(ImageSequence.Iterator(im), start=1):
+            gray = frame.convert("L")
+            if max(gray.size) > OCR_MAX_SIDE:
+                gray.thumbnail((OCR_MAX_SIDE, OCR_MAX_SIDE))
+            yield page_no, np.asarray(gray)
+            del gray
+
+def detect_orientation(img) -> tuple:
+    """
+    縮小コピーに tesseract OSD を掛けて (時計回りの補正角, 信頼度) を返す
+    OSD失敗時（文字が少ない等）は (0, 0.0)
+    """
+    h, w = img.shape[:2]
+    scale = OSD_MAX_SIDE / max(h, w)
+    small = cv2.resize(img, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA) if scale < 1 else img
+    try:
+        osd = pytesseract.image_to_osd(small, config="--psm 0", output_type=pytesseract.Output.DICT)
+        return int(osd.get("rotate", 0)), float(osd.get("orientation_conf", 0.0))
+    except Exception as e:
+        logging.info(f"[INFO] 向き判定失敗（総当たりへ）: {e}")
+        return 0, 0.0
+
+def ocr_with_orientation(img) -> str:
+    """向きを先に決めてOCRは1回だけ。判定の信頼度が低いときのみ4方向総当たり"""
+    angle, conf = detect_orientation(img)
+    if conf >= OSD_MIN_CONFIDENCE:
+        return pytesseract.image_to_string(rotate_image(img, angle), lang=OCR_LANG, config=OCR_CONFIG)
+
+    best_score = 0
+    best_text = ""
+    for angle in (0, 90, 180, 270):
+        text = pytesseract.image_to_string(rotate_image(img, angle), lang=OCR_LANG, config=OCR_CONFIG)
+        score = evaluate_text_quality(text)
+        if score > best_score:
+            best_score = score
+            best_text = text
+    return best_text
 
 def evaluate_text_quality(text: str) -> int:
     return len(re.findall(r"[\u4e00-\u9fafぁ-ん]", text))
@@ -83,7 +155,7 @@ def evaluate_text_quality(text: str) -> int:
 def save_text(filepath: Path, text: str):
     # ===== メタ情報取得（最終設計準拠） =====
     rel_path = filepath.relative_to(NAS_ROOT)
-    out_path = TEXT_ROOT / rel_path.with_suffix(".txt")
+    out_path = TEXT_ROOT / rel_path.with_name(rel_path.name + ".txt")
     out_path.parent.mkdir(parents=True, exist_ok=True)
 
     uid = generate_uid(filepath)
@@ -108,27 +180,77 @@ def save_text(filepath: Path, text: str):
         f.write("----------------------------------------\n")
         f.write(text)
 
+def file_sha256(path: Path) -> str:
+    h = hashlib.sha256()
+    with path.open("rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            h.update(block)
+    return h.hexdigest()
+
+def cache_tag() -> str:
+    """キャッシュの版・言語・設定ごとのディレクトリ名（どれかが変われば別キャッシュ）"""
+    config_hash = hashlib.sha256(OCR_CONFIG.encode("utf-8")).hexdigest()[:8]
+    return f"v{OCR_CACHE_VERSION}-{OCR_LANG}-{config_hash}"
+
+def cache_path(content_hash: str) -> Path:
+    return OCR_CACHE_DIR / cache_tag() / content_hash[:2] / f"{content_hash}.txt"
+
+def load_ocr_cache(content_hash: str):
+    path = cache_path(content_hash)
+    if path.exists():
+        return path.read_text(encoding="utf-8")
+    return None
+
+def store_ocr_cache(content_hash: str, text: str):
+    path = cache_path(content_hash)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_suffix(f".{os.getpid()}.tmp")
+    tmp_path.write_text(text, encoding="utf-8")
+    os.replace(tmp_path, path)
+
+def ocr_image(path: Path) -> str:
+    """全フレームをOCRし <<page:N>> 区切りで結合"""
+    pages = []
+    for page_no, frame in iter_frames(path):
+        text = clean_text(ocr_with_orientation(preprocess_image_cv2(frame)))
+        del frame
+        pages.append(f"<<page:{page_no}>>\n{text.strip()}")
+    return "\n".join(pages)
+
+def init_ocr_worker():
+    """OCRワーカー初期化：メモリ上限・tesseractのスレッド数・優先度"""
+    limit = OCR_WORKER_MEM_MB * 1024 * 1024
+    try:
+        # tesseract（子プロセス）にも継承される
+        # ✅ RLIMIT_AS だと共有ライブラリ・スレッドスタック等の仮想領域予約まで数えて誤爆するため、
+        #    ヒープ・匿名メモリ（実際に確保するデータ領域）だけを制限する
+        resource.setrlimit(resource.RLIMIT_DATA, (limit, limit))
+    except (ValueError, OSError) as e:
+        logging.warning(f"[WARN] メモリ上限設定失敗: {e}")
+    os.environ["OMP_THREAD_LIMIT"] = "1"
+    lower_priority()
+
 def process_image(path_str):
     path = Path(path_str)
+    wait_for_idle("make_image")  # ✅ チャット処理中は待機
     try:
-        rotated_images = preprocess_image_cv2(path)
-        best_score = 0
-        best_text = ""
-
-        for img in rotated_images:
-            text = pytesseract.image_to_string(img, lang="jpn")
-            score = evaluate_text_quality(text)
-            if score > best_score:
-                best_score = score
-                best_text = text
-
-        cleaned = clean_text(best_text)
-        if len(cleaned.strip()) >= 10:
-            save_text(path, cleaned)
-            return f"[OK] {path}"
+        # ✅ スキャナーの再投入など、同一内容の画像は再OCRしない
+        content_hash = file_sha256(path)
+        text = load_ocr_cache(content_hash)
+        cached = text is not None
+        if not cached:
+            text = ocr_image(path)
+            store_ocr_cache(content_hash, text)
+
+        body = re.sub(r"<<page:\d+>>", "", text)
+        if len(body.strip()) >= 10:
+            save_text(path, text)
+            return f"[OK] {path}" + ("（OCRキャッシュ）" if cached else "")
         else:
             return f"[WARN] 内容不足: {path}"
 
+    except MemoryError:
+        return f"[ERROR] {path}: メモリ上限（{OCR_WORKER_MEM_MB}MB）超過"
     except Exception as e:
         return f"[ERROR] {path}: {e}"
 
@@ -142,8 +264,8 @@ def main():
         for line in f:
             try:
                 entry = json.loads(line)
-                path = Path(entry["path"])
-                if path.exists():
+                path = NAS_ROOT / Path(entry["rel_path"])
+                if path.exists() and path.suffix.lower() in IMAGE_EXTS:
                     paths.append(str(path))
             except Exception as e:
                 logging.warning(f"[WARN] JSON読み込み失敗: {e}")
@@ -153,9 +275,9 @@ def main():
         logging.info("[INFO] 有効な画像ファイルがありません。")
         return
 
-    logging.info(f"[INFO] 処理開始: {len(paths)} 件")
+    logging.info(f"[INFO] 処理開始: {len(paths)} 件（OCRワーカー {OCR_WORKERS}）")
 
-    with ProcessPoolExecutor() as executor:
+    with ProcessPoolExecutor(max_workers=OCR_WORKERS, initializer=init_ocr_worker) as executor:
         futures = [executor.submit(process_image, p) for p in paths]
         for f in as_completed(futures):
             print(f.result())
@@ -11,6 +11,8 @@ from datetime import datetime
 from concurrent.futures import ProcessPoolExecutor, as_completed
 
 from uid_utils import generate_uid, get_relative_path  # ✅ 最終設計対応
+from ingest_throttle import lower_priority, wait_for_idle
+from boilerplate import BoilerplateDetector
 
 TEXT_ROOT = Path("/mydata/llm/vector/db/text")
 NAS_ROOT = Path("/mydata/nas")
@@ -26,20 +28,41 @@ def clean_text(text: str) -> str:
     text = re.sub(r'(?<=[\u4e00-\u9fff])\s+(?=[\u4e00-\u9fff])', '', text)
     return text.strip()
 
-def extract_text_and_pages(pdf_path: Path) -> tuple[str, int]:
-    try:
-        with fitz.open(pdf_path) as doc:
-            text = "\n".join([page.get_text() for page in doc])
-            return text, len(doc)
-    except Exception as e:
-        logging.error(f"[ERROR] PDF読み取り失敗: {pdf_path}: {e}")
-        return "", 0
-
-def save_text(filepath: Path, text: str, num_pages: int):
+MIN_TEXT_CHARS = 50  # これ未満はテキスト層なしとみなしOCRへ
+
+def iter_pdf_pages(pdf_path: Path):
+    """
+    1ページずつテキストを取り出す（文書全体を連結しない）
+    ✅ 取り出したページは即座に解放されるため、数千ページのPDFでもメモリ一定
+    """
+    with fitz.open(pdf_path) as doc:
+        for page_no in range(len(doc)):
+            page = doc.load_page(page_no)
+            yield page_no + 1, page.get_text()
+            page = None
+
+def iter_spooled_pages(spool_path: Path):
+    """spool_pages が書き出したページを1ページずつ読み戻す"""
+    with open(spool_path, "r", encoding="utf-8") as f:
+        for line in f:
+            page_no, page_text = json.loads(line)
+            yield page_no, page_text
+
+def save_text(filepath: Path) -> tuple[int, int]:
+    """
+    ページ単位で抽出・整形しながら一時ファイルへ逐次書き込み、本文が十分なら確定
+    本文は <<page:N>> 区切り（チャンク側でページ番号を付与するため）
+    ✅ PDFは1回だけ読む。生テキストを一時ファイルへ退避しながら繰り返しヘッダー・フッターを検出し、
+      退避したページから除去して書き込む（ページ本文はメモリに溜めない）
+    戻り値: (本文の文字数, 定型行の除去文字数)
+            本文が MIN_TEXT_CHARS 未満なら確定せず一時ファイルを破棄
+    """
     # ===== メタ情報取得（最終設計準拠） =====
     rel_path = filepath.relative_to(NAS_ROOT)
     out_path = TEXT_ROOT / rel_path.with_name(rel_path.name + ".txt")
     out_path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = out_path.with_name(out_path.name + ".tmp")
+    spool_path = out_path.with_name(out_path.name + ".pages.tmp")
 
     uid = generate_uid(filepath)
     abs_path = out_path.resolve()
@@ -50,16 +73,44 @@ def save_text(filepath: Path, text: str, num_pages: int):
     size = stat.st_size
 
     # ===== 書き込み =====
-    with open(out_path, "w", encoding="utf-8") as f:
-        f.write(f"[UID]: {uid}\n")
-        f.write(f"[ABS_PATH]: {abs_path}\n")
-        f.write(f"[REL_PATH]: {rel_text_path}\n")
-        f.write(f"[TYPE]: {ftype}\n")
-        f.write(f"[MTIME]: {mtime_iso}\n")
-        f.write(f"[SIZE]: {size}\n")
-        f.write(f"[PAGES]: {num_pages}\n")
-        f.write("----------------------------------------\n")
-        f.write(text)
+    total_chars = 0
+    detector = BoilerplateDetector()
+    try:
+        num_pages = 0
+        with open(spool_path, "w", encoding="utf-8") as spool:
+            for page_no, page_text in iter_pdf_pages(filepath):
+                detector.add_page(page_text)
+                spool.write(json.dumps([page_no, page_text], ensure_ascii=False) + "\n")
+                num_pages += 1
+        detector.finalize()
+
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write(f"[UID]: {uid}\n")
+            f.write(f"[ABS_PATH]: {abs_path}\n")
+            f.write(f"[REL_PATH]: {rel_text_path}\n")
+            f.write(f"[TYPE]: {ftype}\n")
+            f.write(f"[MTIME]: {mtime_iso}\n")
+            f.write(f"[SIZE]: {size}\n")
+            f.write(f"[PAGES]: {num_pages}\n")
+            f.write(f"[BOILERPLATE_CHARS]: {detector.removed_chars}\n")
+            f.write("----------------------------------------\n")
+            for page_no, page_text in iter_spooled_pages(spool_path):
+                cleaned = clean_text(detector.strip(page_text)[0])
+                if not cleaned:
+                    continue
+                f.write(f"<<page:{page_no}>>\n{cleaned}\n")
+                total_chars += len(cleaned)
+    except Exception as e:
+        logging.error(f"[ERROR] PDF読み取り失敗: {filepath}: {e}")
+        total_chars = 0
+    finally:
+        spool_path.unlink(missing_ok=True)
+
+    if total_chars >= MIN_TEXT_CHARS:
+        os.replace(tmp_path, out_path)
+    else:
+        tmp_path.unlink(missing_ok=True)
+    return total_chars, detector.removed_chars
 
 def perform_ocr(pdf_path: Path) -> bool:
     TMP_ROOT.mkdir(parents=True, exist_ok=True)
@@ -93,21 +144,16 @@ def perform_ocr(pdf_path: Path) -> bool:
             tmp_out.unlink()
 
 def process_pdf(filepath: Path):
-    text, num_pages = extract_text_and_pages(filepath)
-    cleaned = clean_text(text)
-
-    if len(cleaned) >= 50:
-        save_text(filepath, cleaned, num_pages)
-        return f"[OK] {filepath}"
-    else:
+    wait_for_idle("make_pdf")  # ✅ チャット処理中は待機
+    total_chars, removed = save_text(filepath)
+    if total_chars < MIN_TEXT_CHARS:
         logging.info(f"[INFO] OCR再試行: {filepath}")
-        if perform_ocr(filepath):
-            text, num_pages = extract_text_and_pages(filepath)
-            cleaned = clean_text(text)
-            if len(cleaned) >= 50:
-                save_text(filepath, cleaned, num_pages)
-                return f"[OK] {filepath}"
-        return f"[WARN] 内容不足: {filepath}"
+        if not perform_ocr(filepath):
+            return f"[WARN] 内容不足: {filepath}", 0
+        total_chars, removed = save_text(filepath)
+        if total_chars < MIN_TEXT_CHARS:
+            return f"[WARN] 内容不足: {filepath}", 0
+    return f"[OK] {filepath}（定型行除去 {removed} 文字）", removed
 
 def main():
     if not TARGETS_JSONL.exists():
@@ -131,12 +177,17 @@ def main():
         return
 
     logging.info(f"[INFO] PDF処理開始: {len(paths)} 件")
+    lower_priority()  # ✅ ワーカーにも継承される
 
     with ProcessPoolExecutor() as executor:
         futures = [executor.submit(process_pdf, p) for p in paths]
+        total_removed = 0
         for f in as_completed(futures):
-            print(f.result())
+            result, removed = f.result()
+            print(result)
+            total_removed += removed
 
+    logging.info(f"[INFO] 定型行（ヘッダー・フッター）除去: 合計 {total_removed} 文字")
     logging.info("[DONE] PDF処理完了")
 
 if __name__ == "__main__":
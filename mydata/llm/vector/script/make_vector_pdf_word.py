@@ -1,17 +1,22 @@
 #!/usr/bin/env python3
 import os
 import json
+import numpy as np
 from pathlib import Path
 from tqdm import tqdm
 from sentence_transformers import SentenceTransformer
 from chromadb import PersistentClient
 from concurrent.futures import ThreadPoolExecutor, as_completed, TimeoutError
-from uid_utils import write_jsonl_atomic_sync
+from uid_utils import write_jsonl_atomic_sync, chunk_extra_meta
+from ingest_throttle import lower_priority, wait_for_idle, throttled_seconds
+from minhash_index import MinHashIndex, signature, DUP_THRESHOLD
+from chunk_store import ChunkStore
+from vector_checkpoint import ShardCheckpoint
+from index_version import bump_index_version
 
 # === パス設定 ===
 ROOT = Path("/mydata/llm/vector")
 LOG_ROOT = ROOT / "db/log"
-CHUNK_DIR = ROOT / "db/chunk"
 
 CHUNK_LOG = LOG_ROOT / "chunk_log.jsonl"
 VECTOR_DB_DIR = "/app/db/chroma/pdf_word"
@@ -22,11 +27,13 @@ MODEL_NAME = "/mydata/llm/vector/models/legal-bge-m3"
 
 THREAD_WORKERS = max(1, os.cpu_count() - 1)
 BATCH_CHUNK_SIZE, CHROMA_BATCH_SIZE, TIMEOUT_SEC = 500, 500, 300
+SHARD_FLUSH_CHUNKS = int(os.getenv("VECTOR_SHARD_FLUSH_CHUNKS", "50"))  # エンコード完了この件数ごとにシャードへ確定
 
 # === 初期化 ===
 client = PersistentClient(path=VECTOR_DB_DIR)
 collection = client.get_or_create_collection("vector_pdf_word", metadata={"hnsw:space": "cosine"})
 model = SentenceTransformer(MODEL_NAME)
+chunk_store = ChunkStore()
 
 # === ヘルパー ===
 def load_chunk_log() -> list:
@@ -38,51 +45,45 @@ def load_chunk_log() -> list:
         for line in f:
             try:
                 e = json.loads(line)
-                if e.get("type") in ("pdf", "word"):
+                if e.get("type") in ("pdf", "word", "image"):
                     chunks.append(e)
             except json.JSONDecodeError:
                 continue
     return chunks
 
-def get_existing_uids_from_db() -> set:
+def get_existing_ids_from_db() -> set:
+    """
+    登録済みチャンクID（uid-index）
+    ✅ uid単位で判定すると、バッチ途中で中断した文書の残りチャンクが登録されないため
+    """
     try:
-        existing = set()
-        results = collection.get(include=["metadatas"])
-        for meta in results.get("metadatas", []):
-            uid = meta.get("uid")
-            if uid:
-                existing.add(uid)
-        return existing
+        return set(collection.get(include=[]).get("ids", []))
     except Exception as e:
-        print(f"[WARN] DB UID取得失敗: {e}")
+        print(f"[WARN] DB ID取得失敗: {e}")
         return set()
 
-def collect_target_chunks(all_chunks: list, valid_uids: set) -> list:
-    return [c for c in all_chunks if c["uid"] not in valid_uids]
+def collect_target_chunks(all_chunks: list, existing_ids: set) -> list:
+    return [c for c in all_chunks if f"{c['uid']}-{c['index']}" not in existing_ids]
 
 def load_chunk_texts(target_chunks: list) -> list:
+    """
+    対象チャンクの本文をチャンクストアから取得（uid単位でまとめて読み込み）
+    """
+    wanted = {(c["uid"], c["index"]) for c in target_chunks}
     enriched = []
-    for c in target_chunks:
-        uid, index, rel_path, ftype = c["uid"], c["index"], c["path"], c["type"]
-        chunk_file = CHUNK_DIR / (rel_path + ".jsonl")
-        if not chunk_file.exists():
-            print(f"[WARN] チャンクファイル未発見: {chunk_file}")
+    for entry in chunk_store.read_uids({c["uid"] for c in target_chunks}):
+        if (entry["uid"], entry["index"]) not in wanted:
             continue
-        try:
-            with chunk_file.open("r", encoding="utf-8") as f:
-                for line in f:
-                    entry = json.loads(line)
-                    if entry.get("index") == index:
-                        enriched.append({
-                            "uid": uid,
-                            "index": index,
-                            "path": rel_path,
-                            "type": ftype,
-                            "text": entry.get("text", "")
-                        })
-                        break
-        except Exception as e:
-            print(f"[WARN] チャンクファイル読み込み失敗: {chunk_file} ({e})")
+        enriched.append({
+            "uid": entry["uid"],
+            "index": entry["index"],
+            "path": entry["path"],
+            "type": entry["type"],
+            "text": entry.get("text", ""),
+            "meta": chunk_extra_meta(entry)  # ✅ シート・行位置などの付加情報
+        })
+    if len(enriched) < len(wanted):
+        print(f"[WARN] チャンクストア未発見: {len(wanted) - len(enriched)} 件")
     return enriched
 
 def save_vector_uid_log(chunks: list):
@@ -94,17 +95,79 @@ def save_vector_uid_log(chunks: list):
     print(f"[INFO] VectorUIDログ更新: {VECTOR_UID_LOG.name}（{len(data)} 件）")
 
 def encode_batch(texts):
+    wait_for_idle("make_vector_pdf_word")  # ✅ チャット処理中はエンコードを一時停止
     return model.encode(texts, convert_to_numpy=True, normalize_embeddings=True).tolist()
 
+def find_duplicates(mh_index: MinHashIndex, batch: list, ids: list) -> tuple:
+    """
+    MinHash/LSH で近似重複チャンクを検出し、(バッチ内位置 → 重複元ID, 署名一覧) を返す
+    ✅ 索引には登録しない（Chroma 登録後に add_signatures で登録。登録前に中断しても索引だけ先行しない）
+    ✅ 同一バッチ内の版違いは、このバッチの手前の署名と突き合わせて検出
+    """
+    dup_of, sigs = {}, []
+    seen_pos, seen = [], []  # バッチ内の署名（比較用に行列化）
+    for pos, c in enumerate(batch):
+        sig = signature(c["text"])
+        sigs.append(sig)
+        if sig is None:
+            continue
+        orig = mh_index.find_duplicate(sig)
+        if orig and orig != ids[pos]:
+            dup_of[pos] = orig
+        elif seen:
+            scores = (np.vstack(seen) == sig).mean(axis=1)
+            best = int(np.argmax(scores))
+            if scores[best] >= DUP_THRESHOLD:
+                dup_of[pos] = ids[seen_pos[best]]
+        seen_pos.append(pos)
+        seen.append(sig)
+    return dup_of, sigs
+
+def add_signatures(mh_index: MinHashIndex, ids: list, metas: list, sigs: list):
+    """Chroma へ登録できたチャンクの署名を索引へ登録して確定"""
+    for cid, meta, sig in zip(ids, metas, sigs):
+        mh_index.add(cid, meta["uid"], sig)
+    mh_index.commit()
+
+def fetch_embeddings(chunk_ids) -> dict:
+    """登録済みベクトルを取得（ID → ベクトル）。取得できないIDは含まない"""
+    if not chunk_ids:
+        return {}
+    try:
+        res = collection.get(ids=list(chunk_ids), include=["embeddings"])
+        return {cid: [float(x) for x in e] for cid, e in zip(res["ids"], res["embeddings"])}
+    except Exception as e:
+        print(f"[WARN] 既存ベクトル取得失敗: {e}")
+        return {}
+
 def add_to_chroma(emb, meta, ids, docs):
+    # ✅ upsert：チェックポイント再登録時に既存IDがあっても失敗しない
     for i in range(0, len(ids), CHROMA_BATCH_SIZE):
-        collection.add(
+        collection.upsert(
             embeddings=emb[i:i + CHROMA_BATCH_SIZE],
             metadatas=meta[i:i + CHROMA_BATCH_SIZE],
             ids=ids[i:i + CHROMA_BATCH_SIZE],
             documents=docs[i:i + CHROMA_BATCH_SIZE]
         )
 
+def replay_checkpoints(checkpoint: ShardCheckpoint) -> int:
+    """
+    前回中断時にエンコード済みだったシャードを Chroma へ再登録（再エンコードなし）
+    ✅ 再登録したIDは Chroma 登録済みになるため、この後の登録対象（エンコード対象）から外れる
+    ✅ 近似重複の索引にも署名を登録（中断時は Chroma 登録後に索引へ入れる前だったため）
+    """
+    replayed = 0
+    with MinHashIndex(collection.name) as mh_index:
+        for seq, ids, emb, metas, docs in checkpoint.pending():
+            add_to_chroma(emb, metas, ids, docs)
+            add_signatures(mh_index, ids, metas, [signature(d) for d in docs])
+            checkpoint.mark_done(seq)
+            replayed += len(ids)
+    if replayed:
+        print(f"[INFO] チェックポイントから再登録: {replayed} 件（エンコード省略）")
+    checkpoint.clear()
+    return replayed
+
 def save_vector_config():
     """✅ コンフィグを自動生成"""
     config = {
@@ -121,53 +184,110 @@ def save_vector_config():
 def main():
     print("▶️ make_vector_pdf_word 開始（構造維持＋コンフィグ生成追加）")
 
+    lower_priority()
+    checkpoint = ShardCheckpoint(collection.name)
+    replayed = replay_checkpoints(checkpoint)  # ✅ 前回の中断分を先に反映
+
     all_chunks = load_chunk_log()
     if not all_chunks:
         print("✅ チャンクログが空のため、処理なし")
         save_vector_config()
+        if replayed:
+            bump_index_version(f"{collection.name}: チェックポイント再登録 {replayed} 件")
         return
 
-    existing_uids = get_existing_uids_from_db()
-    print(f"[INFO] DB登録済UID数: {len(existing_uids)}")
+    existing_ids = get_existing_ids_from_db()
+    print(f"[INFO] DB登録済チャンク数: {len(existing_ids)}")
 
-    target_chunks_meta = collect_target_chunks(all_chunks, existing_uids)
+    target_chunks_meta = collect_target_chunks(all_chunks, existing_ids)
     if not target_chunks_meta:
         print("✅ 新規登録対象なし")
         save_vector_config()
+        if replayed:
+            bump_index_version(f"{collection.name}: チェックポイント再登録 {replayed} 件")
         return
 
     target_chunks = load_chunk_texts(target_chunks_meta)
     print(f"[INFO] 登録対象チャンク数: {len(target_chunks)} 件")
 
-    for i in range(0, len(target_chunks), BATCH_CHUNK_SIZE):
-        batch = target_chunks[i:i + BATCH_CHUNK_SIZE]
-        texts = [c["text"] for c in batch]
-        ids = [f"{c['uid']}-{c['index']}" for c in batch]
-        metas = [
-            {
-                "uid": c["uid"],
-                "index": c["index"],
-                "path": c["path"],
-                "file_name": Path(c["path"]).stem,
-                "type": c["type"]
-            }
-            for c in batch
-        ]
-
-        emb = []
-        with ThreadPoolExecutor(max_workers=THREAD_WORKERS) as ex:
-            futures = [ex.submit(encode_batch, [t]) for t in texts]
-            for f in tqdm(as_completed(futures), total=len(futures),
-                          desc=f"ベクトル生成中({i // BATCH_CHUNK_SIZE + 1}バッチ目)"):
-                try:
-                    emb.extend(f.result(timeout=TIMEOUT_SEC))
-                except TimeoutError:
-                    print("⚠️ タイムアウト発生、スキップ")
-
-        add_to_chroma(emb, metas, ids, texts)
-
+    total_reused = 0
+    with MinHashIndex(collection.name) as mh_index:
+        for i in range(0, len(target_chunks), BATCH_CHUNK_SIZE):
+            batch = target_chunks[i:i + BATCH_CHUNK_SIZE]
+            texts = [c["text"] for c in batch]
+            ids = [f"{c['uid']}-{c['index']}" for c in batch]
+            metas = [
+                {
+                    "uid": c["uid"],
+                    "index": c["index"],
+                    "path": c["path"],
+                    "file_name": Path(c["path"]).stem,
+                    "type": c["type"],
+                    **c["meta"]
+                }
+                for c in batch
+            ]
+
+            # ✅ 近似重複（版違いの書面など）は既存ベクトルを再利用し、重複元を dup_of に記録
+            dup_of, sigs = find_duplicates(mh_index, batch, ids)
+            batch_pos = {cid: pos for pos, cid in enumerate(ids)}
+            stored = fetch_embeddings({orig for orig in dup_of.values() if orig not in batch_pos})
+            emb = [None] * len(batch)
+            copy_from = {}
+            for pos, orig in dup_of.items():
+                metas[pos]["dup_of"] = orig
+                if orig in stored:
+                    emb[pos] = stored[orig]
+                elif orig in batch_pos:
+                    copy_from[pos] = batch_pos[orig]
+            to_encode = [pos for pos in range(len(batch)) if emb[pos] is None and pos not in copy_from]
+            total_reused += len(batch) - len(to_encode)
+
+            def shard_of(positions):
+                return (
+                    [ids[pos] for pos in positions],
+                    [emb[pos] for pos in positions],
+                    [metas[pos] for pos in positions],
+                    [texts[pos] for pos in positions]
+                )
+
+            # ✅ エンコードが終わった分から SHARD_FLUSH_CHUNKS 件ごとにディスクへ確定
+            #    （エンコード中に中断しても、次回は確定済みシャードを再登録するだけで再エンコードしない）
+            seqs, encoded = [], []
+            # ✅ 結果は投入順の位置に格納（完了順だと ids/metas とずれるため）
+            with ThreadPoolExecutor(max_workers=THREAD_WORKERS) as ex:
+                futures = {ex.submit(encode_batch, [texts[pos]]): pos for pos in to_encode}
+                for f in tqdm(as_completed(futures), total=len(futures),
+                              desc=f"ベクトル生成中({i // BATCH_CHUNK_SIZE + 1}バッチ目)"):
+                    try:
+                        emb[futures[f]] = f.result(timeout=TIMEOUT_SEC)[0]
+                        encoded.append(futures[f])
+                    except TimeoutError:
+                        print("⚠️ タイムアウト発生、スキップ")
+                    if len(encoded) >= SHARD_FLUSH_CHUNKS:
+                        seqs.append(checkpoint.write(*shard_of(encoded)))
+                        encoded = []
+            if encoded:
+                seqs.append(checkpoint.write(*shard_of(encoded)))
+            for pos, orig_pos in sorted(copy_from.items()):
+                emb[pos] = emb[orig_pos]
+
+            # 再利用分（近似重複）は取得・コピーし直すだけなのでシャードには含めない
+            keep = [pos for pos in range(len(batch)) if emb[pos] is not None]
+            shard = shard_of(keep)
+            add_to_chroma(shard[1], shard[2], shard[0], shard[3])
+            # ✅ 署名は Chroma に登録できた分だけ索引へ（エンコード失敗分は次回の判定元にしない）
+            add_signatures(mh_index, shard[0], shard[2], [sigs[pos] for pos in keep])
+            for seq in seqs:
+                checkpoint.mark_done(seq)
+
+    checkpoint.clear()  # ✅ 全バッチ登録完了
     save_vector_uid_log(all_chunks)
     save_vector_config()
+    # ✅ 回答キャッシュの無効化用（fastapi 側は版が変わった時点で古い回答を使わない）
+    bump_index_version(f"{collection.name}: 新規登録 {len(target_chunks)} 件")
+    print(f"[INFO] 近似重複によるベクトル再利用: {total_reused} 件（エンコード省略）")
+    print(f"[INFO] チャット優先による待機時間: {throttled_seconds():.1f} 秒")
     print(f"✅ Vector登録完了: 新規登録 {len(target_chunks)} 件 / 総計 {len(all_chunks)} 件")
 
 if __name__ == "__main__":
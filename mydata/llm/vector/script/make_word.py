@@ -1,104 +1,131 @@
 #!/usr/bin/env python3
-import os
-import time
 import json
+import time
 import shutil
-import subprocess
 from pathlib import Path
-from tempfile import TemporaryDirectory
 from datetime import datetime
 from PyPDF2 import PdfReader
-from concurrent.futures import ProcessPoolExecutor, as_completed
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
 
 from uid_utils import generate_uid, get_relative_path  # ✅ 最終設計対応
+from ingest_throttle import lower_priority, wait_for_idle
+from soffice_pool import SofficePool, POOL_SIZE
+from word_extract import extract_native_pages, NATIVE_EXTRACTORS
+from boilerplate import strip_boilerplate
 
-LOCKFILE = Path("/tmp/lock_soffice.lock")
 TMP_DIR = Path("/tmp/libre_pdf_output")
 
 TARGET_LOG = Path("/tmp/targets_text_word.jsonl")  # ✅ generate_text.py に合わせる
 TEXT_ROOT = Path("/mydata/llm/vector/db/text")
 NAS_ROOT = Path("/mydata/nas")  # 元ファイル取得用
-BATCH_SIZE = 100
-
-def acquire_lock():
-    while LOCKFILE.exists():
-        try:
-            with LOCKFILE.open() as f:
-                pid = int(f.read().strip())
-            os.kill(pid, 0)
-            print(f"[INFO] LibreOffice 使用中（PID={pid}）、待機中...")
-        except (ValueError, ProcessLookupError):
-            print("[WARN] ロックファイルはあるがプロセスなし。削除して再取得。")
-            LOCKFILE.unlink()
-            continue
-        time.sleep(1)
-    with LOCKFILE.open("w") as f:
-        f.write(str(os.getpid()))
-
-def release_lock():
-    if LOCKFILE.exists():
-        try:
-            LOCKFILE.unlink()
-        except Exception as e:
-            print(f"[WARN] ロック解除失敗: {e}")
-
-def convert_to_pdf(batch):
-    TMP_DIR.mkdir(exist_ok=True)
-    env = dict(os.environ, HOME="/tmp/libre_home")
+
+def convert_to_pdf(pool: SofficePool, original_file: Path, seq: int):
+    """
+    常駐LibreOfficeで1文書ずつPDF化（1文書の失敗・ハングが他の文書を巻き込まない）
+    出力名は連番付き（別フォルダーの同名ファイル衝突を防ぐ）
+    """
+    wait_for_idle("make_word")  # ✅ チャット処理中は変換開始を待機
+    pdf_path = TMP_DIR / f"{seq:06d}_{original_file.stem}.pdf"
+    if pool.convert(original_file, pdf_path) and pdf_path.exists():
+        return pdf_path
+    print(f"[WARN] PDF未出力: {original_file.name}")
+    return None
+
+def save_text(original_file: Path, pages: list) -> int:
+    """
+    ページごとのテキストを <<page:N>> 区切りで保存
+    ✅ 繰り返しヘッダー・フッターを除去してから書き込む（戻り値: 除去文字数）
+    """
+    pages, removed = strip_boilerplate(pages)
+    text_lines = []
+    for i, page_text in enumerate(pages):
+        text_lines.append(f"<<page:{i+1}>>")
+        text_lines.append(page_text.strip())
+
+    # ===== メタ情報（最終設計準拠） =====
+    rel_path = original_file.relative_to(NAS_ROOT)
+    out_path = TEXT_ROOT / rel_path.with_name(rel_path.name + ".txt")
+    out_path.parent.mkdir(parents=True, exist_ok=True)
+
+    uid = generate_uid(original_file)
+    abs_path = out_path.resolve()
+    rel_text_path = get_relative_path(out_path, TEXT_ROOT)
+    ftype = "word"
+    stat = original_file.stat()
+    mtime_iso = datetime.fromtimestamp(stat.st_mtime).isoformat()
+    size = stat.st_size
+
+    # ===== 書き込み =====
+    with out_path.open("w", encoding="utf-8") as f:
+        f.write(f"[UID]: {uid}\n")
+        f.write(f"[ABS_PATH]: {abs_path}\n")
+        f.write(f"[REL_PATH]: {rel_text_path}\n")
+        f.write(f"[TYPE]: {ftype}\n")
+        f.write(f"[MTIME]: {mtime_iso}\n")
+        f.write(f"[SIZE]: {size}\n")
+        f.write(f"[BOILERPLATE_CHARS]: {removed}\n")
+        f.write("----------------------------------------\n")
+        f.write("\n".join(text_lines))
+    return removed
+
+def extract_native_and_save(original_file: Path):
+    """
+    .docx/.rtf の直接抽出（PDF往復なし）
+    戻り値: (結果メッセージ, 処理秒数)。失敗・空の場合はメッセージ None（LibreOfficeへ回す）
+    """
+    wait_for_idle("make_word")  # ✅ チャット処理中は待機
+    started = time.perf_counter()
     try:
-        subprocess.run(
-            ["soffice", "--headless", "--convert-to", "pdf", "--outdir", str(TMP_DIR)]
-            + [str(f) for f in batch],
-            check=True,
-            stdout=subprocess.DEVNULL,
-            stderr=subprocess.PIPE,
-            timeout=90,
-            env=env
-        )
-        return True
-    except subprocess.TimeoutExpired:
-        print(f"[ERROR] LibreOffice変換がタイムアウトしました（{len(batch)}件）")
-    except subprocess.CalledProcessError as e:
-        print(f"[ERROR] LibreOffice変換に失敗: {e.stderr.decode(errors='ignore')}")
-    return False
+        pages = extract_native_pages(original_file)
+        if not any(p.strip() for p in pages):
+            return None, time.perf_counter() - started
+        removed = save_text(original_file, pages)
+        return f"[OK] {original_file.name}（直接抽出・定型行除去 {removed} 文字）", time.perf_counter() - started
+    except Exception as e:
+        print(f"[WARN] 直接抽出失敗 → LibreOffice変換へ: {original_file.name} ({e})")
+        return None, time.perf_counter() - started
 
 def extract_text_and_save(pdf_path: Path, original_file: Path):
     try:
         reader = PdfReader(str(pdf_path))
-        text_lines = []
-        for i, page in enumerate(reader.pages):
-            page_text = page.extract_text() or ""
-            text_lines.append(f"<<page:{i+1}>>")
-            text_lines.append(page_text.strip())
-
-        # ===== メタ情報（最終設計準拠） =====
-        rel_path = original_file.relative_to(NAS_ROOT)
-        out_path = TEXT_ROOT / rel_path.with_name(rel_path.name + ".txt")
-        out_path.parent.mkdir(parents=True, exist_ok=True)
-
-        uid = generate_uid(original_file)
-        abs_path = out_path.resolve()
-        rel_text_path = get_relative_path(out_path, TEXT_ROOT)
-        ftype = "word"
-        stat = original_file.stat()
-        mtime_iso = datetime.fromtimestamp(stat.st_mtime).isoformat()
-        size = stat.st_size
-
-        # ===== 書き込み =====
-        with out_path.open("w", encoding="utf-8") as f:
-            f.write(f"[UID]: {uid}\n")
-            f.write(f"[ABS_PATH]: {abs_path}\n")
-            f.write(f"[REL_PATH]: {rel_text_path}\n")
-            f.write(f"[TYPE]: {ftype}\n")
-            f.write(f"[MTIME]: {mtime_iso}\n")
-            f.write(f"[SIZE]: {size}\n")
-            f.write("----------------------------------------\n")
-            f.write("\n".join(text_lines))
-
-        return f"[OK] {original_file.name}"
+        pages = [page.extract_text() or "" for page in reader.pages]
+        removed = save_text(original_file, pages)
+        return f"[OK] {original_file.name}（定型行除去 {removed} 文字）"
     except Exception as e:
         return f"[ERROR] {pdf_path.name}: {e}"
 
+def convert_with_libreoffice(targets: list) -> int:
+    """常駐LibreOfficeでPDF化 → PyPDF2で抽出（.doc と直接抽出失敗分）。成功件数を返す"""
+    ok = 0
+    TMP_DIR.mkdir(parents=True, exist_ok=True)
+    print(f"[INFO] LibreOffice変換開始: {len(targets)} 件（{POOL_SIZE} インスタンス）")
+
+    # ✅ 変換（常駐LibreOffice・インスタンス数並列）→ 完了した文書から順次テキスト抽出
+    with SofficePool(POOL_SIZE) as pool, \
+            ThreadPoolExecutor(max_workers=POOL_SIZE) as converter, \
+            ProcessPoolExecutor() as executor:
+        conversions = {
+            converter.submit(convert_to_pdf, pool, original_file, seq): original_file
+            for seq, original_file in enumerate(targets)
+        }
+        tasks = {}
+        for conv in as_completed(conversions):
+            pdf_path = conv.result()
+            if pdf_path:
+                tasks[executor.submit(extract_text_and_save, pdf_path, conversions[conv])] = pdf_path
+        for f in as_completed(tasks):
+            result = f.result()
+            print(result)
+            ok += result.startswith("[OK]")
+            tasks[f].unlink(missing_ok=True)
+
+    shutil.rmtree(TMP_DIR, ignore_errors=True)
+    return ok
+
+def print_bench(label: str, count: int, elapsed: float):
+    if count and elapsed > 0:
+        print(f"[BENCH] {label}: {count} 件 / {elapsed:.2f} 秒 = {count / elapsed:.2f} files/sec")
+
 def main():
     if not TARGET_LOG.exists():
         print("[INFO] Wordターゲットが見つかりません。スキップします。")
@@ -111,66 +138,42 @@ def main():
         print("[INFO] 有効なターゲットなし")
         return
 
-    for i in range(0, len(targets), BATCH_SIZE):
-        batch = targets[i:i + BATCH_SIZE]
-        print(f"[INFO] Wordバッチ変換開始（{i}件目～{i+len(batch)-1}件目）")
-
-        acquire_lock()
-        success = convert_to_pdf(batch)
-        release_lock()
+    lower_priority()  # ✅ soffice・ワーカーにも継承される
 
-        if not success:
-            continue
-
-        tasks = []
+    # ✅ 1. .docx/.rtf は直接抽出（高速経路）
+    native = [t for t in targets if t.suffix.lower() in NATIVE_EXTRACTORS]
+    legacy = [t for t in targets if t.suffix.lower() not in NATIVE_EXTRACTORS]
+    native_stats = {}  # 拡張子 → [件数, 処理秒数合計]
+    if native:
+        print(f"[INFO] 直接抽出開始: {len(native)} 件")
+        started = time.perf_counter()
         with ProcessPoolExecutor() as executor:
-            for original_file in batch:
-                pdf_path = TMP_DIR / original_file.with_suffix(".pdf").name
-                if pdf_path.exists():
-                    tasks.append(executor.submit(extract_text_and_save, pdf_path, original_file))
-                else:
-                    print(f"[WARN] PDF未出力: {original_file.name}")
-            for f in as_completed(tasks):
-                print(f.result())
-
-        for original_file in batch:
-            pdf_path = TMP_DIR / original_file.with_suffix(".pdf").name
-            if pdf_path.exists():
-                pdf_path.unlink()
+            futures = {executor.submit(extract_native_and_save, t): t for t in native}
+            for f in as_completed(futures):
+                original_file = futures[f]
+                result, elapsed = f.result()
+                if result is None:
+                    legacy.append(original_file)
+                    continue
+                print(result)
+                stat = native_stats.setdefault(original_file.suffix.lower(), [0, 0.0])
+                stat[0] += 1
+                stat[1] += elapsed
+        native_wall = time.perf_counter() - started
+
+    # ✅ 2. .doc と直接抽出に失敗したものだけ LibreOffice 経由
+    if legacy:
+        started = time.perf_counter()
+        converted = convert_with_libreoffice(legacy)
+        print_bench("LibreOffice経由（並列・実時間）", converted, time.perf_counter() - started)
+
+    # ✅ 形式別スループット（1ワーカーあたり）
+    for ext, (count, elapsed) in sorted(native_stats.items()):
+        print_bench(f"{ext} 直接抽出（1ワーカーあたり）", count, elapsed)
+    if native_stats:
+        print_bench("直接抽出（並列・実時間）", sum(c for c, _ in native_stats.values()), native_wall)
 
-    shutil.rmtree(TMP_DIR, ignore_errors=True)
     TARGET_LOG.unlink(missing_ok=True)
 
 if __name__ == "__main__":
     main()
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
@@ -0,0 +1,143 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+minhash_index.py
+チャンク単位の近似重複検出（MinHash + LSH、SQLite永続化）
+- 文字5-gramのシングル集合から 128 個の MinHash 署名を作成
+- 32バンド × 4行の LSH バケットで候補を絞り、推定Jaccardがしきい値以上なら重複とみなす
+- 索引はコレクションごとに db/minhash/<collection>.sqlite へ保存（パイプラインで増分更新）
+"""
+
+import os
+import re
+import zlib
+import sqlite3
+import hashlib
+import numpy as np
+from pathlib import Path
+
+MINHASH_DIR = Path("/mydata/llm/vector/db/minhash")
+
+NUM_PERM = 128
+SHINGLE_SIZE = 5
+BANDS, ROWS = 32, 4  # BANDS * ROWS == NUM_PERM
+DUP_THRESHOLD = float(os.getenv("MINHASH_DUP_THRESHOLD", "0.9"))
+
+# ✅ 乱数の種を固定（署名は実行をまたいで比較するため）
+_rng = np.random.RandomState(20240901)
+_PERM_A = _rng.randint(1, 2**62, size=NUM_PERM, dtype=np.uint64) | np.uint64(1)
+_PERM_B = _rng.randint(0, 2**62, size=NUM_PERM, dtype=np.uint64)
+_SPACES = re.compile(r"\s+")
+
+def shingles(text: str) -> set:
+    text = _SPACES.sub("", text)
+    if len(text) <= SHINGLE_SIZE:
+        return {text} if text else set()
+    return {text[i:i + SHINGLE_SIZE] for i in range(len(text) - SHINGLE_SIZE + 1)}
+
+def signature(text: str) -> np.ndarray:
+    """MinHash署名（uint32 × NUM_PERM）。空テキストは None"""
+    grams = shingles(text)
+    if not grams:
+        return None
+    hashes = np.fromiter((zlib.crc32(g.encode("utf-8")) for g in grams), dtype=np.uint64, count=len(grams))
+    # 乗算シフト型ハッシュ（64bit で桁あふれさせ上位32bitを使う）
+    with np.errstate(over="ignore"):
+        permuted = (hashes[:, None] * _PERM_A[None, :] + _PERM_B[None, :]) >> np.uint64(32)
+    return permuted.min(axis=0).astype(np.uint32)
+
+def band_keys(sig: np.ndarray) -> list:
+    """バンドごとのバケットキー（8バイトハッシュ → 符号付き64bit整数）"""
+    keys = []
+    for band in range(BANDS):
+        digest = hashlib.blake2b(sig[band * ROWS:(band + 1) * ROWS].tobytes(), digest_size=8).digest()
+        keys.append(int.from_bytes(digest, "big", signed=True))
+    return keys
+
+def estimate_jaccard(a: np.ndarray, b: np.ndarray) -> float:
+    return float(np.mean(a == b))
+
+class MinHashIndex:
+    """コレクション1つ分の署名とLSHバケット"""
+
+    def __init__(self, collection_name: str):
+        MINHASH_DIR.mkdir(parents=True, exist_ok=True)
+        self.conn = sqlite3.connect(str(MINHASH_DIR / f"{collection_name}.sqlite"))
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.executescript("""
+            CREATE TABLE IF NOT EXISTS signatures (
+                chunk_id TEXT PRIMARY KEY,
+                uid TEXT NOT NULL,
+                sig BLOB NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS idx_signatures_uid ON signatures(uid);
+            CREATE TABLE IF NOT EXISTS bands (
+                band INTEGER NOT NULL,
+                bucket INTEGER NOT NULL,
+                chunk_id TEXT NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS idx_bands_bucket ON bands(band, bucket);
+            CREATE INDEX IF NOT EXISTS idx_bands_chunk ON bands(chunk_id);
+        """)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def find_duplicate(self, sig: np.ndarray, threshold: float = DUP_THRESHOLD):
+        """既存チャンクで最も近いもの（推定Jaccard >= threshold）の chunk_id。なければ None"""
+        if sig is None:
+            return None
+        candidates = set()
+        for band, bucket in enumerate(band_keys(sig)):
+            rows = self.conn.execute(
+                "SELECT chunk_id FROM bands WHERE band = ? AND bucket = ?", (band, bucket)
+            ).fetchall()
+            candidates.update(r[0] for r in rows)
+
+        best_id, best_score = None, threshold
+        for chunk_id in candidates:
+            row = self.conn.execute("SELECT sig FROM signatures WHERE chunk_id = ?", (chunk_id,)).fetchone()
+            if not row:
+                continue
+            score = estimate_jaccard(sig, np.frombuffer(row[0], dtype=np.uint32))
+            if score >= best_score:
+                best_id, best_score = chunk_id, score
+        return best_id
+
+    def add(self, chunk_id: str, uid: str, sig: np.ndarray):
+        if sig is None:
+            return
+        self.remove_chunk(chunk_id)
+        self.conn.execute(
+            "INSERT INTO signatures (chunk_id, uid, sig) VALUES (?, ?, ?)",
+            (chunk_id, uid, sig.tobytes())
+        )
+        self.conn.executemany(
+            "INSERT INTO bands (band, bucket, chunk_id) VALUES (?, ?, ?)",
+            [(band, bucket, chunk_id) for band, bucket in enumerate(band_keys(sig))]
+        )
+
+    def remove_chunk(self, chunk_id: str):
+        self.conn.execute("DELETE FROM bands WHERE chunk_id = ?", (chunk_id,))
+        self.conn.execute("DELETE FROM signatures WHERE chunk_id = ?", (chunk_id,))
+
+    def remove_uids(self, uids) -> int:
+        """UID単位で署名を削除（delete_vector から呼ぶ）。削除チャンク数を返す"""
+        removed = 0
+        for uid in set(uids):
+            chunk_ids = [r[0] for r in self.conn.execute("SELECT chunk_id FROM signatures WHERE uid = ?", (uid,))]
+            for chunk_id in chunk_ids:
+                self.remove_chunk(chunk_id)
+            removed += len(chunk_ids)
+        self.commit()
+        return removed
+
+    def commit(self):
+        self.conn.commit()
+
+    def close(self):
+        self.conn.commit()
+        self.conn.close()
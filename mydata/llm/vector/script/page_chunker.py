@@ -0,0 +1,151 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+page_chunker.py
+ページ単位のストリーミングチャンク化（PDF / Word / 画像 共通）
+- テキストファイルを1行ずつ読み、<<page:N>> 区切りでページ本文を逐次取り出す
+- ページ → チャンク の順に生成し、呼び出し側で逐次書き出す
+- CHUNK_MODE=sentence（既定）: 文境界・トークン数基準（sentence_chunker.py）
+  CHUNK_MODE=fixed: 従来の固定長（350文字・重なり50文字）
+- 保持するのは「現在のページ + チャンク1個分」のみ（文書サイズに依存しないメモリ量）
+- 各チャンクにテキストファイル上の文字位置・バイト位置を記録（seek / mmap で原文を切り出せる）
+"""
+
+import re
+import os
+import itertools
+from pathlib import Path
+from typing import Iterator, Tuple, Dict, Any
+
+from uid_utils import generate_chunk_index  # ✅ インデックス付番用（uidはテキストログのものを使う）
+from sentence_chunker import iter_sentence_chunks
+from text_offsets import iter_lines_with_offsets, ByteOffsets, clean_with_offsets
+
+HEADER_SEPARATOR = "----------------------------------------"
+PAGE_PATTERN = re.compile(r"<<page:(\d+)>>")
+
+CHUNK_SIZE = 350
+CHUNK_OVERLAP = 50
+CHUNK_MODE = os.getenv("CHUNK_MODE", "sentence")
+
+def iter_body_pages(txt_path: Path) -> Iterator[Tuple[int, str, int, int]]:
+    """
+    メタ情報ヘッダー（区切り線まで）を読み飛ばし、
+    (ページ番号, ページ本文, 本文先頭の文字位置, 同バイト位置) を逐次返す
+    ページマーカーのない旧形式テキストは全体を1ページ目として扱う
+    """
+    with open(txt_path, "r", encoding="utf-8", newline="") as f:
+        lines = iter_lines_with_offsets(f)
+        header = []
+        for line, char_pos, byte_pos in lines:
+            header.append((line, char_pos, byte_pos))
+            if line.strip() == HEADER_SEPARATOR:
+                header = []
+                break
+
+        page_no, buf, page_char, page_byte = 1, [], None, None
+        # 区切り線がなければ読んだ行をそのまま本文として扱う
+        for line, char_pos, byte_pos in itertools.chain(header, lines):
+            m = PAGE_PATTERN.fullmatch(line.strip())
+            if m:
+                if buf:
+                    yield page_no, "".join(buf), page_char, page_byte
+                    buf = []
+                page_no = int(m.group(1))
+                continue
+            if not buf:
+                page_char, page_byte = char_pos, byte_pos
+            buf.append(line)
+        if buf:
+            yield page_no, "".join(buf), page_char, page_byte
+
+def iter_page_chunks(pages, chunk_size=CHUNK_SIZE, overlap=CHUNK_OVERLAP) -> Iterator[Dict[str, Any]]:
+    """
+    ページ列から固定長（重なりあり）チャンクを逐次生成
+    ✅ ページ間は空白1つで連結（全文結合→分割と同じ切れ目）
+    ✅ 各チャンクに開始ページ page / 終了ページ page_end と、
+       テキストファイル上の文字位置・バイト位置（整形前の範囲）を付与
+    """
+    step = chunk_size - overlap
+    buffer = ""
+    buf_start = 0          # buffer[0] の文書先頭からの位置
+    segments = []          # (開始位置, ページ番号, 整形前位置表, ByteOffsets, ページ先頭の文字位置)
+
+    def locate(pos: int, end: bool = False):
+        """整形後の位置 → (ページ番号, 文字位置, バイト位置)。end=True は pos の文字の直後"""
+        seg = segments[0]
+        for s in segments:
+            if s[0] > pos:
+                break
+            seg = s
+        seg_start, page_no, offsets, byte_at, char_base = seg
+        local = pos - seg_start
+        if local < len(offsets):
+            src = offsets[local] + (1 if end else 0)
+        else:
+            src = offsets[-1] + 1  # ページ間の区切り空白
+        return page_no, char_base + src, byte_at.at(src)
+
+    def emit():
+        text = buffer[:chunk_size]
+        page, char_start, byte_start = locate(buf_start)
+        page_end, char_end, byte_end = locate(buf_start + len(text) - 1, end=True)
+        return {
+            "text": text,
+            "page": page,
+            "page_end": page_end,
+            "char_start": char_start,
+            "char_end": char_end,
+            "byte_start": byte_start,
+            "byte_end": byte_end,
+        }
+
+    def advance():
+        nonlocal buffer, buf_start
+        buffer = buffer[step:]
+        buf_start += step
+        # ✅ 参照されなくなったページを捨てる
+        while len(segments) > 1 and segments[1][0] <= buf_start:
+            segments.pop(0)
+
+    for page_no, page_text, char_base, byte_base in pages:
+        cleaned, offsets = clean_with_offsets(page_text)
+        if not cleaned:
+            continue
+        if buffer:
+            buffer += " "
+        segments.append((buf_start + len(buffer), page_no, offsets, ByteOffsets(page_text, byte_base), char_base))
+        buffer += cleaned
+
+        while len(buffer) >= chunk_size:
+            yield emit()
+            advance()
+
+    while buffer:
+        yield emit()
+        advance()
+
+def iter_chunks(pages) -> Iterator[Dict[str, Any]]:
+    """CHUNK_MODE に応じたチャンク生成"""
+    if CHUNK_MODE == "fixed":
+        return iter_page_chunks(pages)
+    return iter_sentence_chunks(pages)
+
+def write_chunk_file(txt_path: Path, text_root: Path, writer, uid: str, ftype: str,
+                     chunks: Iterator[Dict[str, Any]]) -> int:
+    """
+    チャンクを1件ずつチャンクストアへ追記（ChunkStoreWriter がバッファして書き出す）
+    戻り値: チャンク数
+    """
+    rel_path = str(txt_path.relative_to(text_root))
+    count = 0
+    for i, chunk in enumerate(chunks):
+        writer.append({
+            "uid": uid,             # ✅ テキストUIDをそのまま利用
+            "index": generate_chunk_index(i),
+            "path": rel_path,       # TEXT_ROOT基準の相対パス
+            "type": ftype,
+            **chunk
+        })
+        count += 1
+    return count
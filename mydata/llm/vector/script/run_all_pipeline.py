@@ -3,6 +3,7 @@ import subprocess
 import os
 import sys
 from pathlib import Path
+from ingest_throttle import lower_priority, wait_for_idle
 
 LOCK_FILE = Path("/tmp/run_all_pipeline.lock")
 
@@ -28,7 +29,9 @@ def main():
 
     try:
         LOCK_FILE.write_text("locked")
+        lower_priority()  # ✅ 全ステップ（子プロセス）を推論より低優先で実行
         for name, command in STEPS:
+            wait_for_idle(f"run_all_pipeline:{name}")
             print(f"\n=== ▶ {name} ===")
             result = subprocess.run(command, shell=True)
             if result.returncode != 0:
@@ -0,0 +1,149 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+sentence_chunker.py
+文境界・トークン数基準のチャンク化（日本語法律文書向け）
+- 「。」「」」・改行で文に分割し、埋め込みモデル（legal-bge-m3）のトークン数で上限まで詰める
+- トークン数はページ単位でまとめて数える（fast tokenizer のバッチ処理）
+- トークナイザーが読み込めない環境では文字種から概算
+- 上限を超える1文だけは文字位置で分割（モデル側での切り捨てを防ぐ）
+"""
+
+import os
+import re
+from typing import Iterator, Dict, Any, List, Tuple
+
+from text_offsets import ByteOffsets, clean_with_offsets
+
+MODEL_NAME = "/mydata/llm/vector/models/legal-bge-m3"
+
+CHUNK_TOKENS = int(os.getenv("CHUNK_TOKENS", "320"))            # 1チャンクの上限（特殊トークン除く）
+CHUNK_OVERLAP_TOKENS = int(os.getenv("CHUNK_OVERLAP_TOKENS", "48"))  # 前チャンク末尾から引き継ぐ文の上限
+
+SENTENCE_PATTERN = re.compile(r"[^。」\n]*(?:[。」]+|\n|$)")
+CJK_CHAR = re.compile(r"[\u3000-\u30ff\u3400-\u9fff\uf900-\ufaff\uff00-\uffef]")
+
+_tokenizer = None
+_tokenizer_failed = False
+
+def get_tokenizer():
+    """トークナイザーを初回のみ読み込む（失敗時は None で概算に切り替え）"""
+    global _tokenizer, _tokenizer_failed
+    if _tokenizer is None and not _tokenizer_failed:
+        try:
+            from transformers import AutoTokenizer
+            _tokenizer = AutoTokenizer.from_pretrained(MODEL_NAME, use_fast=True)
+        except Exception as e:
+            print(f"[WARN] トークナイザー読み込み失敗 → 概算で計数: {e}")
+            _tokenizer_failed = True
+    return _tokenizer
+
+def approx_tokens(text: str) -> int:
+    """和文は1文字≒1トークン、欧文は4文字≒1トークンで概算"""
+    cjk = len(CJK_CHAR.findall(text))
+    return cjk + (len(text) - cjk + 3) // 4
+
+def count_tokens(texts: List[str]) -> List[int]:
+    """複数テキストのトークン数をまとめて計数"""
+    if not texts:
+        return []
+    tokenizer = get_tokenizer()
+    if tokenizer is None:
+        return [approx_tokens(t) for t in texts]
+    encoded = tokenizer(texts, add_special_tokens=False, return_attention_mask=False)
+    return [len(ids) for ids in encoded["input_ids"]]
+
+def clean_sentence(text: str) -> str:
+    text = text.replace("　", " ")
+    text = re.sub(r"\s+", " ", text)
+    return text.strip()
+
+def split_sentences(text: str) -> List[Tuple[str, str, int, int]]:
+    """
+    文に分割し (文, 後続の区切り, 開始位置, 終了位置) を返す（位置は text 内・前後空白を除いた範囲）
+    句点・鉤括弧で終わる文は詰めて連結、改行で終わる行（見出し等）は空白で連結
+    """
+    sentences = []
+    for m in SENTENCE_PATTERN.finditer(text):
+        raw = m.group(0)
+        sentence = clean_sentence(raw)
+        if sentence:
+            start = m.start() + len(raw) - len(raw.lstrip())
+            end = m.start() + len(raw.rstrip())
+            sentences.append((sentence, " " if raw.endswith("\n") else "", start, end))
+    return sentences
+
+def split_long_sentence(sentence: str, tokens: int, budget: int) -> List[Tuple[str, int, int, int]]:
+    """上限超えの1文を、トークン密度に応じた文字数で分割。(断片, トークン数, 開始, 終了) を返す"""
+    step = max(1, len(sentence) * budget // tokens)
+    bounds = [(i, min(i + step, len(sentence))) for i in range(0, len(sentence), step)]
+    pieces = [sentence[a:b] for a, b in bounds]
+    return [(piece, n, a, b) for piece, n, (a, b) in zip(pieces, count_tokens(pieces), bounds)]
+
+def iter_sentence_chunks(pages, budget: int = CHUNK_TOKENS,
+                         overlap: int = CHUNK_OVERLAP_TOKENS) -> Iterator[Dict[str, Any]]:
+    """
+    ページ列 (ページ番号, 本文, 本文先頭の文字位置, 同バイト位置) から、
+    文単位でトークン上限まで詰めたチャンクを逐次生成
+    ✅ 次のチャンクには直前チャンク末尾の文を overlap トークン以内で引き継ぐ
+    ✅ 各チャンクに開始・終了ページ（page / page_end）、トークン数（tokens）、
+       テキストファイル上の文字位置（char_start / char_end）・バイト位置（byte_start / byte_end）を付与
+    """
+    window = []  # (文, 区切り, トークン数, ページ番号, 文字開始, 文字終了, バイト開始, バイト終了)
+    window_tokens = 0
+
+    def emit():
+        text = "".join(item[0] + item[1] for item in window).strip()
+        return {
+            "text": text,
+            "page": window[0][3],
+            "page_end": window[-1][3],
+            "tokens": window_tokens,
+            "char_start": window[0][4],
+            "char_end": window[-1][5],
+            "byte_start": window[0][6],
+            "byte_end": window[-1][7],
+        }
+
+    def carry_over():
+        kept, kept_tokens = [], 0
+        for item in reversed(window[1:]):
+            if kept_tokens + item[2] > overlap:
+                break
+            kept.insert(0, item)
+            kept_tokens += item[2]
+        return kept, kept_tokens
+
+    for page_no, page_text, char_base, byte_base in pages:
+        sentences = split_sentences(page_text)
+        if not sentences:
+            continue
+        counts = count_tokens([s[0] for s in sentences])
+        byte_at = ByteOffsets(page_text, byte_base)
+
+        for (sentence, sep, start, end), tokens in zip(sentences, counts):
+            if tokens <= budget:
+                pieces = [(sentence, tokens, start, end)]
+            else:
+                # 断片の位置は整形前テキスト上の位置へ戻す
+                _, offsets = clean_with_offsets(page_text[start:end])
+                pieces = [
+                    (piece, n, start + offsets[a], start + offsets[b - 1] + 1)
+                    for piece, n, a, b in split_long_sentence(sentence, tokens, budget)
+                ]
+            for k, (piece, piece_tokens, start, end) in enumerate(pieces):
+                piece_sep = sep if k == len(pieces) - 1 else ""
+                if window and window_tokens + piece_tokens > budget:
+                    yield emit()
+                    window, window_tokens = carry_over()
+                    # 引き継ぎ分と合わせて上限を超える場合は引き継ぎを捨てる
+                    if window_tokens + piece_tokens > budget:
+                        window, window_tokens = [], 0
+                window.append((
+                    piece, piece_sep, piece_tokens, page_no,
+                    char_base + start, char_base + end, byte_at.at(start), byte_at.at(end)
+                ))
+                window_tokens += piece_tokens
+
+    if window:
+        yield emit()
@@ -0,0 +1,172 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+soffice_pool.py
+常駐 headless LibreOffice のプール（UNO経由で1文書ずつPDF変換）
+- インスタンスごとに独立したユーザープロファイル・UNOポートを持つため、グローバルロック不要
+- 文書ごとにタイムアウトを設け、ハング・異常終了したインスタンスは自動で再起動
+  （soffice 本体だけが落ちてブリッジが生きている場合も、送信前の生存確認と
+    変換失敗時のエラー内容（UNO の接続断）から検知する）
+- 変換スループットはインスタンス数に比例
+"""
+
+import os
+import json
+import queue
+import shutil
+import signal
+import threading
+import subprocess
+from pathlib import Path
+
+# === 設定 ===
+PROFILE_ROOT = Path("/tmp/libre_profiles")
+BRIDGE_SCRIPT = Path(__file__).resolve().parent / "soffice_uno_bridge.py"
+UNO_PYTHON = os.getenv("UNO_PYTHON", "/usr/bin/python3")  # python3-uno が使えるPython
+BASE_PORT = int(os.getenv("SOFFICE_BASE_PORT", "2202"))
+POOL_SIZE = int(os.getenv("SOFFICE_POOL_SIZE", str(max(1, min(4, (os.cpu_count() or 2) // 2)))))
+DOC_TIMEOUT = int(os.getenv("SOFFICE_DOC_TIMEOUT", "60"))
+STARTUP_TIMEOUT = 90
+# 変換失敗の返信に含まれていたら soffice との接続が切れている（再起動が必要）とみなす
+CONNECTION_ERRORS = ("DisposedException", "disposed", "Connection", "connection", "Broken pipe")
+
+class SofficeInstance:
+    """soffice本体 + UNOブリッジ 1組"""
+
+    def __init__(self, slot: int):
+        self.slot = slot
+        self.port = BASE_PORT + slot
+        self.profile_dir = PROFILE_ROOT / f"slot{slot}"
+        self.soffice = None
+        self.bridge = None
+        self.replies = None
+
+    def start(self):
+        self.profile_dir.mkdir(parents=True, exist_ok=True)
+        env = dict(os.environ, HOME=str(self.profile_dir))
+        self.soffice = subprocess.Popen(
+            [
+                "soffice", "--headless", "--invisible", "--nologo", "--norestore",
+                "--nodefault", "--nolockcheck",
+                f"-env:UserInstallation={self.profile_dir.as_uri()}",
+                f"--accept=socket,host=127.0.0.1,port={self.port};urp;StarOffice.ComponentContext",
+            ],
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+            env=env,
+            start_new_session=True,  # soffice.bin ごとプロセスグループで停止するため
+        )
+        self.bridge = subprocess.Popen(
+            [UNO_PYTHON, str(BRIDGE_SCRIPT), str(self.port)],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL,
+            text=True,
+            encoding="utf-8",
+            env=env,
+            start_new_session=True,
+        )
+        self.replies = queue.Queue()
+        threading.Thread(target=self._read_replies, args=(self.bridge, self.replies), daemon=True).start()
+
+        try:
+            ready = self.replies.get(timeout=STARTUP_TIMEOUT)
+        except queue.Empty:
+            ready = None
+        if not ready or not ready.get("ready"):
+            self.stop()
+            raise RuntimeError(f"LibreOffice起動失敗（slot={self.slot}）")
+        print(f"[INFO] LibreOffice起動（slot={self.slot}, port={self.port}）")
+
+    @staticmethod
+    def _read_replies(proc, replies):
+        for line in proc.stdout:
+            try:
+                replies.put(json.loads(line))
+            except json.JSONDecodeError:
+                continue
+        replies.put(None)  # ブリッジ終了通知
+
+    def stop(self):
+        for proc in (self.bridge, self.soffice):
+            if proc is None or proc.poll() is not None:
+                continue
+            try:
+                os.killpg(proc.pid, signal.SIGKILL)
+            except ProcessLookupError:
+                pass
+            proc.wait()
+        self.soffice = self.bridge = None
+
+    def restart(self):
+        print(f"[WARN] LibreOffice再起動（slot={self.slot}）")
+        self.stop()
+        # ハング時はプロファイルが壊れていることがあるため作り直す
+        shutil.rmtree(self.profile_dir, ignore_errors=True)
+        self.start()
+
+    def alive(self) -> bool:
+        return all(proc is not None and proc.poll() is None for proc in (self.soffice, self.bridge))
+
+    def convert(self, src: Path, dst: Path, timeout: int = DOC_TIMEOUT) -> bool:
+        if not self.alive():
+            self.restart()
+        try:
+            self.bridge.stdin.write(json.dumps({"src": str(src), "dst": str(dst)}, ensure_ascii=False) + "\n")
+            self.bridge.stdin.flush()
+            reply = self.replies.get(timeout=timeout)
+        except queue.Empty:
+            print(f"[ERROR] LibreOffice変換タイムアウト（{timeout}秒）: {src.name}")
+            self.restart()
+            return False
+        except (BrokenPipeError, OSError) as e:
+            print(f"[ERROR] UNOブリッジ通信失敗: {src.name} ({e})")
+            self.restart()
+            return False
+
+        if reply is None:
+            print(f"[ERROR] UNOブリッジ異常終了: {src.name}")
+            self.restart()
+            return False
+        if not reply.get("ok"):
+            error = reply.get("error") or ""
+            print(f"[ERROR] LibreOffice変換に失敗: {src.name}: {error}")
+            # ✅ 文書が原因で soffice が落ちた場合は、次の文書の前に作り直す
+            if not self.alive() or any(key in error for key in CONNECTION_ERRORS):
+                self.restart()
+            return False
+        return True
+
+class SofficePool:
+    """空いているインスタンスに1文書ずつ割り当てる（スレッドセーフ）"""
+
+    def __init__(self, size: int = POOL_SIZE):
+        self.size = size
+        self.instances = []
+        self.idle = queue.Queue()
+
+    def __enter__(self):
+        for slot in range(self.size):
+            inst = SofficeInstance(slot)
+            inst.start()
+            self.instances.append(inst)
+            self.idle.put(inst)
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def convert(self, src: Path, dst: Path, timeout: int = DOC_TIMEOUT) -> bool:
+        inst = self.idle.get()
+        try:
+            return inst.convert(src, dst, timeout)
+        except Exception as e:
+            print(f"[ERROR] LibreOffice変換例外: {src.name} ({e})")
+            return False
+        finally:
+            self.idle.put(inst)
+
+    def close(self):
+        for inst in self.instances:
+            inst.stop()
+        self.instances.clear()
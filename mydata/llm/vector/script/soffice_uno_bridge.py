@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+soffice_uno_bridge.py
+LibreOffice 側の Python（python3-uno が入った /usr/bin/python3）で実行する UNO ブリッジ
+※アプリ側の Python からは uno を import できないため、soffice_pool.py が子プロセスとして起動する
+
+使い方: soffice_uno_bridge.py <UNOポート>
+- 起動後、常駐 soffice に接続できたら {"ready": true} を1行出力
+- 標準入力から {"src": 入力パス, "dst": 出力PDFパス} を1行ずつ受け取り
+  1文書ずつ変換して {"ok": bool, "error": str} を1行返す
+"""
+
+import sys
+import json
+import time
+
+import uno
+from com.sun.star.beans import PropertyValue
+
+CONNECT_TIMEOUT = 60
+
+def make_prop(name, value):
+    prop = PropertyValue()
+    prop.Name = name
+    prop.Value = value
+    return prop
+
+def connect_desktop(port: int):
+    """常駐 soffice の Desktop を取得（起動直後は待ち合わせ）"""
+    local_ctx = uno.getComponentContext()
+    resolver = local_ctx.ServiceManager.createInstanceWithContext(
+        "com.sun.star.bridge.UnoUrlResolver", local_ctx
+    )
+    url = f"uno:socket,host=127.0.0.1,port={port};urp;StarOffice.ComponentContext"
+    deadline = time.time() + CONNECT_TIMEOUT
+    while True:
+        try:
+            ctx = resolver.resolve(url)
+            return ctx.ServiceManager.createInstanceWithContext("com.sun.star.frame.Desktop", ctx)
+        except Exception:
+            if time.time() > deadline:
+                raise
+            time.sleep(0.5)
+
+def convert(desktop, src: str, dst: str):
+    load_props = (
+        make_prop("Hidden", True),
+        make_prop("ReadOnly", True),
+        make_prop("MacroExecutionMode", 0),  # マクロは実行しない
+        make_prop("UpdateDocMode", 0),       # リンク更新しない
+    )
+    doc = desktop.loadComponentFromURL(uno.systemPathToFileUrl(src), "_blank", 0, load_props)
+    if doc is None:
+        raise RuntimeError("文書の読み込みに失敗しました")
+    try:
+        doc.storeToURL(uno.systemPathToFileUrl(dst), (make_prop("FilterName", "writer_pdf_Export"),))
+    finally:
+        doc.close(True)
+
+def reply(obj: dict):
+    sys.stdout.write(json.dumps(obj, ensure_ascii=False) + "\n")
+    sys.stdout.flush()
+
+def main():
+    port = int(sys.argv[1])
+    desktop = connect_desktop(port)
+    reply({"ready": True})
+
+    for line in sys.stdin:
+        if not line.strip():
+            continue
+        try:
+            job = json.loads(line)
+            convert(desktop, job["src"], job["dst"])
+            reply({"ok": True, "error": ""})
+        except Exception as e:
+            # 例外名も返す（DisposedException 等の接続断をプール側で判定するため）
+            reply({"ok": False, "error": f"{type(e).__name__}: {e}"})
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,66 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+test_soffice_pool.py
+soffice_pool の再起動まわりのテスト（LibreOffice なしで動くよう、soffice とブリッジは偽物に差し替え）
+  python3 -m pytest test_soffice_pool.py
+"""
+
+import os
+import sys
+import signal
+import textwrap
+
+import pytest
+
+import soffice_pool
+
+FAKE_BRIDGE = textwrap.dedent("""
+    import sys, json
+    print(json.dumps({"ready": True}), flush=True)
+    for line in sys.stdin:
+        job = json.loads(line)
+        if "crash" in job["src"]:
+            print(json.dumps({"ok": False, "error": "DisposedException: Binary URP bridge disposed during call"}), flush=True)
+            continue
+        open(job["dst"], "w").close()
+        print(json.dumps({"ok": True, "error": ""}), flush=True)
+""")
+
+@pytest.fixture
+def instance(tmp_path, monkeypatch):
+    bin_dir = tmp_path / "bin"
+    bin_dir.mkdir()
+    fake_soffice = bin_dir / "soffice"
+    fake_soffice.write_text("#!/bin/sh\nexec sleep 600\n")
+    fake_soffice.chmod(0o755)
+    bridge = tmp_path / "bridge.py"
+    bridge.write_text(FAKE_BRIDGE)
+
+    monkeypatch.setenv("PATH", f"{bin_dir}{os.pathsep}{os.environ['PATH']}")
+    monkeypatch.setattr(soffice_pool, "PROFILE_ROOT", tmp_path / "profiles")
+    monkeypatch.setattr(soffice_pool, "BRIDGE_SCRIPT", bridge)
+    monkeypatch.setattr(soffice_pool, "UNO_PYTHON", sys.executable)
+
+    inst = soffice_pool.SofficeInstance(0)
+    inst.start()
+    yield inst
+    inst.stop()
+
+def test_restart_after_soffice_killed(instance, tmp_path):
+    assert instance.convert(tmp_path / "a.docx", tmp_path / "a.pdf")
+    old_pid = instance.soffice.pid
+
+    # soffice 本体だけを落とす（ブリッジは生きたまま）
+    os.killpg(old_pid, signal.SIGKILL)
+    instance.soffice.wait()
+
+    assert instance.convert(tmp_path / "b.docx", tmp_path / "b.pdf")
+    assert instance.soffice.pid != old_pid
+    assert (tmp_path / "b.pdf").exists()
+
+def test_restart_after_disposed_reply(instance, tmp_path):
+    old_pid = instance.soffice.pid
+    assert not instance.convert(tmp_path / "crash.docx", tmp_path / "crash.pdf")
+    assert instance.soffice.pid != old_pid
+    assert instance.convert(tmp_path / "c.docx", tmp_path / "c.pdf")
@@ -0,0 +1,60 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+text_offsets.py
+db/text ファイル上の文字位置・バイト位置の計算（チャンクの出典位置記録用）
+- 文字位置: Pythonの文字（コードポイント）単位、改行は変換せずファイルのまま数える
+- バイト位置: UTF-8 バイト単位（seek / mmap でそのまま切り出せる）
+"""
+
+from typing import Iterator, List, Tuple
+
+def iter_lines_with_offsets(f) -> Iterator[Tuple[str, int, int]]:
+    """
+    (行, 行頭の文字位置, 行頭のバイト位置) を逐次返す
+    ※ f は open(..., encoding="utf-8", newline="") で開くこと（改行変換で位置がずれるため）
+    """
+    char_pos = byte_pos = 0
+    for line in f:
+        yield line, char_pos, byte_pos
+        char_pos += len(line)
+        byte_pos += len(line.encode("utf-8"))
+
+class ByteOffsets:
+    """
+    テキスト内の文字位置 → ファイル上のバイト位置
+    前から順に引く場合は差分だけエンコードするため、ページ長に比例した計算量で済む
+    """
+
+    def __init__(self, text: str, base_byte: int = 0):
+        self.text = text
+        self.last_pos = 0
+        self.last_byte = base_byte
+        self.base_byte = base_byte
+
+    def at(self, pos: int) -> int:
+        if pos < self.last_pos:
+            self.last_pos, self.last_byte = 0, self.base_byte
+        self.last_byte += len(self.text[self.last_pos:pos].encode("utf-8"))
+        self.last_pos = pos
+        return self.last_byte
+
+def clean_with_offsets(text: str) -> Tuple[str, List[int]]:
+    """
+    空白の連続を半角空白1つに畳み前後を除去（全角空白含む）
+    戻り値: (整形後テキスト, 整形後の各文字に対応する元テキスト上の位置)
+    """
+    chars, offsets = [], []
+    pending_space = -1
+    for i, ch in enumerate(text):
+        if ch.isspace():
+            if chars and pending_space < 0:
+                pending_space = i
+            continue
+        if pending_space >= 0:
+            chars.append(" ")
+            offsets.append(pending_space)
+            pending_space = -1
+        chars.append(ch)
+        offsets.append(i)
+    return "".join(chars), offsets
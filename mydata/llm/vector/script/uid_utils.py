@@ -8,10 +8,11 @@ UID発番・インデックス付番・ログ操作・相対パス取得に特
 import os
 import json
 import hashlib
-import orjson
 from pathlib import Path
 from typing import List, Dict, Any
 
+CHUNK_BASE_KEYS = ("uid", "index", "path", "type", "text")
+
 # ====== 1. UID生成（テキスト用・一元管理） ======
 def generate_uid(file_path: Path) -> str:
     """
@@ -65,35 +66,44 @@ def ensure_dir_exists(path: Path) -> None:
     """ディレクトリがなければ作成"""
     path.mkdir(parents=True, exist_ok=True)
 
-# ====== 6. チャンクインデックス発番ログ ======
-def rebuild_chunk_log_fast(chunk_dir: Path, log_path: Path) -> int:
+def chunk_extra_meta(entry: Dict[str, Any]) -> Dict[str, Any]:
     """
-    チャンクフォルダ全体をスキャンして chunk_log.jsonl を再生成
-    ✅ UID, index, path, type のみ高速収集（textは読み込まない）
-    ✅ orjsonで高速パース
+    チャンクレコードの付加情報（sheet, row_start 等）をChromaメタデータ形式に変換
+    ✅ uid/index/path/type/text 以外のキーが対象
+    ✅ Chromaはスカラー値のみ保持できるため、リスト等はJSON文字列化・Noneは除外
     """
-    entries = []
-    for chunk_file in chunk_dir.rglob("*.jsonl"):
-        try:
-            with chunk_file.open("r", encoding="utf-8") as f:
-                for line in f:
-                    if not line.strip():
-                        continue
-                    obj = orjson.loads(line)
-                    entries.append({
-                        "uid": obj["uid"],
-                        "index": obj["index"],
-                        "path": obj["path"],
-                        "type": obj.get("type", "unknown")
-                    })
-        except Exception as e:
-            print(f"[WARN] チャンクログ構築失敗: {chunk_file} ({e})")
+    meta = {}
+    for key, value in entry.items():
+        if key in CHUNK_BASE_KEYS or value is None:
             continue
+        if isinstance(value, (str, int, float, bool)):
+            meta[key] = value
+        else:
+            meta[key] = json.dumps(value, ensure_ascii=False)
+    return meta
+
+# ====== 6. チャンクインデックス発番ログ ======
+def rebuild_chunk_log_fast(store_dir: Path, log_path: Path) -> int:
+    """
+    チャンクストア全体を走査して chunk_log.jsonl を再生成
+    ✅ UID, index, path, type の列だけを読む（text列は読み込まない）
+    """
+    from chunk_store import ChunkStore  # pyarrow は必要なスクリプトでのみ読み込む
+
+    entries = [
+        {
+            "uid": row["uid"],
+            "index": row["index"],
+            "path": row["path"],
+            "type": row.get("type") or "unknown"
+        }
+        for row in ChunkStore(store_dir).scan_meta()
+    ]
 
     write_jsonl_atomic_sync(log_path, entries)
     print(f"[INFO] チャンクログ更新: {log_path.name}（{len(entries)} 件・fsync済）")
     return len(entries)
-    
+
 # ====== 7. 回帰的フォルダー抹消 ======
 def remove_empty_dirs(base_dir: Path, exclude: tuple = ()):
     """
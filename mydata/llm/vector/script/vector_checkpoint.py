@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+vector_checkpoint.py
+エンコード済みベクトルのチェックポイント（Chroma登録前にディスクへ確定）
+- エンコード完了 N 件ごとに1シャード: shard-<連番>.npy（float16）＋ shard-<連番>.json（id・メタデータ・本文）
+- .npy → .json の順に一時ファイル経由で書き出し、.json の存在をシャード確定の印とする
+- Chroma登録後に done.log へ連番を追記
+- 再実行時は done.log にない確定済みシャードを再登録するだけで、再エンコードしない
+- 全件完了後にシャードを削除（VECTOR_KEEP_SHARDS=1 で保持）
+"""
+
+import os
+import json
+import numpy as np
+from pathlib import Path
+from typing import Iterator, List
+
+SHARD_ROOT = Path("/mydata/llm/vector/db/vector_shards")
+KEEP_SHARDS = os.getenv("VECTOR_KEEP_SHARDS", "0") == "1"
+
+def _fsync_replace(tmp_path: Path, path: Path):
+    with open(tmp_path, "rb+") as f:
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+class ShardCheckpoint:
+    """コレクション1つ分のシャード置き場"""
+
+    def __init__(self, collection_name: str):
+        self.dir = SHARD_ROOT / collection_name
+        self.dir.mkdir(parents=True, exist_ok=True)
+        self.done_log = self.dir / "done.log"
+
+    def _seqs(self) -> List[int]:
+        """確定済み（manifestあり）シャードの連番"""
+        return sorted(int(p.stem.split("-")[1]) for p in self.dir.glob("shard-*.json"))
+
+    def _done(self) -> set:
+        if not self.done_log.exists():
+            return set()
+        with self.done_log.open("r", encoding="utf-8") as f:
+            return {int(line) for line in f if line.strip()}
+
+    def write(self, ids: list, embeddings: list, metadatas: list, documents: list) -> int:
+        """シャードを確定し連番を返す（この時点でエンコード結果は失われない）"""
+        seq = max(self._seqs(), default=0) + 1
+        base = self.dir / f"shard-{seq:06d}"
+
+        npy_tmp = base.with_suffix(".npy.tmp")
+        with open(npy_tmp, "wb") as f:
+            np.save(f, np.asarray(embeddings, dtype=np.float16))
+        _fsync_replace(npy_tmp, base.with_suffix(".npy"))
+
+        json_tmp = base.with_suffix(".json.tmp")
+        with open(json_tmp, "w", encoding="utf-8") as f:
+            json.dump({"ids": ids, "metadatas": metadatas, "documents": documents}, f, ensure_ascii=False)
+        _fsync_replace(json_tmp, base.with_suffix(".json"))
+        return seq
+
+    def mark_done(self, seq: int):
+        with self.done_log.open("a", encoding="utf-8") as f:
+            f.write(f"{seq}\n")
+            f.flush()
+            os.fsync(f.fileno())
+
+    def pending(self) -> Iterator[tuple]:
+        """Chroma未登録の確定済みシャード: (連番, ids, embeddings, metadatas, documents)"""
+        done = self._done()
+        for seq in self._seqs():
+            if seq in done:
+                continue
+            base = self.dir / f"shard-{seq:06d}"
+            try:
+                embeddings = np.load(base.with_suffix(".npy")).astype(np.float32).tolist()
+                with base.with_suffix(".json").open("r", encoding="utf-8") as f:
+                    manifest = json.load(f)
+            except Exception as e:
+                print(f"[WARN] シャード読み込み失敗（スキップ）: {base.name} ({e})")
+                continue
+            if len(embeddings) != len(manifest["ids"]):
+                print(f"[WARN] シャード件数不一致（スキップ）: {base.name}")
+                continue
+            yield seq, manifest["ids"], embeddings, manifest["metadatas"], manifest["documents"]
+
+    def clear(self):
+        """全シャード登録完了後に削除（未確定の一時ファイル含む）"""
+        if KEEP_SHARDS:
+            return
+        for path in self.dir.iterdir():
+            if path.name.startswith("shard-") or path == self.done_log:
+                path.unlink(missing_ok=True)
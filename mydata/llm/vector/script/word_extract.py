@@ -0,0 +1,208 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+word_extract.py
+.docx / .rtf の直接テキスト抽出（LibreOffice → PDF → PyPDF2 の往復なし）
+- .docx: word/document.xml を iterparse でストリーム解析
+  改ページ（明示改ページ・Word保存時の描画改ページ）をページ区切りとして保持
+- .rtf: 純Python の制御語パーサ（\\page をページ区切りとして保持）
+いずれもページごとのテキストのリストを返す（make_word.save_text で <<page:N>> 付与）
+"""
+
+import re
+import zipfile
+import xml.etree.ElementTree as ET
+from pathlib import Path
+from typing import List
+
+# ====== 1. DOCX ======
+W_NS = "{http://schemas.openxmlformats.org/wordprocessingml/2006/main}"
+W_T = W_NS + "t"
+W_TAB = W_NS + "tab"
+W_BR = W_NS + "br"
+W_CR = W_NS + "cr"
+W_P = W_NS + "p"
+W_RENDERED_BREAK = W_NS + "lastRenderedPageBreak"
+W_TYPE = W_NS + "type"
+
+def extract_docx_pages(path: Path) -> List[str]:
+    """
+    word/document.xml を段落単位でストリーム処理
+    ※明示改ページの直後に描画改ページが続く場合など、空ページは作らない
+    """
+    pages: List[str] = []
+    lines: List[str] = []
+    para: List[str] = []
+
+    def page_break():
+        if para:
+            lines.append("".join(para))
+            para.clear()
+        if any(line.strip() for line in lines):
+            pages.append("\n".join(lines))
+            lines.clear()
+
+    with zipfile.ZipFile(path) as zf, zf.open("word/document.xml") as xml:
+        for _, elem in ET.iterparse(xml, events=("end",)):
+            tag = elem.tag
+            if tag == W_T:
+                para.append(elem.text or "")
+            elif tag == W_TAB:
+                para.append("\t")
+            elif tag == W_BR:
+                if elem.get(W_TYPE) == "page":
+                    page_break()
+                else:
+                    para.append("\n")
+            elif tag == W_CR:
+                para.append("\n")
+            elif tag == W_RENDERED_BREAK:
+                page_break()
+            elif tag == W_P:
+                lines.append("".join(para))
+                para.clear()
+                elem.clear()  # ✅ 処理済み段落を解放（メモリ一定）
+
+    page_break()
+    return pages
+
+# ====== 2. RTF ======
+RTF_TOKEN = re.compile(
+    r"\\([a-z]{1,32})(-?\d{1,10})?[ ]?|\\'([0-9a-f]{2})|\\([^a-z])|([{}])|[\r\n]+|(.)",
+    re.IGNORECASE | re.DOTALL,
+)
+
+# 本文として出力しないグループ（ヘッダー・フッター・脚注・フィールド命令等も除外）
+RTF_DESTINATIONS = frozenset((
+    "fonttbl", "colortbl", "stylesheet", "info", "pict", "object", "themedata",
+    "colorschememapping", "datastore", "latentstyles", "rsidtbl", "listtable",
+    "listoverridetable", "generator", "xmlnstbl", "header", "headerl", "headerr",
+    "headerf", "footer", "footerl", "footerr", "footerf", "footnote", "fldinst",
+    "mmathPr", "pgdsctbl", "revtbl", "filetbl", "bkmkstart", "bkmkend", "xe", "tc",
+    "shppict", "nonshppict", "blipuid", "falt", "panose", "leveltext",
+    "levelnumbers", "wgrffmtfilter", "template", "userprops", "docvar",
+    "private", "annotation", "atnid", "atnauthor",
+))
+
+RTF_SPECIAL = {
+    "par": "\n", "sect": "\n", "line": "\n", "row": "\n", "cell": "\t",
+    "tab": "\t", "emdash": "\u2014", "endash": "\u2013", "emspace": "\u2003",
+    "enspace": "\u2002", "qmspace": "\u2005", "bullet": "\u2022",
+    "lquote": "\u2018", "rquote": "\u2019", "ldblquote": "\u201c", "rdblquote": "\u201d",
+}
+
+# \fcharset → コードページ（日本語文書は Shift_JIS フォント指定が多い）
+RTF_CHARSET_CP = {128: "cp932", 129: "cp949", 134: "gbk", 136: "big5"}
+
+def extract_rtf_pages(path: Path) -> List[str]:
+    # RTFは7bitテキストが原則。生の8bitバイトはlatin-1で1文字=1バイトとして扱う
+    data = path.read_bytes().decode("latin-1")
+
+    pages: List[str] = []
+    out: List[str] = []
+    pending = bytearray()  # \'hh の連続（マルチバイト文字）をまとめてデコード
+
+    stack = []
+    ignorable = False
+    in_fonttbl = False
+    ucskip = 1
+    curskip = 0
+    font = None
+    table_font = None
+    ansi_cp = "cp1252"
+    font_cp = {}
+
+    def flush_bytes():
+        if pending:
+            out.append(pending.decode(font_cp.get(font) or ansi_cp, errors="ignore"))
+            pending.clear()
+
+    def page_break():
+        flush_bytes()
+        text = "".join(out)
+        if text.strip():
+            pages.append(text)
+        out.clear()
+
+    for m in RTF_TOKEN.finditer(data):
+        word, arg, hexcode, char, brace, tchar = m.groups()
+        if hexcode is None and not (tchar and ord(tchar) >= 0x80):
+            flush_bytes()
+
+        if brace:
+            curskip = 0
+            if brace == "{":
+                stack.append((ucskip, ignorable, font, in_fonttbl))
+            elif stack:
+                ucskip, ignorable, font, in_fonttbl = stack.pop()
+        elif char:
+            curskip = 0
+            if char == "*":
+                ignorable = True
+            elif ignorable:
+                continue
+            elif char in "{}\\":
+                out.append(char)
+            elif char == "~":
+                out.append("\u00a0")
+            elif char == "_":
+                out.append("-")
+        elif word:
+            curskip = 0
+            if in_fonttbl:
+                # フォント表は出力しないが、フォント→コードページ対応だけ拾う
+                if word == "f" and arg is not None:
+                    table_font = arg
+                elif word == "fcharset" and arg is not None and table_font is not None:
+                    font_cp[table_font] = RTF_CHARSET_CP.get(int(arg))
+            if word in RTF_DESTINATIONS:
+                ignorable = True
+                in_fonttbl = in_fonttbl or word == "fonttbl"
+            elif ignorable:
+                continue
+            elif word == "ansicpg" and arg:
+                ansi_cp = f"cp{arg}"
+            elif word == "f" and arg is not None:
+                font = arg
+            elif word == "uc" and arg is not None:
+                ucskip = int(arg)
+            elif word == "u" and arg is not None:
+                code = int(arg)
+                if code < 0:
+                    code += 0x10000
+                out.append(chr(code))
+                curskip = ucskip  # 後続の代替表記を読み飛ばす
+            elif word == "page":
+                page_break()
+            elif word in RTF_SPECIAL:
+                out.append(RTF_SPECIAL[word])
+        elif hexcode:
+            if curskip > 0:
+                curskip -= 1
+            elif not ignorable:
+                pending.append(int(hexcode, 16))
+        elif tchar:
+            if curskip > 0:
+                curskip -= 1
+            elif ignorable:
+                continue
+            elif ord(tchar) >= 0x80:
+                pending.append(ord(tchar))
+            else:
+                out.append(tchar)
+
+    page_break()
+    return pages
+
+# ====== 3. 振り分け ======
+NATIVE_EXTRACTORS = {
+    ".docx": extract_docx_pages,
+    ".rtf": extract_rtf_pages,
+}
+
+def extract_native_pages(path: Path) -> List[str]:
+    """直接抽出に対応していない拡張子は ValueError"""
+    extractor = NATIVE_EXTRACTORS.get(path.suffix.lower())
+    if extractor is None:
+        raise ValueError(f"直接抽出非対応: {path.suffix}")
+    return extractor(path)